@@ -0,0 +1,317 @@
+"""
+Load benchmark: 1 to 1,000 MistBuddies against an in-process broker stand-in.
+
+The real supervisor and controllers run on a normal asyncio loop, wired to
+the simulation's InMemoryBroker (zero added latency) and scripted devices,
+so every number below is time spent in this code base rather than on the
+network. For each scale it measures
+
+  * control-message-to-relay latency: ONOFF published -> first relay ON
+  * light-check round trip: LightStateCache.lights_on() as a cycle sees it
+  * power_on: PowerReport.elapsed of every pulse (all _publish acknowledgements)
+  * publishes per second of CPU time, i.e. the publish rate one core sustains
+  * event loop lag: how late a 10 ms ticker wakes up
+
+With --shards it measures sharded throughput instead: the MistBuddies are
+split over 1, 2, 4, ... worker processes the way ShardedRunner splits them,
+every worker sends ONOFF to all of its controllers at the same moment, and
+the result is how many first pulses per second all shards complete
+together. Scaling is near linear as long as there is a free core per shard.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_load                      # print results
+    python -m benchmarks.bench_load --save               # write benchmarks/baseline.json
+    python -m benchmarks.bench_load --compare            # fail on regressions against it
+    python -m benchmarks.bench_load --shards 1 2 4       # sharded throughput
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.simulation import (FakeSnifferBuddy, FakeTasmota, InMemoryBroker, SimulatedConnection,
+                            Timeline, build_config)
+from src.sharding import shard_for
+from src.supervisor import MistBuddySupervisor
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+DEFAULT_SCALES = [1, 10, 100, 1000]
+# Latency metrics compared against the baseline (lower is better)
+COMPARED_METRICS = ["control_to_relay_ms", "light_check_rtt_ms", "power_on_ms", "loop_lag_ms"]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {"p50": at(0.50), "p95": at(0.95), "max": round(ordered[-1], 3)}
+
+
+async def _loop_lag(samples: List[float], interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append((loop.time() - start - interval) * 1000)
+
+
+async def run_scale(buddies: int, cycles: int, cycle_period: float, duration: int) -> Dict:
+    """Run ``buddies`` controllers for ``cycles`` cycles and collect the measurements."""
+    loop = asyncio.get_running_loop()
+    timeline = Timeline(loop.time)
+    broker = InMemoryBroker(loop, latency=0.0)
+    # No debounce and no stagger: every controller reacts at once, the worst-case burst
+    config = build_config(buddies, tents=max(1, buddies // 10), cycle_period=cycle_period, stagger=False,
+                          buddy_settings={"control_debounce": 0})
+    supervisor = MistBuddySupervisor(config, connection=SimulatedConnection(broker))
+    devices = SimulatedConnection(broker)
+    control = SimulatedConnection(broker)
+    for tent_settings in config.tents_settings.values():
+        FakeSnifferBuddy(devices, tent_settings.LightCheck.light_on_query_topic,
+                         tent_settings.LightCheck.light_on_response_topic, timeline, 0, 24)
+
+    light_rtt: List[float] = []
+    power_on: List[float] = []
+    first_relay: Dict[str, float] = {}
+    sent_at: Dict[str, float] = {}
+    device_owner: Dict[str, str] = {}
+
+    def time_lights_on(light_state):
+        query = light_state.lights_on
+
+        async def timed():
+            start = time.perf_counter()
+            try:
+                return await query()
+            finally:
+                light_rtt.append((time.perf_counter() - start) * 1000)
+
+        light_state.lights_on = timed
+
+    def on_cycle(controller, lights_on, report, skip_reason):
+        if report is not None:
+            power_on.append(report.elapsed * 1000)
+
+    for light_state in supervisor.light_states.values():
+        time_lights_on(light_state)
+    supervisor.context.on_cycle = on_cycle
+    for controller in supervisor.controllers.values():
+        for topic in controller.power_topics:
+            FakeTasmota(devices, topic, timeline)
+            device_owner[topic] = controller.control_topic
+
+    lag: List[float] = []
+    ticker = asyncio.create_task(_loop_lag(lag))
+    run = asyncio.create_task(supervisor.run())
+    await asyncio.sleep(0)
+
+    published_before = broker.published
+    cpu_start = time.process_time()
+    for controller in supervisor.controllers.values():
+        sent_at[controller.control_topic] = loop.time()
+        control.publish_nowait(controller.control_topic, str(duration), qos=0)
+    await asyncio.sleep(cycles * cycle_period)
+    cpu_seconds = time.process_time() - cpu_start
+    publishes = broker.published - published_before
+
+    supervisor.stop()
+    await run
+    ticker.cancel()
+
+    for event in timeline.events:
+        if event.kind == "relay_on":
+            owner = device_owner[event.source]
+            first_relay.setdefault(owner, event.time)
+    control_to_relay = [(first_relay[topic] - sent) * 1000 for topic, sent in sent_at.items() if topic in first_relay]
+
+    return {
+        "buddies": buddies,
+        "pulses": len(power_on),
+        "control_to_relay_ms": percentiles(control_to_relay),
+        "light_check_rtt_ms": percentiles(light_rtt),
+        "power_on_ms": percentiles(power_on),
+        "publishes": publishes,
+        "publishes_per_s": round(publishes / cpu_seconds, 1) if cpu_seconds > 0 else 0.0,
+        "loop_lag_ms": percentiles(lag),
+    }
+
+
+def run_benchmarks(scales: List[int], cycles: int, cycle_period: float, duration: int) -> Dict:
+    results = []
+    for buddies in scales:
+        result = asyncio.run(run_scale(buddies, cycles, cycle_period, duration))
+        results.append(result)
+        print(f"{buddies:>5} buddies: control->relay p95 {result['control_to_relay_ms']['p95']:.2f} ms, "
+              f"light check p95 {result['light_check_rtt_ms']['p95']:.2f} ms, "
+              f"power_on p95 {result['power_on_ms']['p95']:.2f} ms, "
+              f"{result['publishes_per_s']:.0f} publishes/s, "
+              f"loop lag max {result['loop_lag_ms']['max']:.2f} ms")
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cycles": cycles,
+        "cycle_period": cycle_period,
+        "results": results,
+    }
+
+
+async def run_shard(buddies: int, shards: int, index: int, duration: int, barrier) -> Dict:
+    """
+    Run shard ``index`` of ``buddies`` controllers and time one ONOFF burst:
+    from the moment all shards pass ``barrier`` until every controller of
+    this shard has finished its first cycle.
+    """
+    loop = asyncio.get_running_loop()
+    timeline = Timeline(loop.time)
+    broker = InMemoryBroker(loop, latency=0.0)
+    config = build_config(buddies, tents=max(1, buddies // 10), stagger=False, buddy_settings={"control_debounce": 0})
+    supervisor = MistBuddySupervisor(config, connection=SimulatedConnection(broker), shard=(index, shards))
+    devices = SimulatedConnection(broker)
+    control = SimulatedConnection(broker)
+    for tent_name, tent_settings in config.tents_settings.items():
+        if shard_for(tent_name, shards) == index:
+            FakeSnifferBuddy(devices, tent_settings.LightCheck.light_on_query_topic,
+                             tent_settings.LightCheck.light_on_response_topic, timeline, 0, 24)
+    controllers = list(supervisor.controllers.values())
+    for controller in controllers:
+        for topic in controller.power_topics:
+            FakeTasmota(devices, topic, timeline)
+
+    finished = loop.create_future()
+    cycles = 0
+
+    def on_cycle(controller, lights_on, report, skip_reason):
+        nonlocal cycles
+        cycles += 1
+        if cycles == len(controllers) and not finished.done():
+            finished.set_result(loop.time())
+
+    supervisor.context.on_cycle = on_cycle
+    run = asyncio.create_task(supervisor.run())
+    await asyncio.sleep(0)
+
+    barrier.wait() # every shard is built; start the burst together
+    start = loop.time()
+    cpu_start = time.process_time()
+    for controller in controllers:
+        control.publish_nowait(controller.control_topic, str(duration), qos=0)
+    end = await finished if controllers else start
+    cpu_seconds = time.process_time() - cpu_start
+
+    supervisor.stop()
+    await run
+    return {"index": index, "controllers": len(controllers), "seconds": end - start, "cpu_seconds": cpu_seconds}
+
+
+def _shard_process(buddies: int, shards: int, index: int, duration: int, barrier, results):
+    logging.basicConfig(level=logging.ERROR)
+    results.put(asyncio.run(run_shard(buddies, shards, index, duration, barrier)))
+
+
+def run_sharded(shard_counts: List[int], buddies: int, duration: int) -> Dict:
+    """Throughput of the same ONOFF burst split over each number of shards, one spawned process per shard."""
+    context = multiprocessing.get_context("spawn") # like ShardedRunner
+    results = []
+    for shards in shard_counts:
+        barrier = context.Barrier(shards)
+        reports = context.Queue()
+        processes = [context.Process(target=_shard_process, args=(buddies, shards, index, duration, barrier, reports))
+                     for index in range(shards)]
+        for process in processes:
+            process.start()
+        per_shard = sorted((reports.get() for _ in processes), key=lambda r: r["index"])
+        for process in processes:
+            process.join()
+        # The burst is done when the slowest shard is
+        seconds = max(r["seconds"] for r in per_shard)
+        result = {
+            "shards": shards,
+            "buddies": buddies,
+            "seconds": round(seconds, 4),
+            "pulses_per_s": round(buddies / seconds, 1) if seconds > 0 else 0.0,
+            "shard_controllers": [r["controllers"] for r in per_shard],
+            # The busiest shard's CPU time bounds the burst once every shard has a core of its own
+            "max_shard_cpu_s": round(max(r["cpu_seconds"] for r in per_shard), 4),
+        }
+        result["speedup"] = round(result["pulses_per_s"] / results[0]["pulses_per_s"], 2) if results else 1.0
+        results.append(result)
+        print(f"{shards:>3} shard(s): {buddies} first pulses in {seconds * 1000:.1f} ms, "
+              f"{result['pulses_per_s']:.0f} pulses/s, x{result['speedup']:.2f} "
+              f"busiest shard {result['max_shard_cpu_s'] * 1000:.1f} ms CPU "
+              f"(controllers per shard {result['shard_controllers']})")
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Metrics whose p95 grew by more than ``tolerance`` (a fraction) over the baseline."""
+    regressions = []
+    previous = {r["buddies"]: r for r in baseline["results"]}
+    for result in current["results"]:
+        base = previous.get(result["buddies"])
+        if base is None:
+            continue
+        for metric in COMPARED_METRICS:
+            now, before = result[metric]["p95"], base[metric]["p95"]
+            # Ignore sub-millisecond noise
+            if now > before * (1 + tolerance) and now - before > 1.0:
+                regressions.append(f"{result['buddies']} buddies: {metric} p95 {before:.2f} -> {now:.2f} ms")
+        if result["publishes_per_s"] < base["publishes_per_s"] * (1 - tolerance):
+            regressions.append(f"{result['buddies']} buddies: publishes_per_s {base['publishes_per_s']} -> {result['publishes_per_s']}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="MistBuddy load benchmark with an in-process broker stand-in")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Numbers of MistBuddies to run")
+    parser.add_argument("--cycles", type=int, default=2, help="Misting cycles per scale")
+    parser.add_argument("--period", type=float, default=2.0, help="Cycle period in seconds")
+    parser.add_argument("--duration", type=int, default=1, help="Pulse duration in seconds")
+    parser.add_argument("--save", action="store_true", help=f"Write the results to {BASELINE_PATH.name}")
+    parser.add_argument("--compare", action="store_true", help=f"Compare against {BASELINE_PATH.name}; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before a metric counts as regressed")
+    parser.add_argument("--shards", type=int, nargs="+", help="Measure sharded throughput for these numbers of shards instead")
+    parser.add_argument("--buddies", type=int, default=1000, help="MistBuddies split over the shards (with --shards)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    if args.shards:
+        if os.cpu_count() < max(args.shards):
+            print(f"Only {os.cpu_count()} CPU(s): shards beyond that share cores and cannot scale.")
+        run_sharded(args.shards, args.buddies, args.duration)
+        return 0
+    current = run_benchmarks(args.scales, args.cycles, args.period, args.duration)
+
+    status = 0
+    if args.compare:
+        if not BASELINE_PATH.exists():
+            print(f"No baseline at {BASELINE_PATH}. Run with --save first.")
+            return 1
+        regressions = compare(current, json.loads(BASELINE_PATH.read_text()), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        status = 1 if regressions else 0
+    if args.save:
+        BASELINE_PATH.write_text(json.dumps(current, indent=2) + "\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
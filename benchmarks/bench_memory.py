@@ -0,0 +1,103 @@
+"""
+Memory benchmark: bytes each MistBuddy controller costs once built and running.
+
+The supervisor is built for N MistBuddies on the simulation's in-process
+broker and its allocations are traced with tracemalloc at two points:
+
+  * idle: controllers built, subscribed and running, no ONOFF received yet
+  * misting: every controller switched on and waiting for its next pulse
+
+The config, broker and scripted devices are created before tracing starts,
+so the figures are what the supervisor and its controllers add, divided by
+N. Shared resources (connection, light state per tent, coordinator, PulseTime
+cache) are spread over all controllers and vanish at scale.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_memory                    # print results
+    python -m benchmarks.bench_memory --max-kb 4         # exit 1 if a controller costs more
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import sys
+import tracemalloc
+from typing import Dict, List, Optional
+
+from src.simulation import (FakeSnifferBuddy, FakeTasmota, InMemoryBroker, SimulatedConnection,
+                            Timeline, build_config)
+from src.supervisor import MistBuddySupervisor
+
+DEFAULT_SCALES = [100, 1000]
+
+
+def _traced_bytes() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+async def measure(buddies: int, duration: int = 10, cycle_period: float = 60.0) -> Dict:
+    """Per-controller bytes of ``buddies`` controllers, idle and misting."""
+    loop = asyncio.get_running_loop()
+    timeline = Timeline(loop.time)
+    broker = InMemoryBroker(loop, latency=0.0)
+    config = build_config(buddies, tents=max(1, buddies // 10), cycle_period=cycle_period,
+                          buddy_settings={"control_debounce": 0})
+    connection = SimulatedConnection(broker)
+    devices = SimulatedConnection(broker)
+    control = SimulatedConnection(broker)
+    for tent_settings in config.tents_settings.values():
+        FakeSnifferBuddy(devices, tent_settings.LightCheck.light_on_query_topic,
+                         tent_settings.LightCheck.light_on_response_topic, timeline, 0, 24)
+        for mb_settings in tent_settings.MistBuddies.values():
+            for topic in mb_settings.mqtt_power_topics:
+                FakeTasmota(devices, topic, timeline)
+
+    tracemalloc.start()
+    try:
+        before = _traced_bytes()
+        supervisor = MistBuddySupervisor(config, connection=connection)
+        run = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.1)
+        idle = _traced_bytes() - before
+
+        for tent_settings in config.tents_settings.values():
+            for mb_settings in tent_settings.MistBuddies.values():
+                control.publish_nowait(mb_settings.mqtt_onoff_topic, str(duration), qos=0)
+        await asyncio.sleep(0.5)
+        misting = sum(controller.is_misting() for controller in supervisor.controllers.values())
+        misting_bytes = _traced_bytes() - before
+    finally:
+        tracemalloc.stop()
+
+    supervisor.stop()
+    await run
+    return {
+        "buddies": buddies,
+        "misting": misting,
+        "idle_bytes": round(idle / buddies),
+        "misting_bytes": round(misting_bytes / buddies),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Per-controller memory of MistBuddy controllers")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Numbers of MistBuddies to run")
+    parser.add_argument("--max-kb", type=float, help="Exit 1 if a misting controller costs more than this many KB")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    status = 0
+    for buddies in args.scales:
+        result = asyncio.run(measure(buddies))
+        print(f"{buddies:>5} buddies: {result['idle_bytes'] / 1024:.2f} KB per controller idle, "
+              f"{result['misting_bytes'] / 1024:.2f} KB misting ({result['misting']} misting)")
+        if args.max_kb is not None and result["misting_bytes"] > args.max_kb * 1024:
+            print(f"OVER BUDGET {buddies} buddies: {result['misting_bytes'] / 1024:.2f} KB > {args.max_kb} KB")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,22 @@
+import time
+# Startup phases are timed from here
+_LAUNCHED = time.perf_counter()
+
+import argparse
 import asyncio
 import logging
 import sys
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-# Correct the import statement to use the updated AppConfig model
-from src.appconfig import AppConfig, LightCheckSettings, MistBuddyDeviceSettings
-# Import the new class location
-from src.mistbuddy_simple import MistBuddySimple
 # Import the logger setup function (ensure this path is correct)
-from src.logger_setup import logger_setup
+from src.logger_setup import logger_setup, stop_queued_logging
+from src.startup import StartupTimer
+# The config models (and pydantic) are imported when the config is loaded,
+# the controller modules (and paho) by the mode that needs them
+if TYPE_CHECKING:
+    from src.appconfig import AppConfig
 
-# Setup root logger using the configuration from logger_setup
-# This ensures logging format is applied application-wide
-logger_setup('') # Setup root logger
 logger = logging.getLogger(__name__) # Get logger for this specific module
 
 def get_config_path() -> Path:
@@ -26,50 +29,121 @@ def get_config_path() -> Path:
     config_dir.mkdir(parents=True, exist_ok=True)
     return config_dir / "appconfig.yaml"
 
-def main():
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Simple MQTT Mist Controller with Light Check")
+    parser.add_argument("--tent", help="Run only this tent's MistBuddy (requires --mistbuddy)")
+    parser.add_argument("--mistbuddy", help="Run only this MistBuddy (requires --tent)")
+    parser.add_argument("--sync-logging", action="store_true",
+                        help="Format and write log records on the calling thread instead of a background listener")
+    parser.add_argument("--no-config-cache", action="store_true",
+                        help="Always parse and validate the YAML config instead of using the validated-config cache")
+    parser.add_argument("--shards", type=int,
+                        help="Split the tents over this many worker processes (overrides supervisor_settings.shards)")
+    args = parser.parse_args(argv)
+    if bool(args.tent) != bool(args.mistbuddy):
+        parser.error("--tent and --mistbuddy must be given together")
+    if args.shards is not None and args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.shards is not None and args.tent:
+        parser.error("--shards runs all tents and cannot be combined with --tent/--mistbuddy")
+    return args
+
+def build_single_buddy(config: "AppConfig", tent_name: str, mistbuddy_id: str, connection=None):
+    """The MistBuddySimple of one tent/MistBuddy entry (--tent/--mistbuddy), on its own connection unless one is given."""
+    # --- Extract settings from the nested config ---
+    if tent_name not in config.tents_settings:
+        raise KeyError(f"Tent '{tent_name}' not found in configuration.")
+    tent_settings = config.tents_settings[tent_name] # Get settings for the whole tent
+
+    if mistbuddy_id not in tent_settings.MistBuddies:
+        raise KeyError(f"MistBuddy '{mistbuddy_id}' not found under tent '{tent_name}'.")
+    mb_settings = tent_settings.MistBuddies[mistbuddy_id] # Get specific MB settings
+
+    # Get required parameters
+    broker_ip_val: str = config.mqtt_broker_ip # Use the property to get the string IP
+    control_topic_val: str = mb_settings.mqtt_onoff_topic
+    power_topics_val: list[str] = mb_settings.mqtt_power_topics
+    light_check_settings_obj = tent_settings.LightCheck # Get the LightCheck object for the tent
+
+    logger.info(f"Creating SimpleMistBuddy instance for {tent_name}/{mistbuddy_id}")
+    from src.mistbuddy_simple import MistBuddySimple
+    # --- Instantiate MistBuddySimple with ALL required parameters ---
+    return MistBuddySimple(
+        broker_ip=broker_ip_val,
+        control_topic=control_topic_val,
+        power_topics=power_topics_val,
+        light_check_settings=light_check_settings_obj, # Pass the full LightCheckSettings object
+        connection=connection,
+        use_backlog=mb_settings.use_backlog,
+        parallel_power=mb_settings.parallel_power,
+        cycle_period=mb_settings.cycle_period,
+        cycle_phase=mb_settings.cycle_phase,
+        deadline_grace=mb_settings.deadline_grace,
+        control_debounce=mb_settings.control_debounce,
+        cache_pulsetime=mb_settings.cache_pulsetime,
+        transport=config.supervisor_settings.mqtt_transport,
+        offline_queue_size=config.supervisor_settings.offline_queue_size,
+    )
+
+def main(argv: Optional[list[str]] = None):
     """Entry point - Load config, create instance(s), run application."""
-    config: Optional[AppConfig] = None
+    config: Optional["AppConfig"] = None
     config_path: Optional[Path] = None # Define config_path here for broader scope
+    startup = StartupTimer(_LAUNCHED)
+    startup.mark("imports")
+    args = parse_args(argv)
+    # Setup root logger using the configuration from logger_setup.
+    # By default a background listener formats and writes the records, so
+    # logging adds no I/O to the event loop or the paho thread.
+    logger_setup('', queued=not args.sync_logging)
+    startup.mark("logging")
 
     try:
 
         config_path = get_config_path()
         logger.info(f"Attempting to load configuration from user config: {config_path}")
 
-        # Load config using the class method from src.appconfig
-        config = AppConfig.from_yaml(config_path)
+        # Load config, from the validated-config cache while the file is unchanged.
+        # The config models are pydantic models, so importing them is part of this phase.
+        if args.no_config_cache:
+            from src.appconfig import AppConfig
+            config = AppConfig.from_yaml(config_path)
+        else:
+            from src.config_cache import load_config
+            config, _ = load_config(config_path)
         logger.info("Configuration loaded successfully.")
-
-        # --- Decide which MistBuddy to run ---
-        # TODO: Modify this logic to run multiple instances or use CLI args
-        tent_name = 'tent_one'
-        mistbuddy_id = 'mistbuddy_1'
+        startup.mark("config")
+
+        # --- Sharded mode: the tents split over worker processes, each running a supervisor ---
+        shards = args.shards or config.supervisor_settings.shards
+        if not args.tent and shards > 1:
+            from src.sharding import ShardedRunner
+            runner = ShardedRunner(config, shards, config_path=config_path, queued_logging=not args.sync_logging)
+            logger.info(f"Starting {shards} shard worker processes.")
+            asyncio.run(runner.run())
+            return
+
+        # --- Supervisor mode: every configured MistBuddy on one loop and one connection ---
+        if not args.tent:
+            from src.supervisor import MistBuddySupervisor
+            supervisor = MistBuddySupervisor(config, config_path=config_path)
+            startup.mark("controllers_built")
+            # The MQTT handshake runs in the background; controllers start without waiting for it
+            supervisor.startup_timer = startup
+            startup.watch_connection(supervisor.connection)
+            logger.info("Starting supervisor run loop for all configured MistBuddies.")
+            asyncio.run(supervisor.run())
+            return
+
+        # --- Single mode: only the MistBuddy selected on the command line ---
+        tent_name = args.tent
+        mistbuddy_id = args.mistbuddy
         logger.info(f"Targeting MistBuddy '{mistbuddy_id}' in tent '{tent_name}'.")
+        buddy = build_single_buddy(config, tent_name, mistbuddy_id)
 
-        # --- Extract settings from the nested config ---
-        if tent_name not in config.tents_settings:
-            raise KeyError(f"Tent '{tent_name}' not found in configuration.")
-        tent_settings = config.tents_settings[tent_name] # Get settings for the whole tent
-
-        if mistbuddy_id not in tent_settings.MistBuddies:
-            raise KeyError(f"MistBuddy '{mistbuddy_id}' not found under tent '{tent_name}'.")
-        mb_settings: MistBuddyDeviceSettings = tent_settings.MistBuddies[mistbuddy_id] # Get specific MB settings
-
-        # Get required parameters
-        broker_ip_val: str = config.mqtt_broker_ip # Use the property to get the string IP
-        control_topic_val: str = mb_settings.mqtt_onoff_topic
-        power_topics_val: list[str] = mb_settings.mqtt_power_topics
-        light_check_settings_obj: LightCheckSettings = tent_settings.LightCheck # Get the LightCheck object for the tent
-
-        logger.info(f"Creating SimpleMistBuddy instance for {tent_name}/{mistbuddy_id}")
-        # --- Instantiate MistBuddySimple with ALL required parameters ---
-        buddy = MistBuddySimple(
-            broker_ip=broker_ip_val,
-            control_topic=control_topic_val,
-            power_topics=power_topics_val,
-            light_check_settings=light_check_settings_obj # Pass the full LightCheckSettings object
-        )
-
+        startup.mark("controllers_built")
+        startup.watch_connection(buddy.connection)
         logger.info(f"Successfully initialized MistBuddy '{mistbuddy_id}' in tent '{tent_name}'. Starting run loop.")
         # Now run the application's async part
         asyncio.run(buddy.run())
@@ -92,6 +166,7 @@ def main():
         sys.exit(1) # Exit on other critical errors
     finally:
         logger.info("Application finished.")
+        stop_queued_logging() # Flush what the listener has not written yet
 
 
 if __name__ == "__main__":
@@ -1,6 +1,5 @@
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Literal, Optional, Any
 from pydantic import BaseModel, Field, IPvAnyAddress, field_validator, ValidationInfo, ValidationError
-import yaml
 from pathlib import Path
 import logging
 
@@ -17,6 +16,22 @@ class MistBuddyDeviceSettings(BaseModel):
     """MQTT topics specific to a MistBuddy device within a tent."""
     mqtt_onoff_topic: str = Field(..., description="Topic to turn misting cycle ON/OFF")
     mqtt_power_topics: List[str] = Field(..., description="List of Tasmota POWER topics for mister/fan")
+    use_backlog: bool = Field(False, description="Send PulseTime and POWER ON as one Tasmota Backlog command per device")
+    parallel_power: bool = Field(False, description="Issue power commands to all devices at once instead of one after the other")
+    cycle_period: float = Field(60.0, gt=0, description="Seconds between the start of one misting pulse and the next")
+    control_debounce: float = Field(0.25, ge=0, description="Seconds a burst of ONOFF messages is collected before only the latest is applied")
+    cache_pulsetime: bool = Field(True, description="Send only POWER ON to devices already holding the needed PulseTime")
+    cycle_phase: Optional[float] = Field(None, ge=0, description="Seconds into each wall-clock period at which pulses fire; unset starts the first pulse immediately")
+    deadline_grace: float = Field(1.0, ge=0, description="Seconds a pulse may start after its deadline (e.g. after the loop stalled) before that deadline is skipped as missed")
+
+    @field_validator('cycle_phase')
+    @classmethod
+    def check_phase_within_period(cls, v: Optional[float], info: ValidationInfo) -> Optional[float]:
+        """Check that the phase falls inside the cycle period."""
+        period = info.data.get('cycle_period')
+        if v is not None and period is not None and v >= period:
+            raise ValueError(f"Field '{info.field_name}' ({v}) must be less than cycle_period ({period})")
+        return v
 
 class LightCheckSettings(BaseModel):
     """Settings for actively querying light status from a designated device using Mem1."""
@@ -24,6 +39,9 @@ class LightCheckSettings(BaseModel):
     light_on_response_topic: str = Field(..., description="Topic to listen on for the status RESULT/STATE response")
     light_on_value: Any = Field(..., description="The value indicating lights are ON (e.g., 1, '1')")
     response_timeout: float = Field(..., gt=0, description="Timeout in seconds (>0) to wait for the response")
+    cache_ttl: float = Field(0.0, ge=0, description="Seconds a light state is reused by the tent's MistBuddies before querying again (0 queries every cycle)")
+    light_on_telemetry_topic: Optional[str] = Field(None, description="Periodic telemetry topic of the checker device carrying Mem1; when set the light state is pushed instead of queried")
+    max_age: float = Field(330.0, gt=0, description="With a telemetry topic, seconds a pushed light state stays valid before falling back to an active query")
 
     @field_validator('light_on_value')
     @classmethod
@@ -42,12 +60,40 @@ class TentSettings(BaseModel):
     """Configuration for devices within a single tent."""
     MistBuddies: Dict[str, MistBuddyDeviceSettings] = Field(..., description="Dictionary of MistBuddy configurations within the tent, keyed by a unique name/ID")
     LightCheck: LightCheckSettings = Field(..., description="Settings for querying light status")
+    phase_offset: float = Field(0.0, ge=0, description="Seconds added to the staggered pulse phase of this tent's MistBuddies")
+
+class SupervisorSettings(BaseModel):
+    """Settings for running all MistBuddies together in one process."""
+    stagger_pulses: bool = Field(False, description="Spread the pulses of all MistBuddies evenly over the cycle period")
+    max_concurrent_pulses: Optional[int] = Field(None, gt=0, description="Maximum number of pulses running at the same time (unset for no limit)")
+    mqtt_transport: Literal["thread", "asyncio"] = Field("thread", description="MQTT backend: paho's network thread, or the socket driven directly by the asyncio loop")
+    offline_queue_size: int = Field(256, ge=0, description="Topics whose latest command is kept while the broker is unreachable (0 disables queueing)")
+    metrics_port: Optional[int] = Field(None, ge=0, le=65535, description="Serve Prometheus metrics over HTTP on this port (unset to disable)")
+    metrics_host: str = Field("127.0.0.1", description="Address the metrics endpoint listens on")
+    stats_topic: Optional[str] = Field(None, description="Publish a retained JSON metrics snapshot to this MQTT topic (unset to disable)")
+    stats_interval: float = Field(60.0, gt=0, description="Seconds between metrics snapshots on stats_topic")
+    watchdog_threshold: Optional[float] = Field(None, gt=0, description="Report the loop thread's stack when one callback blocks the event loop longer than this many seconds (unset to disable)")
+    watchdog_file: Optional[str] = Field(None, description="Append loop watchdog reports as JSON lines to this file")
+    watchdog_topic: Optional[str] = Field(None, description="Publish loop watchdog reports to this MQTT topic")
+    watchdog_min_interval: float = Field(60.0, ge=0, description="Minimum seconds between two loop watchdog reports")
+    config_reload_interval: float = Field(5.0, ge=0, description="Seconds between checks of the config file for changes, applied without a restart (0 disables hot reload)")
+    restore_state: bool = Field(True, description="Journal each MistBuddy's misting duration and phase, and resume them after a restart")
+    state_journal: Optional[str] = Field(None, description="Path of the state journal (defaults to mistbuddy-state.jsonl next to the config file)")
+    trace_capacity: int = Field(0, ge=0, description="Keep a span tree of the last N misting cycles and commands in memory (0 disables tracing)")
+    trace_file: Optional[str] = Field(None, description="Also append every trace as a JSON line to this file")
+    trace_file_max_bytes: int = Field(1_000_000, ge=0, description="Rotate trace_file once it grows past this size (0 never rotates)")
+    trace_query_topic: Optional[str] = Field(None, description="Answer trace queries (a JSON object of filters) received on this MQTT topic")
+    trace_response_topic: Optional[str] = Field(None, description="Topic the trace query answers go to (defaults to <trace_query_topic>/result)")
+    shards: int = Field(1, ge=1, description="Worker processes the tents are split across, each with its own event loop and MQTT connection (1 runs everything in this process)")
+    shard_report_interval: float = Field(5.0, gt=0, description="Seconds between the metrics reports (and heartbeats) a shard worker sends to the parent process")
+    shard_heartbeat_timeout: float = Field(30.0, gt=0, description="Restart a shard worker that has not reported for this many seconds")
 
 class AppConfig(BaseModel):
     """Main application configuration model, matching appconfig.yaml structure."""
     # These are the correct top-level fields based on appconfig.yaml
     growbase_settings: GrowbaseSettings
     tents_settings: Dict[str, TentSettings] = Field(..., description="Configuration for each tent, keyed by tent name")
+    supervisor_settings: SupervisorSettings = Field(default_factory=SupervisorSettings, description="Settings for running all MistBuddies in one process")
 
     # --- Convenience Properties/Methods ---
 
@@ -92,6 +138,7 @@ class AppConfig(BaseModel):
             raise FileNotFoundError(f"Configuration file not found: {file_path}")
 
         logger.info(f"Loading configuration from: {file_path}")
+        import yaml # Deferred: a start from the config cache (src/config_cache.py) never needs it
         try:
             with open(file_path, 'r') as file:
                 config_data = yaml.safe_load(file)
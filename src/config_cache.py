@@ -0,0 +1,87 @@
+"""
+Validated-config cache for fast starts.
+
+Parsing the YAML and validating it from Python objects is the slow part of
+loading the configuration (and the only reason to import yaml at all). After
+a successful load the validated config is written next to the YAML file as
+compact JSON, keyed by the file's mtime, size and SHA-256 and by the
+appconfig module itself. While that key still matches, the next start
+validates the cached JSON with pydantic's native JSON parser instead.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from src import appconfig
+from src.appconfig import AppConfig
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+
+def default_cache_path(config_path: Path) -> Path:
+    return config_path.with_name(f".{config_path.name}.cache.json")
+
+
+def _cache_key(config_path: Path, content: bytes) -> Dict[str, object]:
+    stat = config_path.stat()
+    # A changed config model invalidates the cache as well
+    schema_stat = os.stat(appconfig.__file__)
+    return {
+        "version": CACHE_VERSION,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "schema": [schema_stat.st_mtime_ns, schema_stat.st_size],
+    }
+
+
+def load_config(config_path: Path | str, cache_path: Optional[Path | str] = None) -> Tuple[AppConfig, bool]:
+    """
+    Load the configuration, from the cache when it is current.
+
+    Returns the config and whether it came from the cache. Errors are those
+    of AppConfig.from_yaml; a missing, stale or unreadable cache only means
+    the YAML is loaded and the cache rewritten.
+    """
+    config_path = Path(config_path)
+    cache_path = Path(cache_path) if cache_path is not None else default_cache_path(config_path)
+    try:
+        content = config_path.read_bytes()
+    except FileNotFoundError:
+        logger.error(f"Configuration file not found at: {config_path}")
+        raise
+    key = _cache_key(config_path, content)
+
+    try:
+        with open(cache_path, "r") as f:
+            key_line, config_json = f.read().split("\n", 1)
+        if json.loads(key_line) == key:
+            config = AppConfig.model_validate_json(config_json)
+            logger.info(f"Configuration loaded from cache {cache_path}")
+            return config, True
+        logger.debug(f"Config cache {cache_path} is stale")
+    except FileNotFoundError:
+        pass
+    except ValueError as e: # covers JSON and pydantic validation errors
+        logger.warning(f"Ignoring unreadable config cache {cache_path}: {e}")
+
+    config = AppConfig.from_yaml(config_path)
+    _write_cache(cache_path, key, config)
+    return config, False
+
+
+def _write_cache(cache_path: Path, key: Dict[str, object], config: AppConfig):
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(key) + "\n")
+            f.write(config.model_dump_json(exclude_defaults=True))
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write config cache {cache_path}: {e}")
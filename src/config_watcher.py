@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+
+from src.appconfig import AppConfig
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+
+class ConfigWatcher:
+    """
+    Polls the config file and hands every valid new version to ``on_change``.
+
+    The file is checked every ``interval`` seconds; a change of its
+    modification time or size triggers a reload through AppConfig.from_yaml.
+    A file that fails to load or validate is logged and ignored, so the
+    running configuration stays in place until the file is fixed. Runs on
+    the event loop.
+    """
+
+    def __init__(self, path: Path | str, on_change: Callable[[AppConfig], Awaitable[None]], interval: float = 5.0):
+        self.path = Path(path)
+        self.on_change = on_change
+        self.interval = interval
+        self._signature = self._stat()
+        self._task: Optional[asyncio.Task] = None
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Watching {self.path} for configuration changes every {self.interval}s")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def check(self) -> bool:
+        """Reload the file if it changed since the last check. Returns True if a new config was applied."""
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            config = AppConfig.from_yaml(self.path)
+        except (FileNotFoundError, ValueError) as e:
+            logger.error(f"Ignoring changed configuration in {self.path}: {e}. The running configuration stays in place.")
+            return False
+        logger.info(f"Configuration file {self.path} changed. Applying it.")
+        await self.on_change(config)
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Error applying changed configuration from {self.path}: {e}", exc_info=True)
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+from typing import Any, Optional
+
+from src import metrics
+from src import tracing
+from src.appconfig import LightCheckSettings
+from src.mqtt_connection import MqttConnection
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+# ASSUMPTION: the checker device reports the light state under the 'Mem1' key
+LIGHT_STATE_KEY = "Mem1"
+
+
+class LightStateCache:
+    """
+    Light state of one tent, shared by every MistBuddy in it.
+
+    The state is answered from the cache while it is younger than
+    ``cache_ttl``. Otherwise one Mem1 query is sent to the checker device and
+    every caller that asks while it is in flight waits on the same answer.
+    Any message on the response topic that carries Mem1, solicited or not,
+    refreshes the cache.
+
+    With ``light_on_telemetry_topic`` set, the checker device's periodic
+    telemetry keeps the cache current and a pushed state is trusted for
+    ``max_age`` seconds, so cycles read the light state locally and only
+    query when telemetry has gone stale.
+    """
+
+    def __init__(self, settings: LightCheckSettings, connection: MqttConnection, name: str = ""):
+        self.name = name or settings.light_on_query_topic
+        self.query_topic = settings.light_on_query_topic
+        self.response_topic = settings.light_on_response_topic
+        self.on_value = settings.light_on_value
+        self.timeout = settings.response_timeout
+        self.telemetry_topic = settings.light_on_telemetry_topic
+        # How old a cached state may be before an active query is needed
+        self.max_age = settings.max_age if self.telemetry_topic else settings.cache_ttl
+        self.connection = connection
+
+        self.lights_on_value: Optional[bool] = None
+        self.updated_at: Optional[float] = None # loop.time() of the last update
+        self._inflight: Optional[asyncio.Future] = None
+        self._query_task: Optional[asyncio.Task] = None # kept so the loop cannot drop it mid-query
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Why the last query was answered False without a response ("query_failed", "no_response"); None once one arrives
+        self.last_failure: Optional[str] = None
+
+        self.connection.subscribe(self.response_topic, self._on_response)
+        if self.telemetry_topic:
+            self.connection.subscribe(self.telemetry_topic, self._on_response)
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop):
+        """Bind to the event loop whose clock ages the cached state."""
+        self._loop = loop
+
+    def close(self):
+        """Stop listening on the response and telemetry topics and cancel a running query."""
+        if self._query_task is not None and not self._query_task.done():
+            self._query_task.cancel()
+        self.connection.unsubscribe(self.response_topic, self._on_response)
+        if self.telemetry_topic:
+            self.connection.unsubscribe(self.telemetry_topic, self._on_response)
+
+    def age(self) -> Optional[float]:
+        """Seconds since the light state was last updated, None if never."""
+        if self.updated_at is None or self._loop is None:
+            return None
+        return self._loop.time() - self.updated_at
+
+    def _interpret(self, value: Any) -> bool:
+        # Compare the received result with the configured 'on' value
+        return int(value) == int(self.on_value)
+
+    def _on_response(self, topic: str, payload_str: str):
+        """
+        Connection callback for the response and telemetry topics.
+        Runs on the event loop.
+        """
+        try:
+            data = json.loads(payload_str)
+        except json.JSONDecodeError:
+            logger.warning(f"Could not decode JSON from response topic {topic}: {payload_str}")
+            return
+        if not isinstance(data, dict) or LIGHT_STATE_KEY not in data:
+            # Other RESULT/STATE traffic from the checker device
+            logger.debug("Message on %s has no '%s' key. Ignoring.", topic, LIGHT_STATE_KEY)
+            return
+        try:
+            lights_on = self._interpret(data[LIGHT_STATE_KEY])
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Could not interpret light status '{data[LIGHT_STATE_KEY]}' on {topic} as integer: {e}")
+            return
+
+        self._record(lights_on)
+
+    def _record(self, lights_on: bool):
+        """Store a new light state and wake any caller waiting on the query. Runs on the loop."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        self.lights_on_value = lights_on
+        self.updated_at = self._loop.time()
+        self.last_failure = None
+        logger.debug("Light state for %s updated: %s", self.name, "ON" if lights_on else "OFF")
+        inflight = self._inflight
+        if inflight is not None and not inflight.done():
+            inflight.set_result(lights_on)
+
+    def cached(self) -> Optional[bool]:
+        """The cached state if it is no older than ``max_age``, else None."""
+        age = self.age()
+        if age is None or age > self.max_age:
+            return None
+        return self.lights_on_value
+
+    async def lights_on(self) -> bool:
+        """
+        Return True if the lights are ON.
+
+        False if the lights are OFF, the query times out or an error occurs;
+        ``last_failure`` tells a failed query apart from lights that are OFF.
+        """
+        self._loop = asyncio.get_running_loop()
+        cached = self.cached()
+        span = tracing.current_span()
+        if cached is not None:
+            logger.debug("Light state for %s served from cache: %s", self.name, "ON" if cached else "OFF")
+            if span is not None:
+                span.attrs["source"] = "cache"
+            return cached
+        if self.telemetry_topic:
+            logger.info("Pushed light state for %s is stale (age=%ss, max_age=%ss). Falling back to an active query.", self.name, self.age(), self.max_age)
+
+        if self._inflight is None or self._inflight.done():
+            self._inflight = self._loop.create_future()
+            # The query task inherits the current span, so its steps land in this caller's trace
+            self._query_task = self._loop.create_task(self._query(self._inflight))
+            source = "query"
+        else:
+            logger.debug("Joining in-flight light status query for %s", self.name)
+            source = "joined"
+        if span is not None:
+            span.attrs["source"] = source
+        # shield: one caller being cancelled must not cancel the shared query
+        return await asyncio.shield(self._inflight)
+
+    async def _query(self, inflight: asyncio.Future):
+        """Send one Mem1 query and resolve ``inflight`` with the answer (False on failure)."""
+        logger.info("Requesting light status check via topic: %s", self.query_topic)
+        # The response itself confirms delivery, so the PUBACK is not awaited first.
+        with tracing.span("light_query_publish", topic=self.query_topic) as span:
+            publish_future = self.connection.publish_nowait(self.query_topic, "", queue=False) # Payload usually ignored for Mem query; a stale answer is useless
+            if publish_future.done() and not publish_future.result():
+                logger.error(f"Failed to publish light status query command to {self.query_topic}.")
+                if span is not None:
+                    span.outcome = "failed"
+                self.last_failure = "query_failed"
+                if not inflight.done():
+                    inflight.set_result(False) # Assume lights OFF if we can't even ask
+                return
+        sent_at = self._loop.time()
+        try:
+            logger.debug("Waiting up to %ss for light status response on %s", self.timeout, self.response_topic)
+            with tracing.span("result_wait", topic=self.response_topic):
+                lights_on = await asyncio.wait_for(asyncio.shield(inflight), timeout=self.timeout)
+            metrics.LIGHT_CHECK_SECONDS.labels(self.name).observe(self._loop.time() - sent_at)
+            logger.info("Light status check result for %s: %s", self.name, "ON" if lights_on else "OFF")
+        except asyncio.TimeoutError:
+            metrics.LIGHT_CHECK_TIMEOUTS.labels(self.name).inc()
+            logger.warning("Timeout waiting for light status response on %s. Assuming lights OFF.", self.response_topic)
+            self.last_failure = "no_response"
+            if not inflight.done():
+                inflight.set_result(False)
+        except asyncio.CancelledError:
+            if not inflight.done():
+                inflight.set_result(False)
+            raise
@@ -1,7 +1,60 @@
+import atexit
 import logging
 import logging.config
+import logging.handlers
+import queue
+from typing import Optional
+
 from src.logging_config import LOGGING_CONFIG
 
-def logger_setup(name: str) -> logging.Logger:
+# The listener of the queued mode, None while logging is synchronous
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue as they are, leaving all formatting to the listener.
+
+    The stock QueueHandler formats the message on the caller's thread before
+    queueing it. Here the caller only pays for creating the record; the
+    message, arguments and traceback are formatted by the listener thread.
+    Arguments of a log call must therefore not be mutated afterwards (the
+    hot paths only pass strings and numbers).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def logger_setup(name: str, queued: bool = False) -> logging.Logger:
+    """
+    Configure logging from LOGGING_CONFIG and return the logger ``name``.
+
+    With ``queued`` the root logger's handlers are moved behind a queue: log
+    calls on the event loop or the paho thread only enqueue the record, and
+    a background listener thread formats it and does the console/file I/O.
+    """
+    global _listener
+    stop_queued_logging()
     logging.config.dictConfig(LOGGING_CONFIG)
-    return logging.getLogger(name)
\ No newline at end of file
+    if queued:
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        for handler in handlers:
+            root.removeHandler(handler)
+        root.addHandler(DeferredQueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+    return logging.getLogger(name)
+
+
+def stop_queued_logging():
+    """Write out every queued record and stop the listener thread (no-op when logging is synchronous)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_queued_logging)
@@ -0,0 +1,319 @@
+"""
+Counters, gauges and histograms for the MQTT round trips and misting cycles.
+
+Every metric is recorded from the event loop thread (paho's callbacks hand
+their work to the loop before anything is counted), so recording is a
+plain integer or float update with no lock. The registry can be served
+in Prometheus text format by MetricsServer and published as a retained
+JSON snapshot by StatsPublisher.
+"""
+import asyncio
+import json
+import logging
+import math
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+# Seconds; spans a LAN round trip up to the 5 s publish timeout
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile (0 when empty)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+class MetricFamily:
+    """One named metric, split into a child per combination of label values."""
+
+    def __init__(self, kind: str, name: str, help: str, labelnames: Tuple[str, ...], factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._factory = factory
+        self.children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """The metric for these label values, created on first use."""
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {values}")
+            child = self.children[values] = self._factory()
+        return child
+
+    def remove(self, *values: str):
+        """
+        Drop the metric for these label values, e.g. of a controller that is gone.
+        With fewer values than labels, every child starting with them is dropped.
+        """
+        if len(values) > len(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {values}")
+        if len(values) == len(self.labelnames):
+            self.children.pop(values, None)
+            return
+        for key in [key for key in self.children if key[:len(values)] == values]:
+            del self.children[key]
+
+    def _label_str(self, values: Tuple[str, ...], extra: Iterable[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in pairs)
+        return "{" + escaped + "}"
+
+
+class MetricsRegistry:
+    """All metric families of the process."""
+
+    def __init__(self):
+        self.families: Dict[str, MetricFamily] = {}
+
+    def _family(self, kind: str, name: str, help: str, labelnames: Sequence[str], factory) -> MetricFamily:
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = MetricFamily(kind, name, help, tuple(labelnames), factory)
+        return family
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._family("counter", name, help, labelnames, Counter)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._family("gauge", name, help, labelnames, Gauge)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> MetricFamily:
+        return self._family("histogram", name, help, labelnames, lambda: Histogram(buckets))
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for family in self.families.values():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in family.children.items():
+                if family.kind == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(child.buckets + (math.inf,), child.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else repr(bound)
+                        lines.append(f"{family.name}_bucket{family._label_str(values, [('le', le)])} {cumulative}")
+                    lines.append(f"{family.name}_sum{family._label_str(values)} {child.sum}")
+                    lines.append(f"{family.name}_count{family._label_str(values)} {child.count}")
+                else:
+                    lines.append(f"{family.name}{family._label_str(values)} {child.value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, object]:
+        """Compact JSON-friendly view: counters and gauges by value, histograms as count/avg/p50/p95."""
+        stats: Dict[str, object] = {}
+        for family in self.families.values():
+            for values, child in family.children.items():
+                key = family.name + family._label_str(values)
+                if family.kind == "histogram":
+                    stats[key] = {
+                        "count": child.count,
+                        "avg": round(child.sum / child.count, 6) if child.count else 0.0,
+                        "p50": child.quantile(0.5),
+                        "p95": child.quantile(0.95),
+                    }
+                else:
+                    stats[key] = child.value
+        return stats
+
+    def dump(self) -> Dict[str, Dict[str, object]]:
+        """Raw state of every metric as plain lists and numbers, to be merged into another registry (see merge)."""
+        dumped: Dict[str, Dict[str, object]] = {}
+        for family in self.families.values():
+            buckets = None
+            children = []
+            for values, child in family.children.items():
+                if family.kind == "histogram":
+                    buckets = list(child.buckets)
+                    children.append([list(values), [list(child.counts), child.sum, child.count]])
+                else:
+                    children.append([list(values), child.value])
+            dumped[family.name] = {
+                "kind": family.kind,
+                "help": family.help,
+                "labelnames": list(family.labelnames),
+                "buckets": buckets,
+                "children": children,
+            }
+        return dumped
+
+    def merge(self, dumped: Dict[str, Dict[str, object]], gauges: bool = True):
+        """
+        Add a dump of another registry to this one.
+
+        Counters and histograms are summed; a gauge keeps the larger of the
+        two values, or is left out when ``gauges`` is false.
+        """
+        for name, data in dumped.items():
+            kind = data["kind"]
+            if kind == "gauge" and not gauges:
+                continue
+            if kind == "histogram":
+                family = self.histogram(name, data["help"], data["labelnames"], data["buckets"] or DEFAULT_BUCKETS)
+            else:
+                family = self._family(kind, name, data["help"], data["labelnames"], Counter if kind == "counter" else Gauge)
+            for values, value in data["children"]:
+                values = tuple(values)
+                existing = values in family.children
+                child = family.labels(*values)
+                if kind == "histogram":
+                    counts, total, count = value
+                    child.counts = [a + b for a, b in zip(child.counts, counts)]
+                    child.sum += total
+                    child.count += count
+                elif kind == "counter":
+                    child.value += value
+                else:
+                    child.value = max(child.value, value) if existing else value
+
+
+# The process-wide registry and the metrics recorded by the controllers
+REGISTRY = MetricsRegistry()
+
+LIGHT_CHECK_SECONDS = REGISTRY.histogram(
+    "mistbuddy_light_check_seconds", "Round trip of a Mem1 light status query", ["tent"])
+LIGHT_CHECK_TIMEOUTS = REGISTRY.counter(
+    "mistbuddy_light_check_timeouts_total", "Light status queries that got no answer within response_timeout", ["tent"])
+PUBACK_SECONDS = REGISTRY.histogram(
+    "mistbuddy_puback_seconds", "Time from handing a QoS 1 publish to paho until its PUBACK")
+PUBLISH_TIMEOUTS = REGISTRY.counter(
+    "mistbuddy_publish_timeouts_total", "Publishes whose acknowledgement was not seen in time")
+MQTT_RECONNECTS = REGISTRY.counter(
+    "mistbuddy_mqtt_reconnects_total", "Times the MQTT connection came back after being lost")
+PULSES = REGISTRY.counter(
+    "mistbuddy_pulses_total", "Misting cycles by outcome (fired, skipped, failed)", ["controller", "outcome"])
+CYCLE_LATENESS_SECONDS = REGISTRY.histogram(
+    "mistbuddy_cycle_lateness_seconds", "How late a misting cycle started after its deadline", ["controller"])
+MISSED_DEADLINES = REGISTRY.counter(
+    "mistbuddy_missed_deadlines_total", "Cycle deadlines skipped because the loop was too far behind", ["controller"])
+STARTUP_SECONDS = REGISTRY.gauge(
+    "mistbuddy_startup_seconds", "Seconds from launch until each startup phase finished", ["phase"])
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "mistbuddy_loop_lag_seconds", "How late the loop watchdog's heartbeat ran")
+LOOP_STALLS = REGISTRY.counter(
+    "mistbuddy_loop_stalls_total", "Times one callback held the event loop longer than the watchdog threshold")
+
+
+class MetricsServer:
+    """Serves ``GET /metrics`` in Prometheus text format from the event loop."""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, host: str = "127.0.0.1", port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        sockets = self._server.sockets or []
+        if sockets:
+            self.port = sockets[0].getsockname()[1]
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            # Drain the headers; the request body is never needed
+            while (await asyncio.wait_for(reader.readline(), timeout=5.0)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+                status, body = "200 OK", self.registry.render_prometheus().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"Metrics request aborted: {e}")
+        finally:
+            writer.close()
+
+
+class StatsPublisher:
+    """Publishes a retained JSON snapshot of the registry to ``topic`` every ``interval`` seconds."""
+
+    def __init__(self, connection, topic: str, interval: float = 60.0, registry: MetricsRegistry = REGISTRY):
+        self.connection = connection
+        self.topic = topic
+        self.interval = interval
+        self.registry = registry
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def publish(self):
+        payload = json.dumps(self.registry.snapshot())
+        # A snapshot that cannot go out now is superseded by the next one
+        self.connection.publish_nowait(self.topic, payload, qos=0, retain=True, queue=False)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.publish()
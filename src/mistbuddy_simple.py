@@ -1,25 +1,147 @@
 import asyncio
-from paho.mqtt import client as mqtt
-from typing import List, Optional, Any
-import math
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 import logging # Use standard logging
-import json # Ensure json is imported
+import time
 # Import the specific config model needed
+from src import metrics
 from src.appconfig import LightCheckSettings
+from src.light_state import LightStateCache
+from src.mqtt_connection import MqttConnection, create_connection
+from src.scheduler import DeadlineScheduler, PulseCoordinator
+from src.state_journal import StateJournal
+from src import tasmota
+from src import tracing
 
 # Get a logger specific to this module
 logger = logging.getLogger(__name__) # Use module name for logger
 
+@dataclass
+class PowerReport:
+    """Outcome of one power command sent to all of a MistBuddy's devices."""
+    command: str                # "ON" or "OFF"
+    results: Dict[str, bool]    # power topic -> published and acknowledged
+    elapsed: float              # seconds from first send to last acknowledgement
+
+    @property
+    def succeeded(self) -> List[str]:
+        return [topic for topic, ok in self.results.items() if ok]
+
+    @property
+    def failed(self) -> List[str]:
+        return [topic for topic, ok in self.results.items() if not ok]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+class ControllerContext:
+    """
+    Resources shared by every controller on one connection.
+
+    A supervisor hands the same context to all of its controllers, so each
+    controller only holds its own topics, settings and misting state; the
+    connection, coordinator, PulseTime cache, tracer and journal (and the
+    references that keep command tasks alive) exist once.
+    """
+    __slots__ = ("connection", "coordinator", "pulsetime_cache", "tracer", "journal", "wall_clock", "on_cycle", "tasks")
+
+    def __init__(self,
+                 connection: MqttConnection,
+                 coordinator: Optional[PulseCoordinator] = None,
+                 pulsetime_cache: Optional[tasmota.PulseTimeCache] = None,
+                 tracer: Optional[tracing.Tracer] = None,
+                 journal: Optional[StateJournal] = None):
+        self.connection = connection
+        self.coordinator = coordinator
+        self.pulsetime_cache = pulsetime_cache
+        self.tracer = tracer
+        self.journal = journal
+        # Wall clock that cycle phases are aligned to (a simulation swaps in virtual time)
+        self.wall_clock: Callable[[], float] = time.time
+        # Optional observer called after every cycle with (controller, lights_on, report or None, skip reason or None)
+        self.on_cycle: Optional[Callable[["MistBuddySimple", bool, Optional[PowerReport], Optional[str]], None]] = None
+        # Command tasks of all controllers, referenced until they finish
+        self.tasks: set[asyncio.Task] = set()
+
+
 class MistBuddySimple:
+    # No per-instance __dict__: a supervisor may run thousands of controllers,
+    # each holding only its hot state (shared resources live in the context)
+    __slots__ = ("broker_ip", "control_topic", "power_topics", "use_backlog", "parallel_power",
+                 "cycle_period", "cycle_phase", "deadline_grace", "control_debounce", "cache_pulsetime",
+                 "initial_duration", "initial_phase", "context", "light_state",
+                 "misting_task", "loop", "schedule", "active_duration",
+                 "_pending_command", "_command_received_at", "_debounce_handle", "_command_lock",
+                 "_shutdown", "_owns_connection", "_owns_light_state")
+
     # __init__ now accepts specific config values + power topics
     def __init__(self,
                  broker_ip: str,
                  control_topic: str,
                  power_topics: List[str],
-                 light_check_settings: LightCheckSettings): # Use the explicit config settings object
+                 light_check_settings: LightCheckSettings, # Use the explicit config settings object
+                 connection: Optional[MqttConnection] = None,
+                 use_backlog: bool = False,
+                 parallel_power: bool = False,
+                 light_state: Optional[LightStateCache] = None,
+                 cycle_period: float = 60.0,
+                 cycle_phase: Optional[float] = None,
+                 deadline_grace: float = 1.0,
+                 coordinator: Optional[PulseCoordinator] = None,
+                 transport: str = "thread",
+                 offline_queue_size: int = 256,
+                 control_debounce: float = 0.25,
+                 pulsetime_cache: Optional[tasmota.PulseTimeCache] = None,
+                 cache_pulsetime: bool = True,
+                 tracer: Optional[tracing.Tracer] = None,
+                 initial_duration: Optional[int] = None,
+                 initial_phase: Optional[float] = None,
+                 journal: Optional[StateJournal] = None,
+                 context: Optional[ControllerContext] = None):
         """
         Initialize the MistBuddy controller.
+
+        When ``connection`` is given the controller shares it with other
+        controllers and leaves connecting and the network loop to its owner.
+        With ``use_backlog`` each pulse is sent as a single Tasmota Backlog
+        command instead of separate PulseTime and POWER messages, and with
+        ``parallel_power`` the commands for all devices are issued at once.
+        ``light_state`` is the tent's shared light state cache; a private one
+        is created from ``light_check_settings`` when it is not given.
+        A pulse is fired every ``cycle_period`` seconds, ``cycle_phase``
+        seconds into the period when set (see DeadlineScheduler); a deadline
+        missed by more than ``deadline_grace`` seconds is skipped. A shared
+        ``coordinator`` staggers the phase of controllers without an explicit
+        ``cycle_phase`` and limits how many pulses run at once. ``transport``
+        picks the MQTT backend ("thread" or "asyncio") and ``offline_queue_size``
+        the offline queue of a connection the controller creates for itself. ONOFF messages arriving within
+        ``control_debounce`` seconds of each other collapse to the latest one.
+        With ``cache_pulsetime`` a device already holding the needed PulseTime
+        only gets ``POWER ON``; ``pulsetime_cache`` is shared by all
+        controllers on a connection and created privately when not given.
+        With a ``tracer`` every misting cycle and ONOFF command is recorded as
+        a span tree (see src/tracing.py). ``initial_duration`` starts misting
+        as soon as run() starts, as if that ONOFF command had been received
+        (used when a controller is rebuilt on a config reload or restored
+        after a restart); its first cycle is aligned to ``initial_phase``
+        when no other phase applies. Each start and stop is recorded in
+        ``journal`` so a restart can pick the cycle up again.
+        The controllers of a supervisor share one ``context``; when it is
+        given, the connection, coordinator, PulseTime cache, tracer and
+        journal are taken from it, and passing any of them (or ``transport``
+        or ``offline_queue_size``) as well raises ValueError.
         """
+        if context is not None:
+            conflicting = [name for name, value in (("connection", connection), ("coordinator", coordinator),
+                                                    ("pulsetime_cache", pulsetime_cache), ("tracer", tracer),
+                                                    ("journal", journal)) if value is not None]
+            if transport != "thread":
+                conflicting.append("transport")
+            if offline_queue_size != 256:
+                conflicting.append("offline_queue_size")
+            if conflicting:
+                raise ValueError(f"{', '.join(conflicting)} cannot be given together with a shared context for {control_topic}")
         logger.info(f"Initializing MistBuddy:")
         logger.info(f"  Control Topic: {control_topic}")
         logger.info(f"  Broker IP: {broker_ip}")
@@ -31,12 +153,15 @@ class MistBuddySimple:
         self.broker_ip = broker_ip
         self.control_topic = control_topic
         self.power_topics = power_topics
-
-        # --- Store Light Check Configuration ---
-        self.light_query_cmd_topic = light_check_settings.light_on_query_topic
-        self.light_query_resp_topic = light_check_settings.light_on_response_topic
-        self.light_check_on_val = light_check_settings.light_on_value
-        self.light_check_timeout = light_check_settings.response_timeout
+        self.use_backlog = use_backlog
+        self.parallel_power = parallel_power
+        self.cycle_period = cycle_period
+        self.cycle_phase = cycle_phase
+        self.deadline_grace = deadline_grace
+        self.control_debounce = control_debounce
+        self.cache_pulsetime = cache_pulsetime
+        self.initial_duration = initial_duration
+        self.initial_phase = initial_phase
 
         # Validate power topics
         if not self.power_topics:
@@ -45,294 +170,344 @@ class MistBuddySimple:
         # Initialize state variables
         self.misting_task: Optional[asyncio.Task] = None
         self.loop: Optional[asyncio.AbstractEventLoop] = None
-        self.client: Optional[mqtt.Client] = None
-        # Initialize the Future placeholder
-        self.light_check_future: Optional[asyncio.Future] = None
-
-        # Setup the MQTT client instance
-        self._setup_mqtt_client()
-
-    def _setup_mqtt_client(self):
-        """Setup MQTT client - still in regular Python context."""
-        try:
-
-            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2) # Consider adding client_id
-            self.client.on_connect = self._on_connect
-            self.client.on_message = self._on_message
-            # Use the broker IP stored during __init__
-            broker_ip_str = str(self.broker_ip)
-            logger.info(f"Connecting to MQTT broker at {broker_ip_str}")
-            self.client.connect(broker_ip_str)
-
-        except Exception as e:
-            logger.error(f"Failed to setup or connect MQTT client for {self.control_topic}: {e}", exc_info=True)
-            raise ConnectionError(f"Failed to initialize MQTT connection for {self.control_topic}") from e
-
-    def _publish(self, topic: str, payload: str | int | float, qos: int = 1):
-        """Helper method to publish MQTT messages."""
-        if not self.client or not self.client.is_connected():
-            logger.error(f"MQTT client not connected ({self.control_topic}). Cannot publish to {topic}")
-            return False # Indicate failure
-        try:
-            # Convert payload to string if it's not already
-            if not isinstance(payload, str):
-                payload_str = str(payload)
-            else:
-                 payload_str = payload
-
-            logger.debug(f"Publishing to {topic} ({self.control_topic}): {payload_str}")
-            result = self.client.publish(topic, payload_str, qos=qos)
-            result.wait_for_publish(timeout=5.0) # Wait for publish confirmation (optional)
-            if result.rc != mqtt.MQTT_ERR_SUCCESS:
-                 logger.warning(f"Failed to publish to {topic} ({self.control_topic}). Return code: {result.rc}")
-                 return False
-            return True # Indicate success
-        except ValueError as e: # Catches timeout from wait_for_publish
-             logger.warning(f"Timeout waiting for publish confirmation to {topic} ({self.control_topic}): {e}")
-             return False
-        except Exception as e:
-            logger.error(f"Error publishing to {topic} ({self.control_topic}): {e}", exc_info=True)
-            return False
-
-
-    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        self.schedule: Optional[DeadlineScheduler] = None
+        # Control mailbox: latest ONOFF command waiting out the debounce window
+        self._pending_command: Optional[int] = None
+        self._command_received_at: Optional[float] = None # monotonic time the debounce window opened
+        self._debounce_handle: Optional[asyncio.TimerHandle] = None
+        # Serializes start/stop commands; created with the first command
+        self._command_lock: Optional[asyncio.Lock] = None
+        self.active_duration: Optional[float] = None
+        # Set by stop() to end run(); created in run() on the controller's loop
+        self._shutdown: Optional[asyncio.Event] = None
+
+        # Use the shared context or connection when one is supplied (supervisor
+        # mode), otherwise this controller owns and runs its own connection.
+        self._owns_connection = context is None and connection is None
+        if context is None:
+            if connection is None:
+                connection = create_connection(broker_ip, transport, offline_queue_size=offline_queue_size)
+                connection.connect()
+            # PulseTime last-value cache, kept honest by each device's RESULT/LWT topics
+            if cache_pulsetime and pulsetime_cache is None:
+                pulsetime_cache = tasmota.PulseTimeCache(connection)
+            context = ControllerContext(connection, coordinator, pulsetime_cache, tracer, journal)
+        self.context = context
+
+        # Register for the topics this controller handles
+        self.connection.subscribe(self.control_topic, self._on_control_topic)
+        self.connection.add_state_listener(self._on_connection_state)
+
+        # Light state is shared by all MistBuddies of a tent when supplied
+        self._owns_light_state = light_state is None
+        if light_state is None:
+            light_state = LightStateCache(light_check_settings, self.connection)
+        self.light_state = light_state
+
+        if self.pulsetime_cache is not None:
+            for topic in self.power_topics:
+                self.pulsetime_cache.watch(topic)
+
+    # --- Shared resources, held by the context ---
+    @property
+    def connection(self) -> MqttConnection:
+        return self.context.connection
+
+    @property
+    def coordinator(self) -> Optional[PulseCoordinator]:
+        return self.context.coordinator
+
+    @property
+    def pulsetime_cache(self) -> Optional[tasmota.PulseTimeCache]:
+        return self.context.pulsetime_cache if self.cache_pulsetime else None
+
+    @property
+    def tracer(self) -> Optional[tracing.Tracer]:
+        return self.context.tracer
+
+    @property
+    def journal(self) -> Optional[StateJournal]:
+        return self.context.journal
+
+    async def _publish(self, topic: str, payload: str | int | float, qos: int = 1, ttl: Optional[float] = None) -> bool:
         """
-        MQTT connect callback - subscribes to necessary topics upon connection.
-        Runs in the MQTT client's thread.
+        Helper method to publish MQTT messages and await the broker's acknowledgement.
+        ``ttl`` limits how long the message may wait in the offline queue.
         """
-        # Check if the connection was successful (reason_code 0)
-        if reason_code == 0:
-            logger.info(f"Successfully connected to MQTT broker {self.broker_ip} for {self.control_topic}.")
+        # Convert payload to string if it's not already
+        payload_str = payload if isinstance(payload, str) else str(payload)
+        logger.debug("Publishing to %s (%s): %s", topic, self.control_topic, payload_str)
+        with tracing.span(f"publish {topic.rsplit('/', 1)[-1]}", topic=topic, payload=payload_str) as span:
             try:
-                # Subscribe to the main control topic for this mistbuddy instance
-                client.subscribe(self.control_topic)
-                logger.info(f"Subscribed to control topic: {self.control_topic}")
-
-                # Subscribe to the light check response topic
-                client.subscribe(self.light_query_resp_topic)
-                logger.info(f"Subscribed to light check response topic: {self.light_query_resp_topic}")
-                # --- END SUBSCRIPTION ---
-
+                ok = await self.connection.publish_async(topic, payload_str, qos=qos, timeout=5.0, ttl=ttl)
             except Exception as e:
-                 # Log error if any subscription fails
-                 logger.error(f"Failed to subscribe to required topics ({self.control_topic}, {self.light_query_resp_topic}) during on_connect for {self.control_topic}: {e}", exc_info=True)
-                 # Optionally, consider how to handle failed subscriptions (e.g., prevent operation)
-        else:
-            # Log error if the initial connection failed
-            logger.error(f"Failed to connect MQTT for {self.control_topic}. Reason code: {reason_code}")
+                logger.error(f"Error publishing to {topic} ({self.control_topic}): {e}", exc_info=True)
+                ok = False
+            if span is not None and not ok:
+                span.outcome = "failed"
+            return ok
 
-    def _on_message(self, client, userdata, msg):
+    def _on_control_topic(self, topic: str, payload_str: str):
         """
-        MQTT message callback - Decodes payload and dispatches to specific handlers based on topic.
-        Runs in the MQTT client's thread.
+        Connection callback for the control topic.
+        Runs on the event loop.
         """
-        # Ensure the asyncio loop is available (needed by handlers via run_coroutine_threadsafe)
+        # Ensure run() has started, so the controller is ready to manage its cycle
         if self.loop is None:
-             logger.error(f"Event loop not available in _on_message ({self.control_topic}). Cannot process message for topic '{msg.topic}'.")
-             return
-
-        # 1. Decode Payload (handle potential errors)
-        try:
-            payload_str = msg.payload.decode('utf-8')
-            logger.debug(f"Received message on topic '{msg.topic}': {payload_str}")
-        except UnicodeDecodeError:
-            logger.warning(f"Could not decode payload on topic '{msg.topic}' as UTF-8.")
+            logger.error(f"Event loop not available ({self.control_topic}). Cannot process message for topic '{topic}'.")
             return
-        except Exception as e:
-            logger.error(f"Unexpected error decoding payload on topic '{msg.topic}': {e}", exc_info=True)
-            return
-
-        # 2. Dispatch based on Topic
-        try:
-            if msg.topic == self.control_topic:
-                self._handle_control_message(payload_str)
-            elif msg.topic == self.light_query_resp_topic:
-                self._handle_light_response(payload_str)
-            # else: # Optional: Log unhandled topics
-            #     logger.debug(f"Ignoring message on unhandled topic: {msg.topic}")
-        except Exception as e:
-            # Catch unexpected errors during handler execution
-            logger.error(f"Error processing message for topic '{msg.topic}' in handler: {e}", exc_info=True)
-
+        self._handle_control_message(payload_str)
 
     def _handle_control_message(self, payload_str: str):
-        """Handles incoming messages on the misting control topic."""
+        """
+        Handles incoming messages on the misting control topic.
+
+        Commands go into a one-slot mailbox: a burst of ONOFF messages within
+        ``control_debounce`` seconds collapses to the latest one.
+        """
         try:
             seconds = int(payload_str)
-            logger.debug(f"Processing control message for {self.control_topic}: {seconds} seconds")
+        except ValueError:
+             logger.warning(f"Invalid integer value received on control topic {self.control_topic}: '{payload_str}'")
+             return
+        logger.debug("Processing control message for %s: %s seconds", self.control_topic, seconds)
+        if self._pending_command is not None:
+            logger.debug("Control command %s for %s superseded by %s", self._pending_command, self.control_topic, seconds)
+        self._pending_command = seconds
+        if self._debounce_handle is None:
+            self._command_received_at = time.monotonic()
+            self._debounce_handle = self.loop.call_later(self.control_debounce, self._apply_pending_command)
+
+    def _apply_pending_command(self):
+        """Apply the latest command of the debounce window. Runs on the event loop."""
+        self._debounce_handle = None
+        seconds, self._pending_command = self._pending_command, None
+        received_at, self._command_received_at = self._command_received_at, None
+        if seconds is None:
+            return
+        try:
             if seconds > 0:
                 # Schedule start_misting (which will check lights)
-                asyncio.run_coroutine_threadsafe(self.start_misting(seconds), self.loop)
+                self._schedule(self._run_command(seconds, received_at))
                 logger.info(f"Scheduled misting START: duration={seconds}s for {self.control_topic}")
             else:
                 # Schedule stop_misting
-                asyncio.run_coroutine_threadsafe(self.stop_misting_async(), self.loop)
+                self._schedule(self._run_command(0, received_at))
                 logger.info(f"Scheduled misting STOP for {self.control_topic}")
-        except ValueError:
-             logger.warning(f"Invalid integer value received on control topic {self.control_topic}: '{payload_str}'")
         except Exception as e: # Catch errors during scheduling
              logger.error(f"Error scheduling task from control message ({self.control_topic}): {e}", exc_info=True)
 
-
-    def _handle_light_response(self, payload_str: str):
-        """Handles incoming messages on the light status response topic."""
-        logger.debug(f"Processing potential light status response on {self.light_query_resp_topic}")
-        # Check if we are actually waiting for this response via the Future
-        active_future = self.light_check_future # Local reference for safety
-        if active_future and not active_future.done():
-            try:
-                # Parse the JSON payload from the response
-                data = json.loads(payload_str)
-                # ASSUMPTION: Look for the hardcoded 'Mem1' key
-                key_to_check = "Mem1"
-                if key_to_check in data:
-                    value = data[key_to_check]
-                    logger.debug(f"Parsed light status response: {key_to_check} = {value}")
-                    # Set the result on the waiting Future to unblock _check_light_status
-                    active_future.set_result(value)
-                else:
-                     logger.warning(f"Response on {self.light_query_resp_topic} missing assumed key '{key_to_check}'. Payload: {payload_str}")
-                     # Signal failure if key is missing
-                     active_future.set_exception(KeyError(f"Assumed key '{key_to_check}' not found in response"))
-            except json.JSONDecodeError:
-                logger.warning(f"Could not decode JSON from response topic {self.light_query_resp_topic}: {payload_str}")
-                # Signal failure if JSON is invalid
-                active_future.set_exception(ValueError("Invalid JSON response for light status"))
-            except Exception as e:
-                 logger.error(f"Error processing light status response payload on {self.light_query_resp_topic}: {e}", exc_info=True)
-                 # Signal failure for other processing errors
-                 active_future.set_exception(e)
-        else:
-             # Log if we received a response but weren't actively waiting
-             logger.debug(f"Received light status response on {self.light_query_resp_topic}, but not currently waiting for it.")
-    async def _check_light_status(self) -> bool:
+    def is_misting(self) -> bool:
+        """True while a misting cycle task is running."""
+        return self.misting_task is not None and not self.misting_task.done()
+
+    def running_phase(self) -> Optional[float]:
+        """Seconds into each wall-clock period the running cycle's pulses fall on, or None when not misting."""
+        schedule = self.schedule
+        if not self.is_misting() or schedule is None:
+            return None
+        if schedule.phase is not None:
+            return schedule.phase
+        if schedule.next_deadline is None:
+            return self.context.wall_clock() % self.cycle_period
+        return (self.context.wall_clock() + schedule.next_deadline - self.loop.time()) % self.cycle_period
+
+    async def _run_command(self, seconds: int, received_at: Optional[float] = None):
         """
-        Asynchronously checks the light status via MQTT request/response.
+        Start or stop misting, one command at a time; a command matching the running state is a no-op.
 
-        Sends a command to query Mem1 on the configured checker device and waits
-        for a response handled by _on_message/_handle_light_response.
+        When tracing, a start command opens the trace of the first misting
+        cycle (from ONOFF receipt to its pulse); other commands get a trace of
+        their own.
+        """
+        trace = None
+        if self.tracer is not None:
+            trace = self.tracer.start_trace("cycle" if seconds > 0 else "stop", start=received_at,
+                                            controller=self.control_topic, command=seconds)
+            if received_at is not None:
+                trace.child("onoff_debounce", start=received_at).finish()
+        handed_over = False
+        if self._command_lock is None:
+            self._command_lock = asyncio.Lock()
+        try:
+            with tracing.activate(trace):
+                with tracing.span("command_lock"):
+                    await self._command_lock.acquire()
+                try:
+                    if seconds > 0 and self.is_misting() and self.active_duration == seconds:
+                        logger.info("Misting already running with duration=%ss for %s. Nothing to do.", seconds, self.control_topic)
+                        if trace is not None:
+                            trace.name = "command"
+                            trace.outcome = "noop"
+                        return
+                    if seconds <= 0 and not self.is_misting():
+                        logger.info("Misting already stopped for %s. Nothing to do.", self.control_topic)
+                        if trace is not None:
+                            trace.outcome = "noop"
+                        return
+                    if seconds > 0:
+                        with tracing.span("start_misting"):
+                            await self.start_misting(seconds, trace=trace)
+                        handed_over = trace is not None and self.misting_task is not None
+                    else:
+                        with tracing.span("stop_misting"):
+                            await self.stop_misting_async()
+                        self._journal_state(0, None)
+                finally:
+                    self._command_lock.release()
+        except BaseException:
+            if trace is not None:
+                trace.outcome = "error"
+            raise
+        finally:
+            # The misting task records a start command's trace once its first cycle is done
+            if trace is not None and not handed_over:
+                self.tracer.record(trace)
+
+    def _schedule(self, coro):
+        """Run a coroutine as a task on the loop, keeping a reference until it finishes."""
+        task = self.loop.create_task(coro)
+        tasks = self.context.tasks
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def _check_light_status(self) -> Tuple[bool, Optional[str]]:
+        """
+        Asynchronously checks the light status through the tent's shared light state.
 
         Returns:
-            bool: True if lights are considered ON based on the response,
-                  False if lights are OFF, check times out, or an error occurs.
+            (bool, str): True if lights are considered ON, False if lights are
+                OFF, check times out, or an error occurs; and when False, why
+                the pulse is skipped ("lights_off", "no_response",
+                "query_failed" or "error").
         """
-        # Precheck
-        # Am I already waiting for an answer about the light status? 
-        if self.light_check_future and not self.light_check_future.done():            # 2. AND that previous check has NOT finished yet (its result/exception hasn't been set)
-            logger.warning(f"Light status check already in progress for {self.control_topic}. Aborting new check.")
-            return False 
-        # 1. Setup the Future to wait for the response
-        self.light_check_future = self.loop.create_future()
-        logger.info(f"Requesting light status check via topic: {self.light_query_cmd_topic}")
-
-        # 2. Publish the command to trigger the response
-        published = self._publish(self.light_query_cmd_topic, "") # Payload usually ignored for Mem query
-
-        if not published:
-            logger.error(f"Failed to publish light status query command to {self.light_query_cmd_topic}.")
-            if self.light_check_future and not self.light_check_future.done():
-                self.light_check_future.cancel("Publish failed")
-            self.light_check_future = None
-            return False # Assume lights OFF if we can't even ask
-              # 3. Wait for the response (or timeout)
-        lights_on = False # Default to False (safe state)
         try:
-            logger.debug(f"Waiting up to {self.light_check_timeout}s for light status response on {self.light_query_resp_topic}")
-            result = await asyncio.wait_for(self.light_check_future, timeout=self.light_check_timeout)
-
-            # 4. Process the result received via the Future
-            logger.debug(f"Received light status check result: {result}")
-            try:
-                 # Compare the received result with the configured 'on' value
-                 result_val = int(result)
-                 config_on_val = int(self.light_check_on_val)
-                 lights_on = (result_val == config_on_val)
-                 logger.info(f"Light status check result for {self.control_topic}: Mem1={result_val} -> {'ON' if lights_on else 'OFF'}")
-            except (ValueError, TypeError) as e:
-                 logger.warning(f"Could not interpret light status result '{result}' as integer for comparison: {e}")
-                 lights_on = False # Treat uninterpretable result as OFF
-
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout waiting for light status response on {self.light_query_resp_topic} for {self.control_topic}. Assuming lights OFF.")
-            lights_on = False
+            with tracing.span("light_check", tent=self.light_state.name) as span:
+                lights_on = await self.light_state.lights_on()
+                if span is not None:
+                    span.attrs["lights_on"] = lights_on
+                if lights_on:
+                    return True, None
+                return False, self.light_state.last_failure or "lights_off"
         except asyncio.CancelledError:
-             logger.info(f"Light status check cancelled for {self.control_topic}.")
-             lights_on = False
+            logger.info(f"Light status check cancelled for {self.control_topic}.")
+            raise
         except Exception as e:
             logger.error(f"Error occurred during light status check for {self.control_topic}: {e}", exc_info=True)
-            lights_on = False
-        finally:
-            # 5. Clean up the Future - crucial!
-            self.light_check_future = None
-            logger.debug("Light check future cleared.")
+            return False, "error" # Default to False (safe state)
 
-        # 6. Return the determined state
-        return lights_on
     # --- END NEW ME
     # --- Power control implementation ---
-    def power_on(self, duration: float):
+    async def _send_to_devices(self, command: str, send: Callable[[str], Awaitable[bool]]) -> PowerReport:
+        """
+        Run ``send`` for every power topic and collect the per-topic results.
+
+        Devices are handled one after the other, or all at once when
+        ``parallel_power`` is set so the last relay switches about one round
+        trip after the decision, however many devices there are.
+        """
+        start = time.monotonic()
+        if self.parallel_power:
+            outcomes = await asyncio.gather(*(send(topic) for topic in self.power_topics), return_exceptions=True)
+        else:
+            outcomes = []
+            for topic in self.power_topics:
+                try:
+                    outcomes.append(await send(topic))
+                except Exception as e:
+                    outcomes.append(e)
+
+        results = {}
+        for topic, outcome in zip(self.power_topics, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"Error sending power {command} to {topic} ({self.control_topic}): {outcome}")
+                outcome = False
+            results[topic] = outcome
+        report = PowerReport(command, results, time.monotonic() - start)
+
+        # Log if not all commands were published successfully (e.g., MQTT errors)
+        if report.failed:
+            logger.warning(f"Published power {command} commands successfully for only {len(report.succeeded)}/{len(results)} topics ({self.control_topic}). Failed: {report.failed}")
+        else:
+            logger.debug("Power %s confirmed for %d topics in %.3fs (%s)", command, len(results), report.elapsed, self.control_topic)
+        return report
+
+    async def power_on(self, duration: float) -> PowerReport:
         """Control the power ON using Tasmota PulseTime logic."""
         # Check if power control is configured (i.e., if power_topics list is not empty)
         if not self.power_topics:
             logger.info(f"(Simulated) Power ON for {duration} seconds on topic {self.control_topic}")
-            return
+            return PowerReport("ON", {}, 0.0)
 
         # PulseTime logic requires a positive duration
         if duration <= 0:
             logger.warning(f"Requested power_on duration ({duration}) is not positive for {self.control_topic}. Turning off instead.")
-            self.power_off() # Call power_off if duration is invalid
-            return
+            return await self.power_off() # Call power_off if duration is invalid
 
-        # Tasmota PulseTime: 1..111 is off, 112..64900 is seconds + 100
-        pulsetime_val = math.ceil(duration) + 100 # Use ceiling for safety
-        if pulsetime_val < 112: pulsetime_val = 112 # Minimum effective PulseTime
-        if pulsetime_val > 64900: pulsetime_val = 64900 # Maximum PulseTime
+        pulsetime_val = tasmota.pulsetime_value(duration)
 
         # Calculate the actual duration Tasmota will use based on the final PulseTime value
         actual_seconds = pulsetime_val - 100
-        logger.info(f"Turning Power ON via PulseTime ({pulsetime_val} -> {actual_seconds}s) for topics under {self.control_topic}")
-        
-        # Iterate through each configured power topic to send commands
-        success_count = 0
-        for topic in self.power_topics:
-            # Check if it's a standard Tasmota POWER topic (ends with /POWER)
-            if topic.endswith("/POWER"):
-                # Derive the corresponding PulseTime topic by replacing POWER with PulseTime
-                pulsetime_topic = topic[:-len("POWER")] + "PulseTime"
-                
-                # Step 1: Set the PulseTime timer on the Tasmota device FIRST.
-                # This tells Tasmota how long to stay ON after the next POWER ON command.
-                if self._publish(pulsetime_topic, pulsetime_val):
-                     # Step 2: If PulseTime was set successfully, send the POWER ON command.
-                     # Tasmota will turn the relay ON and automatically turn it OFF after 'actual_seconds'.
-                    if self._publish(topic, "ON"): # Use "ON" string for Tasmota POWER command
-                        success_count += 1
-            else:
-                # Log if the configured topic doesn't follow the expected pattern
-                logger.warning(f"Cannot derive PulseTime topic from non-standard POWER topic: {topic} ({self.control_topic})")
-            
-        # Log if not all commands were published successfully (e.g., MQTT errors)
-        if success_count < len(self.power_topics):
-             logger.warning(f"Published power_on commands successfully for only {success_count}/{len(self.power_topics)} topics ({self.control_topic})")
+        logger.info("Turning Power ON via PulseTime (%s -> %ss) for topics under %s", pulsetime_val, actual_seconds, self.control_topic)
+        return await self._send_to_devices("ON", lambda topic: self._pulse_device(topic, pulsetime_val))
+
+    async def _pulse_device(self, topic: str, pulsetime_val: int) -> bool:
+        """Switch one Tasmota device ON for its PulseTime. Returns True if the commands were published."""
+        with tracing.span("pulse", topic=topic) as span:
+            ok = await self._send_pulse(topic, pulsetime_val, span)
+            if span is not None and not ok:
+                span.outcome = "failed"
+            return ok
+
+    async def _send_pulse(self, topic: str, pulsetime_val: int, span: Optional[tracing.Span]) -> bool:
+        """Publish the commands of one pulse; see _pulse_device."""
+        cache = self.pulsetime_cache
+        # A pulse still queued once it would have ended is dropped rather than replayed
+        pulse_ttl = pulsetime_val - 100
+        if cache is not None and cache.get(topic) == pulsetime_val:
+            # The device already holds this PulseTime; switching ON is enough.
+            if span is not None:
+                span.attrs["pulsetime_cached"] = True
+            return await self._publish(topic, "ON", ttl=pulse_ttl)
+
+        # While disconnected the pulse is queued as one Backlog message, so the
+        # reconnect delivers PulseTime and POWER ON together (or neither, once it expired)
+        if self.use_backlog or not self.connection.is_connected():
+            backlog_topic = tasmota.backlog_topic(topic)
+            if backlog_topic is None:
+                logger.warning(f"Cannot derive Backlog topic from non-standard POWER topic: {topic} ({self.control_topic})")
+                return False
+            # One message: Tasmota sets PulseTime and then turns the relay ON.
+            # The cache learns the new PulseTime from the device's RESULT, not from the PUBACK.
+            return await self._publish(backlog_topic, tasmota.backlog_pulse_payload(pulsetime_val), ttl=pulse_ttl)
+
+        pulsetime_topic = tasmota.pulsetime_topic(topic)
+        if pulsetime_topic is None:
+            # Log if the configured topic doesn't follow the expected pattern
+            logger.warning(f"Cannot derive PulseTime topic from non-standard POWER topic: {topic} ({self.control_topic})")
+            return False
+
+        # Step 1: Set the PulseTime timer on the Tasmota device FIRST.
+        # This tells Tasmota how long to stay ON after the next POWER ON command.
+        # A PUBACK only means the broker has it; the cache is updated once the device answers on RESULT.
+        if not await self._publish(pulsetime_topic, pulsetime_val):
+            if cache is not None:
+                cache.invalidate(topic)
+            return False
+        # Step 2: If PulseTime was set successfully, send the POWER ON command.
+        # Tasmota will turn the relay ON and automatically turn it OFF after the pulse.
+        return await self._publish(topic, "ON", ttl=pulse_ttl) # Use "ON" string for Tasmota POWER command
 
 
-    def power_off(self):
+    async def power_off(self) -> PowerReport:
         """Control the power OFF."""
         if not self.power_topics:
             logger.info(f"(Simulated) Power OFF on topic {self.control_topic}")
-            return
+            return PowerReport("OFF", {}, 0.0)
 
-        logger.info(f"Turning Power OFF for topics under {self.control_topic}")
-        
-        # Iterate through each configured power topic
-        success_count = 0
-        for topic in self.power_topics:
-            # Main Step: Send the POWER OFF command to turn the relay off immediately.
-            if self._publish(topic, "OFF"): # Use "OFF" string for Tasmota POWER command
-                 success_count += 1             
-        # Log if not all commands were published successfully
-        if success_count < len(self.power_topics):
-             logger.warning(f"Published power_off commands successfully for only {success_count}/{len(self.power_topics)} topics ({self.control_topic})")
+        logger.info("Turning Power OFF for topics under %s", self.control_topic)
+        # Main Step: Send the POWER OFF command to turn each relay off immediately.
+        return await self._send_to_devices("OFF", lambda topic: self._publish(topic, "OFF")) # Use "OFF" string for Tasmota POWER command
 
     # --- Misting task management ---
     async def stop_misting_async(self):
@@ -354,113 +529,220 @@ class MistBuddySimple:
                  # Clear only if it's the same task we started cancelling
                  if self.misting_task is task_to_clear:
                       self.misting_task = None
+                      self.active_duration = None
          else:
              logger.debug(f"No active misting task to stop for topic {self.control_topic}")
 
          # Ensure power is off after attempting to stop/clear the task
-         self.power_off()
+         await self.power_off()
 
 
-    async def start_misting(self, duration: float):
-        """Start misting cycle - runs in async context."""
-        logger.debug(f"start_misting called for topic {self.control_topic} with duration: {duration}")
+    async def start_misting(self, duration: float, trace: Optional[tracing.Span] = None):
+        """
+        Start misting cycle - runs in async context.
+        ``trace`` is the open trace of the command, continued by the first cycle.
+        """
+        logger.debug("start_misting called for topic %s with duration: %s", self.control_topic, duration)
         if duration <= 0:
-            logger.warning(f"Requested misting duration ({duration}) is not positive for {self.control_topic}. Stopping any active cycle.")
+            logger.warning("Requested misting duration (%s) is not positive for %s. Stopping any active cycle.", duration, self.control_topic)
             await self.stop_misting_async()
             return
 
         # Stop and await previous task before starting new one
         await self.stop_misting_async()
 
-        logger.info(f"Starting new misting cycle task for {self.control_topic} ({duration}s duration)")
-        self.misting_task = asyncio.create_task(self.misting_cycle(duration))
+        logger.info("Starting new misting cycle task for %s (%ss duration)", self.control_topic, duration)
+        self.misting_task = asyncio.create_task(self.misting_cycle(duration, trace))
+        self.misting_task.add_done_callback(self._on_misting_task_done)
+        self.active_duration = duration
+
+    def _on_misting_task_done(self, task: asyncio.Task):
+        """
+        Done-callback of the misting task: reports how it ended the moment it ends.
+        Runs on the event loop.
+        """
+        if task.cancelled():
+            logger.debug(f"Misting task ({self.control_topic}) finished due to cancellation.")
+        elif task.exception() is not None:
+            e = task.exception()
+            logger.error(f"Misting task ({self.control_topic}) failed unexpectedly: {e}", exc_info=e)
+        else:
+            logger.info(f"Misting task for {self.control_topic} has finished.")
+        # Clear task only if it hasn't been replaced by a newer one
+        if self.misting_task is task:
+            self.misting_task = None
+            self.active_duration = None
+
+    def _on_connection_state(self, connected: bool):
+        """
+        Connection state listener. Runs on the event loop.
+        The connection itself logs the loss once; here it is only traced per controller.
+        """
+        if connected:
+            logger.debug("MQTT connection up for %s.", self.control_topic)
+        else:
+            logger.debug("MQTT connection down for %s; commands are queued until it is back.", self.control_topic)
 
 
-    async def misting_cycle(self, duration: float):
-        """Run the misting cycle - runs in async context."""
-        logger.debug(f"Entered misting_cycle for {self.control_topic} with duration: {duration}")
-        # Basic validation already done in start_misting, but double check < 60
-        if duration >= 60:
-             logger.error(f"Misting duration ({duration}) must be less than 60 seconds. Stopping cycle for {self.control_topic}.")
-             self.power_off() # Ensure power is off
+    async def misting_cycle(self, duration: float, trace: Optional[tracing.Span] = None):
+        """
+        Run the misting cycle - runs in async context.
+        With a tracer every cycle is recorded as one trace; ``trace``, when
+        given, is the already open trace of the first cycle.
+        """
+        logger.debug("Entered misting_cycle for %s with duration: %s", self.control_topic, duration)
+        # Basic validation already done in start_misting, but double check it fits in the period
+        if duration >= self.cycle_period:
+             logger.error("Misting duration (%s) must be less than the %s second cycle period. Stopping cycle for %s.", duration, self.cycle_period, self.control_topic)
+             self._journal_state(0, None)
+             with tracing.activate(trace):
+                 await self.power_off() # Ensure power is off
+             if trace is not None:
+                 self.tracer.record(trace, "rejected")
              return
 
+        # Pulses fire on absolute deadlines, so the time spent checking and
+        # publishing below does not make the cycle drift.
+        phase = self.cycle_phase
+        if phase is None and self.coordinator is not None:
+            phase = self.coordinator.phase_for(self, self.cycle_period)
+            if phase is not None:
+                logger.info("Staggered misting phase for %s: %.2fs into each %ss period", self.control_topic, phase, self.cycle_period)
+        if phase is None and self.initial_phase is not None:
+            phase = self.initial_phase % self.cycle_period
+            logger.info("Re-aligning restored misting cycle for %s to %.2fs into each %ss period", self.control_topic, phase, self.cycle_period)
+        self.initial_phase = None
+        self.schedule = DeadlineScheduler(self.cycle_period, phase, grace=self.deadline_grace,
+                                          name=self.control_topic, wall_clock=self.context.wall_clock)
+        # Without a phase the first pulse fires now; that instant is the phase to come back to
+        self._journal_state(duration, phase if phase is not None else self.context.wall_clock() % self.cycle_period)
+        lateness = metrics.CYCLE_LATENESS_SECONDS.labels(self.control_topic)
+        missed = metrics.MISSED_DEADLINES.labels(self.control_topic)
         try:
             while True:
-                logger.info(f"Checking light status before starting misting for {self.control_topic}...")
-                lights_are_on = await self._check_light_status()
-                if lights_are_on:
-                    # Lights are ON, proceed with turning power on
-                    logger.info(f"Lights ON. Misting ON for {duration}s ({self.control_topic})")
-                    self.power_on(duration)
+                if trace is None and self.tracer is not None:
+                    trace = self.tracer.start_trace("cycle", controller=self.control_topic, duration=duration)
+                with tracing.activate(trace):
+                    missed_before = self.schedule.missed
+                    with tracing.span("deadline_wait") as span:
+                        await self.schedule.wait()
+                        if span is not None:
+                            span.attrs["lateness_ms"] = round(self.schedule.last_lateness * 1000, 3)
+                    lateness.observe(self.schedule.last_lateness)
+                    if self.schedule.missed > missed_before:
+                        missed.inc(self.schedule.missed - missed_before)
+                    logger.info("Checking light status before starting misting for %s...", self.control_topic)
+                    lights_are_on, skip_reason = await self._check_light_status()
+                    report: Optional[PowerReport] = None
+                    if lights_are_on:
+                        # Lights are ON, proceed with turning power on
+                        logger.info("Lights ON. Misting ON for %ss (%s)", duration, self.control_topic)
+                        if self.coordinator is not None:
+                            with tracing.span("pulse_slot"):
+                                # The relays stay on for the clamped PulseTime, not just ``duration``
+                                await self.coordinator.acquire_pulse(tasmota.pulse_seconds(duration))
+                        with tracing.span("power_on"):
+                            report = await self.power_on(duration)
+                    else:
+                        # Lights are OFF (or unknown), skip turning power on for this pulse
+                        logger.info("Lights OFF (%s). Skipping misting pulse for this cycle (%s).", skip_reason, self.control_topic)
+                if not lights_are_on:
+                    outcome = "skipped"
+                elif report is not None and not report.ok:
+                    outcome = "failed"
                 else:
-                    # Lights are OFF, skip turning power on for this pulse
-                    logger.info(f"Lights OFF. Skipping misting pulse for this cycle ({self.control_topic}).")
-                # Calculate sleep time s
-                sleep_duration = 60.0 - duration
-                logger.debug(f"Misting cycle ({self.control_topic}) sleeping for {sleep_duration:.1f}s")
-                await asyncio.sleep(sleep_duration)
+                    outcome = "fired"
+                metrics.PULSES.labels(self.control_topic, outcome).inc()
+                if trace is not None:
+                    self.tracer.record(trace, outcome)
+                    trace = None
+                on_cycle = self.context.on_cycle
+                if on_cycle is not None:
+                    on_cycle(self, lights_are_on, report, skip_reason)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Misting cycle (%s) next deadline in %.1fs", self.control_topic, self.schedule.next_deadline - self.loop.time())
         except asyncio.CancelledError:
-            logger.info(f"Misting cycle cancelled externally for {self.control_topic}")
+            logger.info("Misting cycle cancelled externally for %s", self.control_topic)
+            if trace is not None:
+                self.tracer.record(trace, "cancelled")
             # Power off is handled in stop_misting_async which is the only way this should be cancelled
             # self.power_off() # Redundant if stop_misting_async is always used
             # Do not re-raise CancelledError here, let the caller handle it
         except Exception as e:
-            logger.error(f"Error within misting cycle for {self.control_topic}: {e}", exc_info=True)
-            self.power_off() # Ensure power is off on other errors
-
+            logger.error("Error within misting cycle for %s: %s", self.control_topic, e, exc_info=True)
+            if trace is not None:
+                self.tracer.record(trace, "error")
+            await self.power_off() # Ensure power is off on other errors
+
+
+    def _journal_state(self, duration: int, phase: Optional[float]):
+        if self.journal is not None:
+            self.journal.record(self.control_topic, duration, phase, self.cycle_period)
+
+    def close(self):
+        """Stop listening on the connection. Call once run() has returned; the controller is not reusable."""
+        self.connection.unsubscribe(self.control_topic, self._on_control_topic)
+        self.connection.remove_state_listener(self._on_connection_state)
+        if self.pulsetime_cache is not None:
+            for topic in self.power_topics:
+                self.pulsetime_cache.unwatch(topic)
+        if self._owns_light_state:
+            self.light_state.close()
+
+    def stop(self):
+        """Ask run() to clean up and return."""
+        if self._shutdown is not None:
+            self._shutdown.set()
+
+    def start(self):
+        """
+        Attach to the running loop and resume misting if ``initial_duration`` asks for it.
+        Runs on the event loop.
 
-    async def run(self):
-        """Main application loop - Manages MQTT loop and task status."""
+        run() calls this for a standalone controller; a supervisor calls
+        start() and shutdown() itself rather than keeping a run() task per
+        controller.
+        """
         self.loop = asyncio.get_running_loop()
-        if not self.client:
-             logger.critical(f"MQTT client not initialized for {self.control_topic}. Cannot run.")
-             return
-
-        try:
-            self.client.loop_start()
-        except Exception as e:
-             logger.critical(f"Failed to start MQTT network loop for {self.control_topic}: {e}", exc_info=True)
-             return
-
+        self.light_state.attach_loop(self.loop)
         logger.info(f"Started main loop for MistBuddy controlling {self.control_topic}")
+        if self.initial_duration:
+            logger.info(f"Resuming misting with duration={self.initial_duration}s for {self.control_topic}")
+            self._schedule(self._run_command(self.initial_duration))
+
+    async def shutdown(self):
+        """Drop a command still waiting out its debounce window and stop misting (devices are powered off)."""
+        if self._debounce_handle is not None:
+            self._debounce_handle.cancel()
+            self._debounce_handle = None
+        # Ensure misting stops and task is awaited
+        await self.stop_misting_async()
 
-        try:
-            while True:
-                if not self.client.is_connected():
-                    logger.warning(f"MQTT client disconnected for {self.control_topic}. Attempting to reconnect is handled by paho-mqtt.")
-                    # Paho-mqtt attempts reconnect automatically, we just wait.
-
-                # Check task status periodically
-                task_to_check = self.misting_task
-                if task_to_check and task_to_check.done():
-                    logger.info(f"Misting task for {self.control_topic} has finished.")
-                    try:
-                        task_to_check.result() # Check for exceptions
-                    except asyncio.CancelledError:
-                        logger.debug(f"Misting task ({self.control_topic}) finished due to cancellation.")
-                    except Exception as e:
-                        logger.error(f"Misting task ({self.control_topic}) failed unexpectedly: {e}", exc_info=True)
-                    # Clear task only if it hasn't changed due to race condition
-                    if self.misting_task is task_to_check:
-                        self.misting_task = None
-
-                # Heartbeat sleep
-                await asyncio.sleep(5)
+    async def run(self):
+        """Main application loop - Starts the MQTT loop if owned and waits until stopped or cancelled."""
+        if self._owns_connection:
+            try:
+                self.connection.loop_start()
+            except Exception as e:
+                 logger.critical(f"Failed to start MQTT network loop for {self.control_topic}: {e}", exc_info=True)
+                 return
 
+        # Nothing to poll: the misting task and the connection report through
+        # callbacks, so an idle controller just waits here for stop().
+        self._shutdown = asyncio.Event()
+        self.start()
+        try:
+            await self._shutdown.wait()
         except asyncio.CancelledError:
             logger.info(f"Main loop cancellation requested for {self.control_topic}. Shutting down.")
         finally:
             logger.info(f"Cleaning up resources for {self.control_topic}...")
-            # Ensure misting stops and task is awaited
-            await self.stop_misting_async()
+            await self.shutdown()
 
-            # Stop the MQTT network loop
-            if self.client:
+            # Stop the MQTT network loop if this controller owns it
+            if self._owns_connection:
                 try:
-                    # No need to explicitly disconnect if loop_stop is called? Check docs.
-                    # self.client.disconnect() # Might interfere with clean LWT?
-                    self.client.loop_stop() # Stops the background thread
+                    self.connection.loop_stop() # Stops the background thread
                     logger.info(f"MQTT network loop stopped for {self.control_topic}.")
                 except Exception as e:
                      logger.error(f"Error during MQTT cleanup for {self.control_topic}: {e}", exc_info=True)
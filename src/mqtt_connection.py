@@ -0,0 +1,454 @@
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from paho.mqtt import client as mqtt
+
+from src import metrics
+from src.offline_queue import OfflineQueue
+from src.topic_router import MessageHandler, TopicRouter
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+
+class MqttConnection:
+    """
+    A single paho-mqtt client shared by any number of MistBuddy controllers.
+
+    Controllers register a handler per topic (or wildcard filter) instead of
+    owning a client. The connection subscribes to every registered filter
+    once, re-subscribes after a reconnect and dispatches each inbound message
+    through its TopicRouter. State listeners are told on the event loop
+    whenever the connection comes up or goes down.
+
+    This is the paho-thread backend: the network loop runs in paho's own
+    thread and every inbound message is handed to the asyncio loop in a
+    single hop, so handlers always run on the event loop.
+
+    While the broker is unreachable, publishes are held in an OfflineQueue
+    of ``offline_queue_size`` topics (0 disables it) and sent in one batch
+    as soon as the connection is back.
+    """
+
+    def __init__(self, broker_ip: str, port: int = 1883, client_id: str = "", offline_queue_size: int = 256):
+        self.broker_ip = str(broker_ip)
+        self.port = port
+        self.router = TopicRouter()
+        # QoS>0 publishes waiting for their PUBACK, keyed by message id.
+        # Only ever touched from the event loop thread.
+        self._pending_publishes: Dict[int, asyncio.Future] = {}
+        self._publish_sent_at: Dict[int, float] = {} # mid -> loop.time() handed to paho
+        self._has_connected = False
+        self.offline_queue: Optional[OfflineQueue] = OfflineQueue(offline_queue_size) if offline_queue_size else None
+        self._state_listeners: List[Callable[[bool], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_connect_fail = self._on_connect_fail
+        self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+
+    def connect(self, blocking: bool = False):
+        """
+        Connect to the broker - still in regular Python context.
+
+        By default this only records the broker: paho's network thread does
+        the TCP/MQTT handshake once loop_start() runs, retrying until the
+        broker answers, so controllers are ready (and publishes queue)
+        while it is in progress. With ``blocking`` the handshake happens
+        here and a failure raises ConnectionError.
+        """
+        try:
+            if not blocking:
+                logger.info(f"Connecting to MQTT broker at {self.broker_ip}:{self.port} in the background")
+                self.client.connect_async(self.broker_ip, self.port)
+                return
+            logger.info(f"Connecting to MQTT broker at {self.broker_ip}:{self.port}")
+            self.client.connect(self.broker_ip, self.port)
+        except Exception as e:
+            logger.error(f"Failed to connect MQTT client to {self.broker_ip}: {e}", exc_info=True)
+            raise ConnectionError(f"Failed to initialize MQTT connection to {self.broker_ip}") from e
+
+    def loop_start(self):
+        """Start the paho network thread. Call from the event loop that handlers should run on."""
+        self._loop = asyncio.get_running_loop()
+        self.client.loop_start()
+
+    def loop_stop(self):
+        """Stop the paho network thread."""
+        self.client.loop_stop()
+
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
+    def subscribe(self, topic: str, handler: MessageHandler):
+        """Register a handler for a topic or wildcard filter, subscribing on the broker the first time it is seen."""
+        if self.router.add(topic, handler) and self.client.is_connected():
+            self.client.subscribe(topic)
+            logger.info(f"Subscribed to topic: {topic}")
+
+    def unsubscribe(self, topic: str, handler: MessageHandler):
+        """Remove a handler, unsubscribing on the broker once no handler is left for the filter."""
+        if self.router.remove(topic, handler) and self.client.is_connected():
+            self.client.unsubscribe(topic)
+            logger.info(f"Unsubscribed from topic: {topic}")
+
+    def add_state_listener(self, listener: Callable[[bool], None]):
+        """Call ``listener(connected)`` on the event loop on every connect and disconnect."""
+        self._state_listeners.append(listener)
+
+    def remove_state_listener(self, listener: Callable[[bool], None]):
+        if listener in self._state_listeners:
+            self._state_listeners.remove(listener)
+
+    def _notify_state(self, connected: bool):
+        """Tell every state listener about a connect or disconnect. Runs on the event loop."""
+        if connected:
+            if self._has_connected:
+                metrics.MQTT_RECONNECTS.labels().inc()
+            self._has_connected = True
+        for listener in list(self._state_listeners):
+            try:
+                listener(connected)
+            except Exception as e:
+                logger.error(f"Error in connection state listener {listener}: {e}", exc_info=True)
+
+    def publish(self, topic: str, payload: str, qos: int = 1) -> mqtt.MQTTMessageInfo:
+        """Publish a message and return paho's message info."""
+        return self.client.publish(topic, payload, qos=qos)
+
+    def publish_nowait(self,
+                       topic: str,
+                       payload: str,
+                       qos: int = 1,
+                       ttl: Optional[float] = None,
+                       queue: bool = True,
+                       retain: bool = False) -> asyncio.Future:
+        """
+        Send a message without blocking and return a future for its delivery.
+
+        The future resolves to True once the broker acknowledges the message
+        (immediately for QoS 0) and to False if it could not be sent. Must be
+        called from the event loop; the PUBACK is handed back to the loop
+        by ``_on_publish``. While disconnected the message is queued for the
+        reconnect unless ``queue`` is False; ``ttl`` is how many seconds it
+        stays worth sending.
+        """
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        future = loop.create_future()
+        if not self.client.is_connected():
+            if queue and self.offline_queue is not None:
+                expires = loop.time() + ttl if ttl is not None else None
+                self.offline_queue.put(topic, payload, qos, future, expires, retain)
+                logger.warning("MQTT client not connected. Queued publish to %s for reconnect (%d queued)", topic, len(self.offline_queue))
+                return future
+            logger.error(f"MQTT client not connected. Cannot publish to {topic}")
+            future.set_result(False)
+            return future
+        self._send(topic, payload, qos, future, retain)
+        return future
+
+    def _send(self, topic: str, payload: str, qos: int, future: asyncio.Future, retain: bool = False):
+        """Hand the message to paho and tie ``future`` to its acknowledgement. Runs on the event loop."""
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.warning(f"Failed to publish to {topic}. Return code: {info.rc}")
+            future.set_result(False)
+        elif qos == 0:
+            future.set_result(True)
+        else:
+            # Registered before control returns to the loop, so an early PUBACK
+            # (resolved via call_soon_threadsafe) always finds its future.
+            self._pending_publishes[info.mid] = future
+            self._publish_sent_at[info.mid] = self._loop.time()
+            future.add_done_callback(lambda f, mid=info.mid: self._forget_publish(mid, f))
+
+    async def publish_async(self,
+                            topic: str,
+                            payload: str,
+                            qos: int = 1,
+                            timeout: float = 5.0,
+                            ttl: Optional[float] = None) -> bool:
+        """
+        Publish a message and await its acknowledgement without blocking the loop.
+
+        A message taken into the offline queue while disconnected counts as
+        sent: True is returned right away instead of waiting ``timeout``
+        seconds for a PUBACK that cannot come before the reconnect.
+        """
+        future = self.publish_nowait(topic, payload, qos=qos, ttl=ttl)
+        if not future.done() and self.offline_queue is not None and self.offline_queue.holds(topic, future):
+            return True
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            metrics.PUBLISH_TIMEOUTS.labels().inc()
+            logger.warning(f"Timeout waiting for publish confirmation to {topic}")
+            return False
+
+    def _flush_offline_queue(self):
+        """Send everything queued while disconnected in one batch. Runs on the event loop."""
+        if not self.offline_queue or not self.client.is_connected():
+            return
+        entries = self.offline_queue.drain(self._loop.time())
+        for topic, entry in entries:
+            # The caller may have given up waiting; the message is still delivered
+            future = entry.future if not entry.future.done() else self._loop.create_future()
+            self._send(topic, entry.payload, entry.qos, future, entry.retain)
+        if entries:
+            logger.info(f"Flushed {len(entries)} queued publish(es) after reconnecting to {self.broker_ip}")
+
+    def _forget_publish(self, mid: int, future: asyncio.Future):
+        """Drop a finished (or timed out) publish unless its mid was already reused."""
+        if self._pending_publishes.get(mid) is future:
+            del self._pending_publishes[mid]
+            self._publish_sent_at.pop(mid, None)
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        """
+        MQTT publish callback - hands the acknowledgement back to the event loop.
+        Runs in the MQTT client's thread.
+        """
+        self._to_loop(self._resolve_publish, mid, reason_code)
+
+    def _to_loop(self, callback: Callable, *args):
+        """
+        Run ``callback`` on the event loop.
+        Called from paho's network thread, so the call is scheduled thread-safely.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            logger.error(f"Event loop not available. Dropping {getattr(callback, '__name__', callback)} callback.")
+            return
+        loop.call_soon_threadsafe(callback, *args)
+
+    def _resolve_publish(self, mid: int, reason_code):
+        """Complete the future of an acknowledged publish. Runs on the event loop."""
+        future = self._pending_publishes.pop(mid, None)
+        sent_at = self._publish_sent_at.pop(mid, None)
+        if future is None or future.done():
+            return
+        if sent_at is not None:
+            metrics.PUBACK_SECONDS.labels().observe(self._loop.time() - sent_at)
+        failed = getattr(reason_code, "is_failure", False)
+        if failed:
+            logger.warning(f"Broker rejected publish (mid={mid}). Reason code: {reason_code}")
+        future.set_result(not failed)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        """
+        MQTT connect callback - (re)subscribes every registered topic.
+        Runs in the MQTT client's network context.
+        """
+        if reason_code == 0:
+            logger.info(f"Successfully connected to MQTT broker {self.broker_ip}.")
+            topics = self.router.filters()
+            if topics:
+                try:
+                    # One SUBSCRIBE packet for every registered filter
+                    client.subscribe([(topic, 0) for topic in topics])
+                    logger.info(f"Subscribed to {len(topics)} topic(s): {topics}")
+                except Exception as e:
+                    logger.error(f"Failed to subscribe to {len(topics)} topic(s) during on_connect: {e}", exc_info=True)
+            if self.offline_queue:
+                self._to_loop(self._flush_offline_queue)
+            self._to_loop(self._notify_state, True)
+        else:
+            logger.error(f"Failed to connect MQTT to {self.broker_ip}. Reason code: {reason_code}")
+
+    def _on_connect_fail(self, client, userdata):
+        """
+        Called when the network thread cannot reach the broker; paho retries on its own.
+        Runs in the MQTT client's network context.
+        """
+        logger.warning(f"Could not reach MQTT broker {self.broker_ip}:{self.port}. Retrying.")
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        """
+        MQTT disconnect callback - tells the state listeners right away.
+        Runs in the MQTT client's network context.
+        """
+        if getattr(reason_code, "is_failure", True):
+            logger.warning(f"Connection to MQTT broker {self.broker_ip} lost. Reason code: {reason_code}")
+        else:
+            logger.info(f"Disconnected from MQTT broker {self.broker_ip}.")
+        self._to_loop(self._notify_state, False)
+
+    def _on_message(self, client, userdata, msg):
+        """
+        MQTT message callback - decodes the payload once and hands it to the event loop.
+        Runs in the MQTT client's network context.
+        """
+        try:
+            payload_str = msg.payload.decode('utf-8')
+            logger.debug("Received message on topic '%s': %s", msg.topic, payload_str)
+        except UnicodeDecodeError:
+            logger.warning(f"Could not decode payload on topic '{msg.topic}' as UTF-8.")
+            return
+        self._to_loop(self._dispatch, msg.topic, payload_str)
+
+    def _dispatch(self, topic: str, payload_str: str):
+        """Route the message to its handlers. Runs on the event loop."""
+        self.router.dispatch(topic, payload_str)
+
+
+class AsyncioMqttConnection(MqttConnection):
+    """
+    MqttConnection whose socket is driven directly by the asyncio loop.
+
+    paho's external-socket hooks register the socket with the loop's reader
+    and writer callbacks, and ``loop_misc`` runs as a loop task for
+    keepalives. There is no network thread: message, publish and connect
+    callbacks all run on the event loop and reach handlers with no
+    cross-thread scheduling. Only the blocking TCP connect is done in the
+    loop's default executor.
+    """
+
+    # Seconds between reconnect attempts, doubling up to the maximum
+    RECONNECT_DELAY_MIN = 1.0
+    RECONNECT_DELAY_MAX = 60.0
+
+    def __init__(self, broker_ip: str, port: int = 1883, client_id: str = "", offline_queue_size: int = 256):
+        super().__init__(broker_ip, port, client_id, offline_queue_size)
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        self._misc_task: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._reconnect_delay = self.RECONNECT_DELAY_MIN # grows until a CONNACK arrives
+        self._loop_thread: Optional[int] = None
+        self._running = False
+
+    def connect(self, blocking: bool = False):
+        """The socket can only be registered once a loop runs; the connection is made in loop_start()."""
+        logger.info(f"MQTT broker {self.broker_ip}:{self.port} will be connected from the event loop.")
+
+    def loop_start(self):
+        """Attach the client to the running event loop and connect in the background."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._running = True
+        logger.info(f"Connecting to MQTT broker at {self.broker_ip}:{self.port}")
+        self.client.connect_async(self.broker_ip, self.port)
+        self._schedule_reconnect(delay=0.0)
+
+    def loop_stop(self):
+        """Disconnect and detach the socket from the event loop."""
+        self._running = False
+        for task in (self._reconnect_task, self._misc_task):
+            if task is not None and not task.done():
+                task.cancel()
+        try:
+            self.client.disconnect()
+        except Exception as e:
+            logger.debug(f"Error while disconnecting from {self.broker_ip}: {e}")
+
+    def _to_loop(self, callback: Callable, *args):
+        """Already on the event loop, so call straight through."""
+        callback(*args)
+
+    def _on_loop(self, callback: Callable, *args):
+        """Run ``callback`` on the event loop; the socket hooks also fire in the executor thread that connects."""
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    # --- paho external-socket hooks ---
+    # The file descriptor is taken right away: paho may close the socket
+    # before a hook called from the connect thread reaches the loop.
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._attach_socket, sock.fileno())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._detach_socket, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self._loop.add_writer, sock.fileno(), client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self._loop.remove_writer, sock.fileno())
+
+    def _attach_socket(self, fd: int):
+        self._loop.add_reader(fd, self.client.loop_read)
+        self._misc_task = self._loop.create_task(self._misc_loop())
+
+    def _detach_socket(self, fd: int):
+        self._loop.remove_reader(fd)
+        self._loop.remove_writer(fd)
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+
+    async def _misc_loop(self):
+        """
+        Run paho's keepalive/retry housekeeping once a second until the connection drops.
+        A keepalive timeout found here ends in _on_disconnect, which owns reconnecting.
+        """
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        """The backoff only starts over once the broker has accepted the session (CONNACK)."""
+        super()._on_connect(client, userdata, flags, reason_code, properties)
+        if reason_code == 0:
+            self._reconnect_delay = self.RECONNECT_DELAY_MIN
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        """The only place a lost connection is reconnected from, with the backoff kept across attempts."""
+        super()._on_disconnect(client, userdata, disconnect_flags, reason_code, properties)
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self, delay: Optional[float] = None):
+        if self._running and (self._reconnect_task is None or self._reconnect_task.done()):
+            self._reconnect_task = self._loop.create_task(self._reconnect_loop(delay))
+
+    async def _reconnect_loop(self, delay: Optional[float] = None):
+        """
+        Open the connection, waiting ``delay`` seconds (the current backoff by
+        default) before each attempt.
+
+        The blocking TCP connect runs in an executor so the loop keeps
+        serving the other controllers. This task ends once the CONNECT
+        packet is on its way; whether the broker accepts it is up to
+        _on_connect, so a broker that accepts TCP and then drops the session
+        still sees a growing backoff.
+        """
+        while self._running and not self.client.is_connected():
+            if delay is None:
+                delay = self._reconnect_delay
+                self._reconnect_delay = min(delay * 2, self.RECONNECT_DELAY_MAX)
+            await asyncio.sleep(delay)
+            delay = None
+            try:
+                await self._loop.run_in_executor(None, self.client.reconnect)
+                return
+            except Exception as e:
+                logger.warning(f"Connecting to MQTT broker {self.broker_ip}:{self.port} failed: {e}. "
+                               f"Next attempt in {self._reconnect_delay:.0f}s")
+
+
+# Transport backends selectable from the configuration
+TRANSPORTS = {
+    "thread": MqttConnection,
+    "asyncio": AsyncioMqttConnection,
+}
+
+
+def create_connection(broker_ip: str,
+                      transport: str = "thread",
+                      port: int = 1883,
+                      client_id: str = "",
+                      offline_queue_size: int = 256) -> MqttConnection:
+    """Build a connection for the named transport backend ("thread" or "asyncio")."""
+    try:
+        connection_cls = TRANSPORTS[transport]
+    except KeyError:
+        raise ValueError(f"Unknown MQTT transport '{transport}'. Expected one of: {', '.join(TRANSPORTS)}") from None
+    return connection_cls(broker_ip, port=port, client_id=client_id, offline_queue_size=offline_queue_size)
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueuedPublish:
+    """A publish held back while the broker is unreachable."""
+    payload: str
+    qos: int
+    expires: Optional[float]    # loop time after which the message is stale, None to keep it
+    future: asyncio.Future      # the caller's delivery future
+    retain: bool = False
+
+
+def _settle(future: asyncio.Future, result: bool):
+    if not future.done():
+        future.set_result(result)
+
+
+class OfflineQueue:
+    """
+    Outbound messages kept per topic while the MQTT connection is down.
+
+    Only the latest message of each topic is kept: a newer command replaces
+    the one waiting on the same topic, so a reconnect delivers the final
+    POWER state of each device rather than its history. Messages carry an
+    optional expiry (a pulse that would already have ended is not worth
+    sending). At most ``max_size`` topics are held; the oldest is dropped
+    when a new topic does not fit. Futures of dropped, replaced or expired
+    messages resolve to False. Only used from the event loop.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries: Dict[str, QueuedPublish] = {} # topic -> latest message, oldest first
+        self.superseded = 0
+        self.expired = 0
+        self.overflowed = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, topic: str, payload: str, qos: int, future: asyncio.Future,
+            expires: Optional[float] = None, retain: bool = False):
+        previous = self._entries.pop(topic, None)
+        if previous is not None:
+            self.superseded += 1
+            _settle(previous.future, False)
+        elif len(self._entries) >= self.max_size:
+            oldest = next(iter(self._entries))
+            self.overflowed += 1
+            logger.warning(f"Offline queue full ({self.max_size} topics). Dropping queued publish to {oldest}")
+            _settle(self._entries.pop(oldest).future, False)
+        self._entries[topic] = QueuedPublish(payload, qos, expires, future, retain)
+
+    def holds(self, topic: str, future: asyncio.Future) -> bool:
+        """True while the message behind ``future`` is the one queued for ``topic``."""
+        entry = self._entries.get(topic)
+        return entry is not None and entry.future is future
+
+    def drain(self, now: float) -> List[Tuple[str, QueuedPublish]]:
+        """Empty the queue, returning the messages that have not expired at loop time ``now``, oldest first."""
+        entries, self._entries = self._entries, {}
+        live = []
+        for topic, entry in entries.items():
+            if entry.expires is not None and entry.expires <= now:
+                self.expired += 1
+                logger.info(f"Dropping expired queued publish to {topic}: {entry.payload}")
+                _settle(entry.future, False)
+                continue
+            live.append((topic, entry))
+        return live
+
+    def clear(self):
+        """Drop everything still queued."""
+        for entry in self._entries.values():
+            _settle(entry.future, False)
+        self._entries.clear()
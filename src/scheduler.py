@@ -0,0 +1,175 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """
+    Fires on absolute ``loop.time()`` deadlines spaced exactly ``period`` apart.
+
+    Each deadline is computed from the first one, never from when the
+    previous cycle finished, so the time spent on light checks and publishes
+    does not push later cycles back. With ``phase`` set, deadlines fall
+    ``phase`` seconds into each period of the wall clock (``phase=15`` with
+    ``period=60`` fires at :15 every minute); without it the first deadline is
+    immediate. A deadline that is already more than ``grace`` seconds in the
+    past is skipped and counted in ``missed``.
+    """
+    __slots__ = ("period", "phase", "grace", "name", "wall_clock", "next_deadline", "fired", "missed", "last_lateness")
+
+    def __init__(self,
+                 period: float = 60.0,
+                 phase: Optional[float] = None,
+                 grace: float = 1.0,
+                 name: str = "",
+                 wall_clock: Callable[[], float] = time.time):
+        if period <= 0:
+            raise ValueError(f"Scheduler period must be positive, got {period}")
+        self.period = period
+        self.phase = phase
+        self.grace = grace
+        self.name = name
+        self.wall_clock = wall_clock
+
+        self.next_deadline: Optional[float] = None
+        self.fired = 0
+        self.missed = 0
+        self.last_lateness = 0.0
+
+    def first_deadline(self, loop: asyncio.AbstractEventLoop) -> float:
+        """Loop time of the first deadline: now, or the next wall-clock instant matching ``phase``."""
+        now = loop.time()
+        if self.phase is None:
+            return now
+        return now + (self.phase - self.wall_clock()) % self.period
+
+    def reset(self):
+        """Forget the schedule; the next wait() starts over from the first deadline."""
+        self.next_deadline = None
+
+    async def wait(self) -> float:
+        """
+        Sleep until the next deadline and return it.
+
+        Deadlines missed by more than ``grace`` (e.g. after the loop was
+        stalled) are skipped rather than fired in a burst.
+        """
+        loop = asyncio.get_running_loop()
+        if self.next_deadline is None:
+            self.next_deadline = self.first_deadline(loop)
+
+        lateness = loop.time() - self.next_deadline
+        if lateness > self.grace:
+            skipped = math.ceil((lateness - self.grace) / self.period)
+            self.next_deadline += skipped * self.period
+            self.missed += skipped
+            logger.warning(f"Scheduler {self.name} missed {skipped} deadline(s), {lateness:.3f}s behind schedule. Resuming at the next deadline.")
+
+        delay = self.next_deadline - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        deadline = self.next_deadline
+        self.last_lateness = max(0.0, loop.time() - deadline)
+        self.next_deadline = deadline + self.period
+        self.fired += 1
+        return deadline
+
+
+def _spread(slot: int) -> float:
+    """
+    Fraction of the period for the ``slot``-th member: 0, 1/2, 1/4, 3/4, 1/8...
+
+    (the binary digits of ``slot`` mirrored behind the point). However many
+    slots are in use, every new one lands in the middle of the largest gap
+    and no two slots share a fraction.
+    """
+    fraction, scale = 0.0, 0.5
+    while slot:
+        if slot & 1:
+            fraction += scale
+        slot >>= 1
+        scale /= 2
+    return fraction
+
+
+class PulseCoordinator:
+    """
+    Spreads the pulses of many MistBuddies over the cycle period.
+
+    Every registered controller gets its own phase, shifted by its tent's
+    ``phase_offset``, so pulses no longer line up on the second each ONOFF
+    message happened to arrive. A phase is assigned once at register() and
+    kept: a member added or removed later never moves (or lands on) the
+    phase of one that is running, and a freed phase goes to the next member
+    registered. ``max_concurrent`` additionally caps how many pulses may be
+    running (relays energized) at the same time; a pulse over the cap waits
+    for a running one to finish.
+    """
+
+    def __init__(self,
+                 stagger: bool = True,
+                 max_concurrent: Optional[int] = None,
+                 tent_offsets: Optional[Dict[str, float]] = None):
+        self.stagger = stagger
+        self.max_concurrent = max_concurrent
+        self.tent_offsets = dict(tent_offsets or {})
+        self._members: Dict[Hashable, Tuple[str, int]] = {} # controller -> (tent, slot)
+        self._free_slots: List[int] = [] # heap of slots given back by unregister()
+        self._next_slot = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active_pulses = 0
+        self.delayed_pulses = 0
+
+    def register(self, member: Hashable, tent_name: str):
+        if member in self._members:
+            self.unregister(member)
+        if self._free_slots:
+            slot = heapq.heappop(self._free_slots)
+        else:
+            slot = self._next_slot
+            self._next_slot += 1
+        self._members[member] = (tent_name, slot)
+
+    def unregister(self, member: Hashable):
+        entry = self._members.pop(member, None)
+        if entry is not None:
+            heapq.heappush(self._free_slots, entry[1])
+
+    def phase_for(self, member: Hashable, period: float) -> Optional[float]:
+        """Phase of ``member`` within ``period``, or None when staggering is off or it is not registered."""
+        if not self.stagger:
+            return None
+        entry = self._members.get(member)
+        if entry is None:
+            return None
+        tent_name, slot = entry
+        return (self.tent_offsets.get(tent_name, 0.0) + _spread(slot) * period) % period
+
+    async def acquire_pulse(self, duration: float):
+        """
+        Wait for a free pulse slot and hold it for ``duration`` seconds.
+
+        The slot is released by a loop timer, so the caller is not blocked
+        for the length of the pulse.
+        """
+        if not self.max_concurrent:
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self._semaphore.locked():
+            self.delayed_pulses += 1
+            logger.debug("Pulse slots full (%s running). Waiting for a free slot.", self.max_concurrent)
+        await self._semaphore.acquire()
+        self.active_pulses += 1
+        asyncio.get_running_loop().call_later(duration, self._release_pulse)
+
+    def _release_pulse(self):
+        self.active_pulses -= 1
+        self._semaphore.release()
@@ -0,0 +1,311 @@
+"""
+Runs the tents of one config in several worker processes.
+
+Every tent is assigned to one of N shards by a CRC32 of its name, so the
+assignment is the same on every start and does not depend on the order of
+the config file. Each shard runs in its own process as a normal
+MistBuddySupervisor (one event loop and one MQTT connection) over only its
+tents; adding CPU cores adds event loops for JSON parsing, logging and
+publishing.
+
+The parent process only supervises the workers. Each worker sends a dump of
+its metrics registry every ``report_interval`` seconds; those reports double
+as heartbeats. A worker that exits, or stays silent for
+``heartbeat_timeout`` seconds (e.g. its loop is stuck), is restarted with an
+exponential backoff. The parent serves the merged metrics of all workers
+on ``metrics_port``.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src import metrics
+from src.appconfig import AppConfig
+from src.config_watcher import ConfigWatcher
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+SHARD_UP = metrics.REGISTRY.gauge(
+    "mistbuddy_shard_up", "1 while the worker process of a shard is running and reporting", ["shard"])
+SHARD_RESTARTS = metrics.REGISTRY.counter(
+    "mistbuddy_shard_restarts_total", "Times the worker process of a shard was restarted", ["shard"])
+
+# Restart delays of a failing worker: doubling from the first to the last
+RESTART_BACKOFF = (1.0, 60.0)
+# A worker that ran this long before failing starts over at the shortest delay
+STABLE_AFTER = 60.0
+
+
+def shard_for(tent_name: str, shards: int) -> int:
+    """The shard a tent belongs to (stable across runs and Python versions)."""
+    return zlib.crc32(tent_name.encode("utf-8")) % shards
+
+
+def shard_path(path: Path | str, index: int) -> Path:
+    """``path`` with the shard index before its suffix: state.jsonl -> state.shard1.jsonl."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.shard{index}{path.suffix}")
+
+
+def shard_config(config: AppConfig, index: int, shards: int) -> AppConfig:
+    """
+    The part of ``config`` that shard ``index`` of ``shards`` runs.
+
+    Only the shard's tents are kept. Files a worker writes get the shard in
+    their name, the stats topic gets a ``/shard<index>`` level, and the
+    metrics endpoint is left to the parent process.
+    """
+    settings = config.supervisor_settings
+    update: Dict[str, object] = {"metrics_port": None}
+    for field in ("state_journal", "trace_file", "watchdog_file"):
+        path = getattr(settings, field)
+        if path is not None:
+            update[field] = str(shard_path(path, index))
+    if settings.stats_topic:
+        update["stats_topic"] = f"{settings.stats_topic}/shard{index}"
+    return config.model_copy(update={
+        "tents_settings": {name: tent for name, tent in config.tents_settings.items() if shard_for(name, shards) == index},
+        "supervisor_settings": settings.model_copy(update=update),
+    })
+
+
+def _run_worker(index: int, shards: int, config_json: str, config_path: Optional[str],
+                reports: "multiprocessing.Queue", report_interval: float, queued_logging: bool):
+    """Entry point of a worker process: run the supervisor of one shard until SIGTERM/SIGINT."""
+    from src.logger_setup import logger_setup, stop_queued_logging
+    from src.supervisor import MistBuddySupervisor
+
+    logger_setup('', queued=queued_logging)
+    try:
+        config = AppConfig.model_validate_json(config_json)
+        supervisor = MistBuddySupervisor(config, config_path=config_path, shard=(index, shards))
+
+        async def report():
+            while True:
+                # Never blocks: the queue's feeder thread does the pipe I/O
+                reports.put_nowait((index, os.getpid(), metrics.REGISTRY.dump()))
+                await asyncio.sleep(report_interval)
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, supervisor.stop)
+            reporter = loop.create_task(report())
+            try:
+                await supervisor.run()
+            finally:
+                reporter.cancel()
+                await asyncio.gather(reporter, return_exceptions=True)
+
+        asyncio.run(main())
+    finally:
+        logger.info(f"Shard {index} worker (pid {os.getpid()}) finished.")
+        stop_queued_logging()
+
+
+class ShardWorker:
+    """The parent's view of one worker process."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.started_at = 0.0
+        self.last_report = 0.0
+        self.restart_at: Optional[float] = None # monotonic time of a pending restart
+        self.backoff = RESTART_BACKOFF[0]
+        self.restarts = 0
+        self.metrics: Dict[str, Dict[str, object]] = {} # last reported registry dump
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class ShardedRunner:
+    """
+    Starts one worker process per shard and keeps them running.
+
+    Workers are spawned (not forked), so each starts from a clean
+    interpreter. stop() shuts them down with SIGTERM, which every worker
+    handles like a normal supervisor shutdown (misting stops, devices are
+    powered off). ``shards`` defaults to the config's ``shards`` setting.
+    With ``config_path`` the workers hot-reload the file themselves, and
+    the parent follows it too so a restarted worker gets the latest config.
+    """
+
+    def __init__(self, config: AppConfig, shards: Optional[int] = None,
+                 config_path: Optional[Path | str] = None, queued_logging: bool = True):
+        settings = config.supervisor_settings
+        shards = settings.shards if shards is None else shards
+        if shards < 1:
+            raise ValueError(f"Number of shards must be at least 1, got {shards}")
+        self.config = config
+        self.shards = shards
+        self.config_path = None if config_path is None else str(config_path)
+        self.report_interval = settings.shard_report_interval
+        self.heartbeat_timeout = settings.shard_heartbeat_timeout
+        self.queued_logging = queued_logging
+        self._context = multiprocessing.get_context("spawn")
+        self._reports = self._context.Queue()
+        self.workers: List[ShardWorker] = [ShardWorker(index) for index in range(shards)]
+        # Metrics of worker processes that have since been replaced, so totals never go backwards
+        self._retired = metrics.MetricsRegistry()
+        self.registry = metrics.MetricsRegistry()
+        self._shutdown: Optional[asyncio.Event] = None
+        self._metrics_server: Optional[metrics.MetricsServer] = None
+
+        for index in range(shards):
+            tents = [name for name in config.tents_settings if shard_for(name, shards) == index]
+            logger.info(f"Shard {index}: {len(tents)} tent(s) {tents}")
+            if not tents:
+                logger.warning(f"Shard {index} has no tents. Its worker idles until the config gives it some.")
+
+    def _start_worker(self, worker: ShardWorker):
+        process = self._context.Process(
+            target=_run_worker,
+            args=(worker.index, self.shards, self.config.model_dump_json(), self.config_path,
+                  self._reports, self.report_interval, self.queued_logging),
+            name=f"mistbuddy-shard{worker.index}",
+            daemon=False,
+        )
+        process.start()
+        worker.process = process
+        worker.started_at = worker.last_report = time.monotonic()
+        worker.restart_at = None
+        logger.info(f"Started shard {worker.index} worker (pid {process.pid}).")
+
+    def _retire_worker(self, worker: ShardWorker, reason: str):
+        """Forget a dead worker process and schedule its restart."""
+        now = time.monotonic()
+        if now - worker.started_at >= STABLE_AFTER:
+            worker.backoff = RESTART_BACKOFF[0]
+        worker.restart_at = now + worker.backoff
+        logger.error(f"Shard {worker.index} worker {reason}. Restarting it in {worker.backoff:.0f}s.")
+        worker.backoff = min(worker.backoff * 2, RESTART_BACKOFF[1])
+        worker.process = None
+        self._retired.merge(worker.metrics, gauges=False)
+        worker.metrics = {}
+        SHARD_UP.labels(str(worker.index)).set(0)
+        self._rebuild_registry()
+
+    def _drain_reports(self) -> bool:
+        """Take every queued worker report. Returns True if there were any."""
+        received = False
+        while True:
+            try:
+                index, pid, dumped = self._reports.get_nowait()
+            except queue.Empty:
+                return received
+            worker = self.workers[index]
+            # Ignore a late report of a process that has already been replaced
+            if worker.process is None or worker.process.pid != pid:
+                continue
+            worker.metrics = dumped
+            worker.last_report = time.monotonic()
+            SHARD_UP.labels(str(index)).set(1)
+            received = True
+
+    def _rebuild_registry(self):
+        registry = metrics.MetricsRegistry()
+        registry.merge(self._retired.dump())
+        for worker in self.workers:
+            registry.merge(worker.metrics)
+        registry.merge(metrics.REGISTRY.dump())
+        self.registry = registry
+        if self._metrics_server is not None:
+            self._metrics_server.registry = registry
+
+    def check_workers(self):
+        """Health check: restart workers that exited or stopped reporting. Runs on the event loop."""
+        if self._drain_reports():
+            self._rebuild_registry()
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is None:
+                if worker.restart_at is not None and now >= worker.restart_at:
+                    worker.restarts += 1
+                    SHARD_RESTARTS.labels(str(worker.index)).inc()
+                    self._start_worker(worker)
+                continue
+            if not worker.process.is_alive():
+                self._retire_worker(worker, f"(pid {worker.process.pid}) exited with code {worker.process.exitcode}")
+            elif now - worker.last_report > self.heartbeat_timeout:
+                process = worker.process
+                process.kill()
+                process.join(1.0)
+                self._retire_worker(worker, f"(pid {process.pid}) sent no report for {now - worker.last_report:.0f}s and was killed")
+
+    async def _on_config_change(self, config: AppConfig):
+        """ConfigWatcher callback: restarted workers start from ``config`` (running ones reload it themselves)."""
+        if config.supervisor_settings.shards != self.config.supervisor_settings.shards:
+            logger.warning("shards changed. Restart the service to split the tents differently.")
+        self.config = config
+
+    def stop(self):
+        """Ask run() to shut the workers down and return."""
+        if self._shutdown is not None:
+            self._shutdown.set()
+
+    async def _stop_workers(self, timeout: float = 10.0):
+        running = [worker.process for worker in self.workers if worker.is_alive()]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in running:
+            while process.is_alive() and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            if process.is_alive():
+                logger.warning(f"Worker {process.name} (pid {process.pid}) did not stop in time. Killing it.")
+                process.kill()
+            process.join(1.0)
+        for worker in self.workers:
+            worker.process = None
+            SHARD_UP.labels(str(worker.index)).set(0)
+
+    async def run(self, check_interval: float = 0.5):
+        """Run every shard's worker until stop(), SIGTERM or SIGINT."""
+        loop = asyncio.get_running_loop()
+        self._shutdown = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+        settings = self.config.supervisor_settings
+        if settings.metrics_port is not None:
+            self._metrics_server = metrics.MetricsServer(self.registry, host=settings.metrics_host, port=settings.metrics_port)
+            try:
+                await self._metrics_server.start()
+            except OSError as e:
+                logger.error(f"Could not start metrics endpoint on {settings.metrics_host}:{settings.metrics_port}: {e}")
+                self._metrics_server = None
+
+        watcher: Optional[ConfigWatcher] = None
+        if self.config_path is not None and settings.config_reload_interval:
+            watcher = ConfigWatcher(self.config_path, self._on_config_change, settings.config_reload_interval)
+            watcher.start()
+
+        for worker in self.workers:
+            self._start_worker(worker)
+        logger.info(f"Running {self.shards} shard worker(s).")
+        try:
+            while not self._shutdown.is_set():
+                self.check_workers()
+                try:
+                    await asyncio.wait_for(self._shutdown.wait(), check_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            logger.info("Stopping shard workers.")
+            if watcher is not None:
+                await watcher.stop()
+            await self._stop_workers()
+            if self._metrics_server is not None:
+                await self._metrics_server.stop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
+            logger.info("All shard workers stopped.")
@@ -0,0 +1,467 @@
+"""
+Accelerated simulation of MistBuddies on a virtual clock.
+
+Everything runs on a VirtualTimeEventLoop, whose clock jumps straight to the
+next scheduled timer instead of sleeping, against an in-memory broker and
+scripted Tasmota and snifferbuddy devices. The real controllers (through
+MistBuddySupervisor) run unchanged, so a day of misting cycles finishes in
+seconds and every pulse and skipped pulse ends up on a timeline.
+
+    python -m src.simulation --buddies 10 --hours 24 --drop 0.05 --timeline timeline.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import selectors
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from src.appconfig import AppConfig
+from src.light_state import LIGHT_STATE_KEY
+from src.supervisor import MistBuddySupervisor
+from src.topic_router import MessageHandler, TopicRouter
+from src import tasmota
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+# --- Virtual time ---
+
+class _VirtualSelector:
+    """
+    Selector that never blocks: when no file descriptor is ready it moves the
+    loop's clock forward by the timeout the loop asked to sleep for.
+    """
+
+    def __init__(self, loop: "VirtualTimeEventLoop"):
+        self._loop = loop
+        self._selector = selectors.DefaultSelector()
+
+    def select(self, timeout: Optional[float] = None):
+        events = self._selector.select(0)
+        if not events and timeout is not None and timeout > 0:
+            self._loop.advance(timeout)
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop whose ``time()`` is virtual.
+
+    Idle time costs nothing: instead of sleeping until the next timer, the
+    clock is advanced to it. ``wall_time()`` maps the virtual clock onto a
+    wall clock starting at ``start_wall`` (seconds since the epoch), for
+    code that aligns to time of day.
+    """
+
+    def __init__(self, start_wall: float = 0.0):
+        self._now = 0.0
+        self.start_wall = start_wall
+        super().__init__(_VirtualSelector(self))
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float):
+        self._now += seconds
+
+    def wall_time(self) -> float:
+        return self.start_wall + self._now
+
+
+# --- Timeline ---
+
+@dataclass
+class TimelineEvent:
+    time: float         # seconds on the timeline's clock (virtual wall clock in a simulation)
+    kind: str           # pulse, skip, relay_on, relay_off, light_query, dropped_response
+    source: str         # controller ONOFF topic or device topic
+    detail: Dict[str, Any] = field(default_factory=dict)
+
+
+class Timeline:
+    """Every event of a run, in the order they happened on ``clock``."""
+
+    def __init__(self, clock: Callable[[], float]):
+        self.clock = clock
+        self.events: List[TimelineEvent] = []
+
+    def record(self, kind: str, source: str, **detail):
+        self.events.append(TimelineEvent(round(self.clock(), 6), kind, source, detail))
+
+    def on_cycle(self, controller, lights_on: bool, report, skip_reason: Optional[str]):
+        """MistBuddySimple.on_cycle observer."""
+        if lights_on:
+            self.record("pulse", controller.control_topic,
+                        duration=controller.active_duration,
+                        ok=report.ok if report is not None else True,
+                        failed=report.failed if report is not None else [])
+        else:
+            self.record("skip", controller.control_topic, reason=skip_reason)
+
+    def counts(self) -> Counter:
+        return Counter(event.kind for event in self.events)
+
+    def write_jsonl(self, path: Path):
+        with open(path, "w") as f:
+            for event in self.events:
+                f.write(json.dumps(asdict(event)) + "\n")
+
+
+# --- In-memory broker ---
+
+class InMemoryBroker:
+    """
+    Routes publishes between SimulatedConnections after a fixed ``latency``.
+
+    Retained messages are not supported; the broker only forwards.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, latency: float = 0.005):
+        self.loop = loop
+        self.latency = latency
+        self.connections: List["SimulatedConnection"] = []
+        self.published = 0
+
+    def publish(self, topic: str, payload: str):
+        self.published += 1
+        for connection in self.connections:
+            if connection.router.match(topic):
+                self.loop.call_later(self.latency, connection.router.dispatch, topic, payload)
+
+
+class SimulatedConnection:
+    """
+    Stand-in for MqttConnection on an InMemoryBroker.
+
+    Offers the same subscribe/publish interface the controllers, light state
+    and PulseTime cache use. Publishes are acknowledged after one broker
+    round trip.
+    """
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+        self.router = TopicRouter()
+        self.connected = True
+        self._state_listeners: List[Callable[[bool], None]] = []
+        broker.connections.append(self)
+
+    def connect(self):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def subscribe(self, topic: str, handler: MessageHandler):
+        self.router.add(topic, handler)
+
+    def unsubscribe(self, topic: str, handler: MessageHandler):
+        self.router.remove(topic, handler)
+
+    def add_state_listener(self, listener: Callable[[bool], None]):
+        self._state_listeners.append(listener)
+
+    def remove_state_listener(self, listener: Callable[[bool], None]):
+        if listener in self._state_listeners:
+            self._state_listeners.remove(listener)
+
+    def set_connected(self, connected: bool):
+        """Simulate the broker link going down or coming back."""
+        self.connected = connected
+        for listener in list(self._state_listeners):
+            listener(connected)
+
+    def publish_nowait(self, topic: str, payload: str, qos: int = 1,
+                       ttl: Optional[float] = None, queue: bool = True, retain: bool = False) -> asyncio.Future:
+        future = self.broker.loop.create_future()
+        if not self.connected:
+            future.set_result(False)
+            return future
+        self.broker.publish(topic, payload)
+        if qos == 0:
+            future.set_result(True)
+        else:
+            self.broker.loop.call_later(2 * self.broker.latency, _settle, future, True)
+        return future
+
+    async def publish_async(self, topic: str, payload: str, qos: int = 1,
+                            timeout: float = 5.0, ttl: Optional[float] = None) -> bool:
+        try:
+            return await asyncio.wait_for(self.publish_nowait(topic, payload, qos, ttl), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+
+def _settle(future: asyncio.Future, result: bool):
+    if not future.done():
+        future.set_result(result)
+
+
+# --- Scripted devices ---
+
+class FakeTasmota:
+    """
+    One Tasmota relay behind a POWER topic.
+
+    Understands POWER, PulseTime and Backlog commands, switches itself off
+    when the PulseTime runs out and answers on ``stat/.../RESULT`` like the
+    real firmware.
+    """
+
+    def __init__(self, connection: SimulatedConnection, power_topic: str, timeline: Timeline):
+        self.connection = connection
+        self.power_topic = power_topic
+        self.timeline = timeline
+        self.pulsetime = 0
+        self.on = False
+        self._off_handle: Optional[asyncio.TimerHandle] = None
+        self.result_topic, lwt_topic = tasmota.device_status_topics(power_topic)
+        connection.subscribe(power_topic, self._on_power)
+        connection.subscribe(tasmota.pulsetime_topic(power_topic), self._on_pulsetime)
+        connection.subscribe(tasmota.backlog_topic(power_topic), self._on_backlog)
+        connection.publish_nowait(lwt_topic, "Online", qos=0)
+
+    def _on_power(self, topic: str, payload: str):
+        self._switch(payload.strip().upper() in ("ON", "1"))
+
+    def _on_pulsetime(self, topic: str, payload: str):
+        self._set_pulsetime(int(payload))
+
+    def _on_backlog(self, topic: str, payload: str):
+        for command in payload.split(";"):
+            name, _, value = command.strip().partition(" ")
+            if name.lower() == "pulsetime":
+                self._set_pulsetime(int(value))
+            elif name.upper() == "POWER":
+                self._switch(value.strip().upper() in ("ON", "1"))
+
+    def _set_pulsetime(self, value: int):
+        self.pulsetime = value
+        self.connection.publish_nowait(self.result_topic, json.dumps({"PulseTime1": {"Set": value, "Remaining": 0}}), qos=0)
+
+    def _switch(self, on: bool):
+        if self._off_handle is not None:
+            self._off_handle.cancel()
+            self._off_handle = None
+        if on and self.pulsetime:
+            # PulseTime 1..111 is tenths of a second, above that seconds + 100
+            seconds = self.pulsetime / 10 if self.pulsetime < tasmota.PULSETIME_MIN else self.pulsetime - 100
+            self._off_handle = self.connection.broker.loop.call_later(seconds, self._switch, False)
+        if on != self.on:
+            self.on = on
+            self.timeline.record("relay_on" if on else "relay_off", self.power_topic)
+        self.connection.publish_nowait(self.result_topic, json.dumps({"POWER": "ON" if on else "OFF"}), qos=0)
+
+
+class FakeSnifferBuddy:
+    """
+    The tent's light checker.
+
+    Answers Mem1 queries with 1 between ``lights_on_hour`` and
+    ``lights_off_hour`` of the virtual wall clock and 0 otherwise. Each
+    answer is dropped with ``drop_probability``.
+    """
+
+    def __init__(self,
+                 connection: SimulatedConnection,
+                 query_topic: str,
+                 response_topic: str,
+                 timeline: Timeline,
+                 lights_on_hour: float = 6.0,
+                 lights_off_hour: float = 22.0,
+                 drop_probability: float = 0.0,
+                 rng: Optional[random.Random] = None):
+        self.connection = connection
+        self.query_topic = query_topic
+        self.response_topic = response_topic
+        self.timeline = timeline
+        self.lights_on_hour = lights_on_hour
+        self.lights_off_hour = lights_off_hour
+        self.drop_probability = drop_probability
+        self.rng = rng or random.Random()
+        connection.subscribe(query_topic, self._on_query)
+
+    def lights_on(self) -> bool:
+        hour = (self.timeline.clock() % SECONDS_PER_DAY) / 3600
+        if self.lights_on_hour <= self.lights_off_hour:
+            return self.lights_on_hour <= hour < self.lights_off_hour
+        return hour >= self.lights_on_hour or hour < self.lights_off_hour # schedule across midnight
+
+    def _on_query(self, topic: str, payload: str):
+        self.timeline.record("light_query", self.query_topic)
+        if self.rng.random() < self.drop_probability:
+            self.timeline.record("dropped_response", self.query_topic)
+            return
+        self.connection.publish_nowait(self.response_topic, json.dumps({LIGHT_STATE_KEY: int(self.lights_on())}), qos=0)
+
+
+# --- Scenario ---
+
+def build_config(buddies: int,
+                 tents: int = 1,
+                 cycle_period: float = 60.0,
+                 stagger: bool = True,
+                 response_timeout: float = 2.0,
+                 buddy_settings: Optional[Dict[str, Any]] = None) -> AppConfig:
+    """
+    Configuration for ``buddies`` MistBuddies spread over ``tents`` tents.
+    ``buddy_settings`` are extra MistBuddyDeviceSettings fields for every MistBuddy.
+    """
+    per_tent = math.ceil(buddies / tents)
+    tents_settings = {}
+    for t in range(tents):
+        tent = f"tent_{t}"
+        names = [f"mistbuddy_{n}" for n in range(t * per_tent, min((t + 1) * per_tent, buddies))]
+        if not names:
+            continue
+        tents_settings[tent] = {
+            "MistBuddies": {
+                name: {
+                    "mqtt_onoff_topic": f"cmnd/{tent}/{name}/ONOFF",
+                    "mqtt_power_topics": [f"cmnd/{tent}/{name}/fan/POWER", f"cmnd/{tent}/{name}/mister/POWER"],
+                    "cycle_period": cycle_period,
+                    **(buddy_settings or {}),
+                }
+                for name in names
+            },
+            "LightCheck": {
+                "light_on_query_topic": f"cmnd/snifferbuddy/{tent}/sunshine/Mem1",
+                "light_on_response_topic": f"stat/snifferbuddy/{tent}/sunshine/RESULT",
+                "light_on_value": 1,
+                "response_timeout": response_timeout,
+            },
+        }
+    return AppConfig(
+        growbase_settings={"host_ip": "127.0.0.1"},
+        tents_settings=tents_settings,
+        supervisor_settings={"stagger_pulses": stagger},
+    )
+
+
+@dataclass
+class SimulationResult:
+    timeline: Timeline
+    virtual_seconds: float
+    real_seconds: float
+    broker_publishes: int
+
+    def summary(self) -> Dict[str, Any]:
+        counts = self.timeline.counts()
+        return {
+            "virtual_hours": round(self.virtual_seconds / 3600, 2),
+            "real_seconds": round(self.real_seconds, 3),
+            "pulses": counts["pulse"],
+            "skipped_pulses": counts["skip"],
+            "relay_on": counts["relay_on"],
+            "light_queries": counts["light_query"],
+            "dropped_responses": counts["dropped_response"],
+            "broker_publishes": self.broker_publishes,
+        }
+
+
+def run_simulation(config: AppConfig,
+                   hours: float = 24.0,
+                   duration: int = 15,
+                   start_wall: float = 0.0,
+                   lights_on_hour: float = 6.0,
+                   lights_off_hour: float = 22.0,
+                   drop_probability: float = 0.0,
+                   latency: float = 0.005,
+                   seed: int = 0,
+                   setup: Optional[Callable[[VirtualTimeEventLoop, InMemoryBroker, MistBuddySupervisor], None]] = None) -> SimulationResult:
+    """
+    Run every MistBuddy of ``config`` for ``hours`` of virtual time.
+
+    Each controller is switched on with a ``duration`` second ONOFF message at the start. The
+    virtual wall clock starts at ``start_wall`` (0 is midnight). ``setup``
+    may schedule extra events (outages, ONOFF changes) before the run.
+    """
+    loop = VirtualTimeEventLoop(start_wall)
+    rng = random.Random(seed)
+    timeline = Timeline(loop.wall_time)
+    broker = InMemoryBroker(loop, latency)
+    connection = SimulatedConnection(broker)
+    devices = SimulatedConnection(broker)
+    control = SimulatedConnection(broker)
+
+    supervisor = MistBuddySupervisor(config, connection=connection)
+    for tent_name, tent_settings in config.tents_settings.items():
+        FakeSnifferBuddy(devices, tent_settings.LightCheck.light_on_query_topic, tent_settings.LightCheck.light_on_response_topic,
+                         timeline, lights_on_hour, lights_off_hour, drop_probability, rng)
+    supervisor.context.wall_clock = loop.wall_time
+    supervisor.context.on_cycle = timeline.on_cycle
+    for controller in supervisor.controllers.values():
+        for topic in controller.power_topics:
+            FakeTasmota(devices, topic, timeline)
+    if setup is not None:
+        setup(loop, broker, supervisor)
+
+    async def scenario():
+        run = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0)
+        for controller in supervisor.controllers.values():
+            control.publish_nowait(controller.control_topic, str(duration), qos=0)
+        await asyncio.sleep(hours * 3600)
+        supervisor.stop()
+        await run
+
+    real_start = time.perf_counter()
+    try:
+        loop.run_until_complete(scenario())
+    finally:
+        # Light queries still waiting on a response when the run ended
+        leftovers = asyncio.all_tasks(loop)
+        for task in leftovers:
+            task.cancel()
+        if leftovers:
+            loop.run_until_complete(asyncio.gather(*leftovers, return_exceptions=True))
+        loop.close()
+    return SimulationResult(timeline, loop.time(), time.perf_counter() - real_start, broker.published)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run MistBuddies against simulated devices on a virtual clock")
+    parser.add_argument("--buddies", type=int, default=10, help="Number of simulated MistBuddies")
+    parser.add_argument("--tents", type=int, default=1, help="Number of tents they are spread over")
+    parser.add_argument("--hours", type=float, default=24.0, help="Virtual hours to run")
+    parser.add_argument("--duration", type=int, default=15, help="Pulse duration in seconds")
+    parser.add_argument("--period", type=float, default=60.0, help="Cycle period in seconds")
+    parser.add_argument("--lights", default="6-22", help="Lights-on window as <on hour>-<off hour>")
+    parser.add_argument("--drop", type=float, default=0.0, help="Probability a light check response is lost")
+    parser.add_argument("--no-stagger", action="store_true", help="Do not stagger the pulses")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="ERROR", help="Logging level of the controllers (e.g. INFO to follow every cycle)")
+    parser.add_argument("--timeline", type=Path, help="Write every event as JSON lines to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+    on_hour, _, off_hour = args.lights.partition("-")
+    config = build_config(args.buddies, args.tents, args.period, stagger=not args.no_stagger)
+    result = run_simulation(config, args.hours, args.duration,
+                            lights_on_hour=float(on_hour), lights_off_hour=float(off_hour),
+                            drop_probability=args.drop, seed=args.seed)
+    if args.timeline:
+        result.timeline.write_jsonl(args.timeline)
+    print(json.dumps(result.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import logging
+import time
+from typing import Dict, Optional
+
+from src import metrics
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    Records when each startup phase finished, in seconds since ``start``.
+
+    The offsets are kept in ``phases``, exported as the
+    mistbuddy_startup_seconds gauge, and logged in one line by report().
+    Once the MQTT connection comes up (watch_connection) the
+    "mqtt_connected" phase is added and the report is logged.
+    """
+
+    def __init__(self, start: Optional[float] = None):
+        self.start = time.perf_counter() if start is None else start
+        self.phases: Dict[str, float] = {}
+        self._connection = None
+
+    def mark(self, phase: str) -> float:
+        elapsed = time.perf_counter() - self.start
+        self.phases[phase] = elapsed
+        metrics.STARTUP_SECONDS.labels(phase).set(elapsed)
+        return elapsed
+
+    def report(self) -> str:
+        return ", ".join(f"{phase} {elapsed * 1000:.1f} ms" for phase, elapsed in self.phases.items())
+
+    def watch_connection(self, connection):
+        """Mark "mqtt_connected" and log the report when ``connection`` first comes up."""
+        self._connection = connection
+        connection.add_state_listener(self._on_connection_state)
+
+    def _on_connection_state(self, connected: bool):
+        """Connection state listener. Runs on the event loop."""
+        if not connected:
+            return
+        self._connection.remove_state_listener(self._on_connection_state)
+        self.mark("mqtt_connected")
+        logger.info(f"Startup timings (since launch): {self.report()}")
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ControllerState:
+    """What a controller was doing when it last changed: misting ``duration`` (0 when stopped) and cycle phase."""
+    duration: int
+    phase: Optional[float]  # seconds into each wall-clock period the pulses fall on
+    period: float
+    time: float             # wall clock time of the change
+
+
+class StateJournal:
+    """
+    Append-only journal of each controller's misting state, keyed by control topic.
+
+    Every start or stop is appended as one JSON line and flushed to disk
+    (with ``fsync``), so the state survives a crash or power cut. On the
+    event loop the writes are done in the loop's default executor: the
+    changes made while a write is in flight (e.g. a whole tent switched on
+    at once) are batched into the next one. flush() waits for them; without
+    a running loop record() writes before it returns. load() replays the
+    file, latest line per controller wins, and skips a line torn by a crash
+    mid-write. Once the file holds more than ``compact_after`` lines it is
+    rewritten with only the latest state of each controller (written to a
+    temporary file and renamed into place). Only used from one thread.
+    """
+
+    def __init__(self, path: Path | str, fsync: bool = True, compact_after: int = 1000):
+        self.path = Path(path)
+        self.fsync = fsync
+        self.compact_after = compact_after
+        self.states: Dict[str, ControllerState] = {}
+        self._lines = 0
+        self._torn = False # the file ends in a partial line that the next append must not extend
+        self._pending: List[str] = [] # recorded lines not yet handed to a write
+        self._writer: Optional[asyncio.Task] = None
+
+    def load(self) -> Dict[str, ControllerState]:
+        """Read the journal into ``states`` and return them."""
+        self.states = {}
+        self._lines = 0
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    self._lines += 1
+                    self._torn = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                        controller = entry.pop("controller")
+                        self.states[controller] = ControllerState(**entry)
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning(f"Skipping unreadable line {self._lines} of state journal {self.path}")
+        except FileNotFoundError:
+            return self.states
+        except OSError as e:
+            logger.error(f"Could not read state journal {self.path}: {e}")
+            return self.states
+        logger.info(f"Loaded state of {len(self.states)} controller(s) from {self.path}")
+        return self.states
+
+    def get(self, controller: str) -> Optional[ControllerState]:
+        return self.states.get(controller)
+
+    def record(self, controller: str, duration: int, phase: Optional[float], period: float):
+        """Note a state change of ``controller``; it is made durable in the background (see flush())."""
+        state = ControllerState(duration, None if phase is None else round(phase, 6), period, round(time.time(), 3))
+        self.states[controller] = state
+        self._pending.append(json.dumps({"controller": controller, **asdict(state)}) + "\n")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_batch(*self._take_batch())
+            return
+        if self._writer is None:
+            self._writer = loop.create_task(self._write_pending())
+
+    async def flush(self):
+        """Wait until every recorded change is on disk."""
+        while self._writer is not None:
+            await asyncio.shield(self._writer)
+
+    async def _write_pending(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                text, compact = self._take_batch()
+                written = await loop.run_in_executor(None, self._write_file, text, compact)
+                self._batch_written(compact, written)
+        finally:
+            self._writer = None
+
+    def _take_batch(self) -> Tuple[str, bool]:
+        """The text of the next write and whether it replaces the file. Runs where record() does."""
+        lines, self._pending = self._pending, []
+        if self._lines + len(lines) > self.compact_after:
+            return self._compacted(), True
+        self._lines += len(lines)
+        return ("\n" if self._torn else "") + "".join(lines), False
+
+    def _batch_written(self, compact: bool, written: bool):
+        if written:
+            self._torn = False
+            if compact:
+                self._lines = len(self.states)
+
+    def _write_batch(self, text: str, compact: bool):
+        self._batch_written(compact, self._write_file(text, compact))
+
+    def compact(self):
+        """Rewrite the journal with one line per controller."""
+        self._pending = []
+        self._write_batch(self._compacted(), True)
+
+    def _compacted(self) -> str:
+        return "".join(json.dumps({"controller": controller, **asdict(state)}) + "\n"
+                       for controller, state in self.states.items())
+
+    def _write_file(self, text: str, compact: bool) -> bool:
+        """Append ``text``, or with ``compact`` replace the file with it. Safe to run in an executor."""
+        if not compact:
+            return self._write(text, "a")
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        if not self._write(text, "w", tmp_path):
+            return False
+        os.replace(tmp_path, self.path)
+        return True
+
+    def _write(self, text: str, mode: str, path: Optional[Path] = None) -> bool:
+        path = path or self.path
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, mode) as f:
+                f.write(text)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            return True
+        except OSError as e:
+            logger.error(f"Could not write state journal {path}: {e}")
+            return False
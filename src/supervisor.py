@@ -0,0 +1,327 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from src.appconfig import AppConfig, MistBuddyDeviceSettings, TentSettings
+from src.config_watcher import ConfigWatcher
+from src.light_state import LightStateCache
+from src import metrics
+from src.metrics import MetricsServer, StatsPublisher
+from src.watchdog import LoopWatchdog
+from src.mistbuddy_simple import ControllerContext, MistBuddySimple
+from src.mqtt_connection import MqttConnection, create_connection
+from src.scheduler import PulseCoordinator
+from src.sharding import shard_config, shard_path
+from src.state_journal import StateJournal
+from src.tasmota import PulseTimeCache
+from src.tracing import Tracer
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+# Controllers are keyed by (tent name, MistBuddy id) as they appear in the config.
+ControllerKey = Tuple[str, str]
+
+
+class MistBuddySupervisor:
+    """
+    Runs every configured MistBuddy from one process and one event loop.
+
+    One MistBuddySimple controller is built per tent/MistBuddy entry in
+    ``AppConfig.tents_settings``. All controllers share a single MQTT
+    connection and its other resources (one ControllerContext) and run on
+    the same asyncio loop; an idle controller costs no task of its own.
+
+    With ``config_path`` the file is watched while running and every valid
+    change is applied by apply_config(): only the controllers whose settings
+    changed are rebuilt, the rest keep running untouched.
+
+    Each controller's misting state is kept in a StateJournal; on startup
+    the controllers that were misting resume with their duration, aligned to
+    their original cycle phase.
+
+    With ``shard`` set to (index, count) only the tents of that shard are run
+    (see src/sharding.py); every config, including a reloaded one, is cut
+    down to them first.
+    """
+
+    def __init__(self, config: AppConfig, connection: Optional[MqttConnection] = None,
+                 config_path: Optional[Path | str] = None, shard: Optional[Tuple[int, int]] = None):
+        self.shard = shard
+        if shard is not None:
+            config = shard_config(config, *shard)
+        self.config = config
+        self.config_path = config_path
+        # One string for every controller (the broker is only read at startup)
+        self.broker_ip = config.mqtt_broker_ip
+        self._owns_connection = connection is None
+        if connection is None:
+            connection = create_connection(self.broker_ip,
+                                           config.supervisor_settings.mqtt_transport,
+                                           offline_queue_size=config.supervisor_settings.offline_queue_size)
+            connection.connect()
+        self.connection = connection
+
+        self.controllers: Dict[ControllerKey, MistBuddySimple] = {}
+        self._running = False
+        self._shutdown: Optional[asyncio.Event] = None
+        # Set by the app to time the startup phases
+        self.startup_timer = None
+        supervisor_settings = config.supervisor_settings
+        self.coordinator: Optional[PulseCoordinator] = None
+        if supervisor_settings.stagger_pulses or supervisor_settings.max_concurrent_pulses:
+            self.coordinator = PulseCoordinator(
+                stagger=supervisor_settings.stagger_pulses,
+                max_concurrent=supervisor_settings.max_concurrent_pulses,
+                tent_offsets={name: tent.phase_offset for name, tent in config.tents_settings.items()},
+            )
+        # One light state per tent, shared by all of its MistBuddies
+        self.light_states: Dict[str, LightStateCache] = {}
+        # Last PulseTime of every device, shared by all controllers on the connection
+        self.pulsetime_cache = PulseTimeCache(self.connection)
+        self.tracer: Optional[Tracer] = None
+        if supervisor_settings.trace_capacity:
+            self.tracer = Tracer(supervisor_settings.trace_capacity,
+                                 path=supervisor_settings.trace_file,
+                                 max_bytes=supervisor_settings.trace_file_max_bytes)
+            if supervisor_settings.trace_query_topic:
+                response_topic = supervisor_settings.trace_response_topic or f"{supervisor_settings.trace_query_topic}/result"
+                self.tracer.serve(self.connection, supervisor_settings.trace_query_topic, response_topic)
+        self.journal: Optional[StateJournal] = None
+        if supervisor_settings.restore_state:
+            journal_path = supervisor_settings.state_journal
+            if journal_path is None and config_path is not None:
+                journal_path = Path(config_path).parent / "mistbuddy-state.jsonl"
+                if shard is not None:
+                    journal_path = shard_path(journal_path, shard[0])
+            if journal_path is not None:
+                self.journal = StateJournal(journal_path)
+                self.journal.load()
+        self.context = ControllerContext(self.connection, self.coordinator, self.pulsetime_cache, self.tracer, self.journal)
+        for tent_name, tent_settings in config.tents_settings.items():
+            for mistbuddy_id, mb_settings in tent_settings.MistBuddies.items():
+                state = self.journal.get(mb_settings.mqtt_onoff_topic) if self.journal is not None else None
+                if state is not None and state.duration > 0:
+                    logger.info(f"Restoring misting of {tent_name}/{mistbuddy_id}: duration={state.duration}s, phase={state.phase}")
+                    self._add_controller(tent_name, mistbuddy_id, tent_settings, mb_settings,
+                                         initial_duration=state.duration, initial_phase=state.phase)
+                else:
+                    self._add_controller(tent_name, mistbuddy_id, tent_settings, mb_settings)
+        logger.info(f"Supervisor initialized with {len(self.controllers)} MistBuddy controller(s).")
+
+    def _add_controller(self, tent_name: str, mistbuddy_id: str, tent_settings: TentSettings,
+                        mb_settings: MistBuddyDeviceSettings, initial_duration: Optional[int] = None,
+                        initial_phase: Optional[float] = None) -> MistBuddySimple:
+        """Build one controller (and its tent's light state if needed) on the shared connection."""
+        light_state = self.light_states.get(tent_name)
+        if light_state is None:
+            light_state = self.light_states[tent_name] = LightStateCache(tent_settings.LightCheck, self.connection, name=tent_name)
+        logger.info(f"Creating MistBuddySimple instance for {tent_name}/{mistbuddy_id}")
+        controller = MistBuddySimple(
+            broker_ip=self.broker_ip,
+            control_topic=mb_settings.mqtt_onoff_topic,
+            power_topics=mb_settings.mqtt_power_topics,
+            light_check_settings=tent_settings.LightCheck,
+            use_backlog=mb_settings.use_backlog,
+            parallel_power=mb_settings.parallel_power,
+            light_state=light_state,
+            cycle_period=mb_settings.cycle_period,
+            cycle_phase=mb_settings.cycle_phase,
+            deadline_grace=mb_settings.deadline_grace,
+            control_debounce=mb_settings.control_debounce,
+            cache_pulsetime=mb_settings.cache_pulsetime,
+            initial_duration=initial_duration,
+            initial_phase=initial_phase,
+            context=self.context,
+        )
+        self.controllers[(tent_name, mistbuddy_id)] = controller
+        if self.coordinator is not None:
+            self.coordinator.register(controller, tent_name)
+        return controller
+
+    def _start_controller(self, key: ControllerKey):
+        tent_name, mistbuddy_id = key
+        try:
+            self.controllers[key].start()
+        except Exception as e:
+            # The other controllers keep running
+            logger.error(f"Controller mistbuddy:{tent_name}/{mistbuddy_id} failed to start: {e}", exc_info=True)
+
+    async def _retire_controller(self, key: ControllerKey, removed: bool = False) -> Optional[Tuple[int, float]]:
+        """
+        Stop one controller (misting stops and its devices are powered off),
+        detach it from the connection and forget it. Returns the misting
+        duration and cycle phase it was running, if any. A controller
+        ``removed`` from the config is journaled as stopped so a restart
+        does not bring it back.
+        """
+        controller = self.controllers.pop(key)
+        running = (controller.active_duration, controller.running_phase()) if controller.is_misting() else None
+        if self._running:
+            try:
+                await controller.shutdown()
+            except Exception as e:
+                logger.error(f"Error shutting down controller mistbuddy:{key[0]}/{key[1]}: {e}", exc_info=True)
+        if removed and self.journal is not None:
+            self.journal.record(controller.control_topic, 0, None, controller.cycle_period)
+        controller.close()
+        # Its series would otherwise be exported forever; a rebuilt controller starts them over
+        for family in (metrics.PULSES, metrics.CYCLE_LATENESS_SECONDS, metrics.MISSED_DEADLINES):
+            family.remove(controller.control_topic)
+        if self.coordinator is not None:
+            self.coordinator.unregister(controller)
+        return running
+
+    async def apply_config(self, config: AppConfig):
+        """
+        Switch to ``config`` while running, touching only what changed.
+
+        Controllers of removed MistBuddies are stopped; new ones are started.
+        A MistBuddy whose settings (or whose tent's LightCheck) changed is
+        rebuilt and resumes misting with the duration and cycle phase it was
+        running. With staggered pulses, a changed ``phase_offset`` of a tent
+        rebuilds its MistBuddies too, so their running cycles move to the new
+        phase. Everything else, including running misting cycles, is left
+        alone.
+        Broker and supervisor settings are only read at startup; a change
+        to them is logged and needs a restart.
+        """
+        if self.shard is not None:
+            config = shard_config(config, *self.shard)
+        old = self.config
+        if config.growbase_settings != old.growbase_settings:
+            logger.warning("growbase_settings changed. Restart the service to connect to the new broker.")
+        if config.supervisor_settings != old.supervisor_settings:
+            logger.warning("supervisor_settings changed. Restart the service to apply them.")
+
+        old_tents, new_tents = old.tents_settings, config.tents_settings
+        staggered = self.coordinator is not None and self.coordinator.stagger
+        removed: List[ControllerKey] = []
+        changed: List[ControllerKey] = []
+        for key in self.controllers:
+            tent_name, mistbuddy_id = key
+            new_tent = new_tents.get(tent_name)
+            if new_tent is None or mistbuddy_id not in new_tent.MistBuddies:
+                removed.append(key)
+            elif (new_tent.LightCheck != old_tents[tent_name].LightCheck
+                  or new_tent.MistBuddies[mistbuddy_id] != old_tents[tent_name].MistBuddies[mistbuddy_id]
+                  or (staggered and new_tent.phase_offset != old_tents[tent_name].phase_offset)):
+                changed.append(key)
+        added = [(tent_name, mistbuddy_id)
+                 for tent_name, tent_settings in new_tents.items()
+                 for mistbuddy_id in tent_settings.MistBuddies
+                 if (tent_name, mistbuddy_id) not in self.controllers]
+
+        resume: Dict[ControllerKey, Optional[Tuple[int, float]]] = {}
+        for key in removed:
+            await self._retire_controller(key, removed=True)
+        for key in changed:
+            resume[key] = await self._retire_controller(key)
+        # A tent's light state goes with its LightCheck settings
+        for tent_name in list(self.light_states):
+            if tent_name not in new_tents or new_tents[tent_name].LightCheck != old_tents[tent_name].LightCheck:
+                self.light_states.pop(tent_name).close()
+        if self.coordinator is not None:
+            # Read by phase_for() when a cycle starts; the cycles it affects are rebuilt below
+            self.coordinator.tent_offsets = {name: tent.phase_offset for name, tent in new_tents.items()}
+
+        self.config = config
+        for key in changed + added:
+            tent_name, mistbuddy_id = key
+            tent_settings = new_tents[tent_name]
+            duration, phase = resume.get(key) or (None, None)
+            self._add_controller(tent_name, mistbuddy_id, tent_settings, tent_settings.MistBuddies[mistbuddy_id],
+                                 initial_duration=duration, initial_phase=phase)
+            if self._running:
+                self._start_controller(key)
+        logger.info(f"Configuration applied: {len(added)} added, {len(removed)} removed, {len(changed)} reconfigured, "
+                    f"{len(self.controllers) - len(added) - len(changed)} unchanged MistBuddy controller(s).")
+
+    def stop(self):
+        """Ask the supervisor to shut every controller down; run() returns once they have."""
+        if self._shutdown is not None:
+            self._shutdown.set()
+
+    async def run(self):
+        """Run all controllers on the current loop until stopped or cancelled."""
+        settings = self.config.supervisor_settings
+        watch_config = self.config_path is not None and bool(settings.config_reload_interval)
+        if not self.controllers:
+            if not watch_config and self.shard is None:
+                logger.warning("No MistBuddies configured. Nothing to run.")
+                return
+            logger.warning("No MistBuddies configured. Waiting for the config file to add some.")
+
+        if self._owns_connection:
+            try:
+                self.connection.loop_start()
+            except Exception as e:
+                logger.critical(f"Failed to start shared MQTT network loop: {e}", exc_info=True)
+                return
+
+        self._shutdown = asyncio.Event()
+        metrics_server: Optional[MetricsServer] = None
+        if settings.metrics_port is not None:
+            metrics_server = MetricsServer(host=settings.metrics_host, port=settings.metrics_port)
+            try:
+                await metrics_server.start()
+            except OSError as e:
+                logger.error(f"Could not start metrics endpoint on {settings.metrics_host}:{settings.metrics_port}: {e}")
+                metrics_server = None
+        stats_publisher: Optional[StatsPublisher] = None
+        if settings.stats_topic:
+            stats_publisher = StatsPublisher(self.connection, settings.stats_topic, settings.stats_interval)
+            stats_publisher.start()
+        watchdog: Optional[LoopWatchdog] = None
+        if settings.watchdog_threshold is not None:
+            watchdog = LoopWatchdog(settings.watchdog_threshold,
+                                    log_file=settings.watchdog_file,
+                                    connection=self.connection,
+                                    topic=settings.watchdog_topic,
+                                    min_report_interval=settings.watchdog_min_interval)
+            watchdog.start()
+
+        self._running = True
+        for key in self.controllers:
+            self._start_controller(key)
+        logger.info(f"Supervisor running {len(self.controllers)} MistBuddy controller(s) on one event loop.")
+        if self.startup_timer is not None:
+            self.startup_timer.mark("controllers_running")
+        watcher: Optional[ConfigWatcher] = None
+        if watch_config:
+            watcher = ConfigWatcher(self.config_path, self.apply_config, settings.config_reload_interval)
+            watcher.start()
+        try:
+            # Controllers work through callbacks and their misting tasks; nothing to poll here
+            await self._shutdown.wait()
+        except asyncio.CancelledError:
+            logger.info("Supervisor cancellation requested. Shutting down controllers.")
+        finally:
+            self._running = False
+            if watcher is not None:
+                await watcher.stop()
+            # Let every controller run its own cleanup (stop misting, power off)
+            controllers = list(self.controllers.items())
+            results = await asyncio.gather(*(controller.shutdown() for _, controller in controllers), return_exceptions=True)
+            for (tent_name, mistbuddy_id), result in zip(controllers, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error shutting down controller mistbuddy:{tent_name}/{mistbuddy_id}: {result}", exc_info=result)
+            if self.journal is not None:
+                await self.journal.flush()
+            if self.tracer is not None:
+                self.tracer.close()
+            if watchdog is not None:
+                watchdog.stop()
+            if stats_publisher is not None:
+                await stats_publisher.stop()
+            if metrics_server is not None:
+                await metrics_server.stop()
+
+            if self._owns_connection:
+                try:
+                    self.connection.loop_stop()
+                    logger.info("Shared MQTT network loop stopped.")
+                except Exception as e:
+                    logger.error(f"Error during shared MQTT cleanup: {e}", exc_info=True)
+            logger.info("Supervisor shutdown complete.")
@@ -0,0 +1,133 @@
+import json
+import logging
+import math
+from typing import Dict, Optional, Tuple
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+# Tasmota PulseTime: 1..111 is tenths of a second, 112..64900 is seconds + 100
+PULSETIME_MIN = 112
+PULSETIME_MAX = 64900
+POWER_SUFFIX = "/POWER"
+
+
+def pulsetime_value(duration: float) -> int:
+    """Convert a pulse duration in seconds to the PulseTime value Tasmota expects."""
+    value = math.ceil(duration) + 100 # Use ceiling for safety
+    return min(max(value, PULSETIME_MIN), PULSETIME_MAX)
+
+
+def pulse_seconds(duration: float) -> int:
+    """Seconds a device really stays on for a pulse of ``duration`` (PulseTime is clamped, see pulsetime_value)."""
+    return pulsetime_value(duration) - 100
+
+
+def device_command_topic(power_topic: str, command: str) -> Optional[str]:
+    """
+    Derive another command topic for the same device from its POWER topic.
+
+    ``cmnd/tent_one/mistbuddy_1/fan/POWER`` with ``PulseTime`` becomes
+    ``cmnd/tent_one/mistbuddy_1/fan/PulseTime``. Returns None when the
+    topic does not follow the standard ``.../POWER`` pattern.
+    """
+    if not power_topic.endswith(POWER_SUFFIX):
+        return None
+    return power_topic[:-len("POWER")] + command
+
+
+def pulsetime_topic(power_topic: str) -> Optional[str]:
+    return device_command_topic(power_topic, "PulseTime")
+
+
+def backlog_topic(power_topic: str) -> Optional[str]:
+    return device_command_topic(power_topic, "Backlog")
+
+
+def backlog_pulse_payload(pulsetime: int) -> str:
+    """Backlog payload that sets PulseTime and switches the relay on in one message."""
+    return f"PulseTime {pulsetime}; POWER ON"
+
+
+def device_status_topics(power_topic: str) -> Optional[Tuple[str, str]]:
+    """
+    The ``stat/.../RESULT`` and ``tele/.../LWT`` topics of the device behind a POWER topic.
+
+    Returns None unless the topic follows Tasmota's default
+    ``cmnd/<device topic>/POWER`` full topic.
+    """
+    if not power_topic.startswith("cmnd/") or not power_topic.endswith(POWER_SUFFIX):
+        return None
+    device = power_topic[len("cmnd/"):-len(POWER_SUFFIX)]
+    return f"stat/{device}/RESULT", f"tele/{device}/LWT"
+
+
+class PulseTimeCache:
+    """
+    Last PulseTime value each Tasmota device is known to hold.
+
+    Once a device has the PulseTime a pulse needs, later pulses only have to
+    send ``POWER ON``. Entries only come from what the device itself reports
+    on its RESULT topic (a PUBACK just means the broker got the command). An
+    entry is dropped when the device's LWT changes (it went offline or came
+    back).
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._values: Dict[str, int] = {}        # power topic -> PulseTime
+        self._status_topics: Dict[str, str] = {} # stat/tele topic -> power topic
+
+    def watch(self, power_topic: str):
+        """Follow the device's RESULT and LWT topics so its entry stays truthful."""
+        topics = device_status_topics(power_topic)
+        if topics is None or topics[0] in self._status_topics:
+            return
+        for topic in topics:
+            self._status_topics[topic] = power_topic
+            self.connection.subscribe(topic, self._on_status)
+
+    def unwatch(self, power_topic: str):
+        topics = device_status_topics(power_topic)
+        if topics is None or topics[0] not in self._status_topics:
+            return
+        for topic in topics:
+            del self._status_topics[topic]
+            self.connection.unsubscribe(topic, self._on_status)
+        self._values.pop(power_topic, None)
+
+    def get(self, power_topic: str) -> Optional[int]:
+        return self._values.get(power_topic)
+
+    def invalidate(self, power_topic: str):
+        if self._values.pop(power_topic, None) is not None:
+            logger.debug("PulseTime cache invalidated for %s", power_topic)
+
+    def _on_status(self, topic: str, payload_str: str):
+        """Connection callback for a device's RESULT and LWT topics. Runs on the event loop."""
+        power_topic = self._status_topics.get(topic)
+        if power_topic is None:
+            return
+        if topic.endswith("/LWT"):
+            # Online after a reboot/reconnect, or Offline: either way re-send next time
+            logger.info(f"Device behind {power_topic} reported LWT '{payload_str}'. Re-sending PulseTime on next pulse.")
+            self.invalidate(power_topic)
+            return
+        try:
+            data = json.loads(payload_str)
+        except json.JSONDecodeError:
+            return
+        if not isinstance(data, dict):
+            return
+        # PulseTime replies look like {"PulseTime1":{"Set":130,"Remaining":0}}
+        for key, value in data.items():
+            if key.startswith("PulseTime") and isinstance(value, dict) and "Set" in value:
+                try:
+                    reported = int(value["Set"])
+                except (TypeError, ValueError):
+                    self.invalidate(power_topic)
+                    return
+                if self._values.get(power_topic) != reported:
+                    logger.debug("Device behind %s reports PulseTime %s", power_topic, reported)
+                self._values[power_topic] = reported
+                return
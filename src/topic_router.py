@@ -0,0 +1,142 @@
+import logging
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+# Handlers receive the topic and the already decoded UTF-8 payload.
+MessageHandler = Callable[[str, str], None]
+
+
+class _TrieNode:
+    """One topic level of the wildcard subscriptions."""
+    __slots__ = ("children", "handlers", "hash_handlers")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {} # level (or '+') -> node
+        self.handlers: List[MessageHandler] = []   # filter ends at this level
+        self.hash_handlers: List[MessageHandler] = [] # filter is '<this level>/#'
+
+
+def is_wildcard(topic_filter: str) -> bool:
+    return "+" in topic_filter or "#" in topic_filter
+
+
+class TopicRouter:
+    """
+    Maps MQTT topics to handlers for one shared connection.
+
+    Exact subscriptions (the ONOFF and RESULT topics of every controller) are
+    found with one dict lookup. Filters with ``+``/``#`` wildcards live in a
+    trie walked level by level, so dispatch cost does not grow with the number
+    of subscriptions. Every routed message is counted per topic.
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, List[MessageHandler]] = {}
+        self._root = _TrieNode()
+        self._wildcards: Dict[str, int] = {} # wildcard filter -> handler count
+        self.message_counts: Counter = Counter()
+        self.unmatched_count = 0
+
+    def add(self, topic_filter: str, handler: MessageHandler) -> bool:
+        """Register a handler. Returns True if this is the first handler for the filter."""
+        if not is_wildcard(topic_filter):
+            handlers = self._exact.setdefault(topic_filter, [])
+            handlers.append(handler)
+            return len(handlers) == 1
+
+        levels = topic_filter.split("/")
+        if "#" in levels[:-1] or any("#" in level and level != "#" for level in levels) \
+                or any("+" in level and level != "+" for level in levels):
+            raise ValueError(f"Invalid MQTT topic filter: '{topic_filter}'")
+        node = self._root
+        for level in levels:
+            if level == "#":
+                node.hash_handlers.append(handler)
+                break
+            node = node.children.setdefault(level, _TrieNode())
+        else:
+            node.handlers.append(handler)
+        self._wildcards[topic_filter] = self._wildcards.get(topic_filter, 0) + 1
+        return self._wildcards[topic_filter] == 1
+
+    def remove(self, topic_filter: str, handler: MessageHandler) -> bool:
+        """Unregister a handler. Returns True if no handler is left for the filter."""
+        if not is_wildcard(topic_filter):
+            handlers = self._exact.get(topic_filter)
+            if not handlers or handler not in handlers:
+                return False
+            handlers.remove(handler)
+            if not handlers:
+                del self._exact[topic_filter]
+                return True
+            return False
+
+        if topic_filter not in self._wildcards:
+            return False
+        node: Optional[_TrieNode] = self._root
+        for level in topic_filter.split("/"):
+            if level == "#":
+                target = node.hash_handlers
+                break
+            node = node.children.get(level)
+            if node is None:
+                return False
+        else:
+            target = node.handlers
+        if handler not in target:
+            return False
+        target.remove(handler)
+        self._wildcards[topic_filter] -= 1
+        if self._wildcards[topic_filter] == 0:
+            del self._wildcards[topic_filter]
+            return True
+        return False
+
+    def filters(self) -> List[str]:
+        """All topic filters that currently have a handler."""
+        return list(self._exact) + list(self._wildcards)
+
+    def match(self, topic: str) -> List[MessageHandler]:
+        """Handlers whose filter matches ``topic``."""
+        matched = list(self._exact.get(topic, ()))
+        if not self._wildcards:
+            return matched
+
+        levels = topic.split("/")
+        # Wildcards at the first level never match topics starting with '$'
+        nodes = [(self._root, 0)]
+        while nodes:
+            node, depth = nodes.pop()
+            if depth == 0 and topic.startswith("$"):
+                child = node.children.get(levels[0])
+                if child is not None:
+                    nodes.append((child, 1))
+                continue
+            # '#' matches the parent level too ('a/#' matches 'a')
+            matched.extend(node.hash_handlers)
+            if depth == len(levels):
+                matched.extend(node.handlers)
+                continue
+            for key in (levels[depth], "+"):
+                child = node.children.get(key)
+                if child is not None:
+                    nodes.append((child, depth + 1))
+        return matched
+
+    def dispatch(self, topic: str, payload_str: str) -> int:
+        """Call every matching handler. Returns how many handlers were called."""
+        handlers = self.match(topic)
+        if not handlers:
+            self.unmatched_count += 1
+            logger.debug("Ignoring message on unhandled topic: %s", topic)
+            return 0
+        self.message_counts[topic] += 1
+        for handler in handlers:
+            try:
+                handler(topic, payload_str)
+            except Exception as e:
+                logger.error(f"Error processing message for topic '{topic}' in handler: {e}", exc_info=True)
+        return len(handlers)
@@ -0,0 +1,265 @@
+"""
+Per-cycle tracing: a tree of timed spans from control message to relay command.
+
+A controller opens a root span for every misting cycle (and for every ONOFF
+command) and makes it the current span of its task. Code further down, in
+the light state cache or the power commands, wraps its steps in ``span()``,
+which adds a child to whatever span is current. Without a current span
+``span()`` returns one shared no-op context manager, so the instrumented
+paths cost next to nothing (and allocate nothing) when tracing is off. The current span lives in a context variable, so tasks
+created inside a span (the shared light query, parallel power commands)
+report into the right tree.
+
+Finished traces are kept in a ring buffer, optionally appended to a size
+rotated JSON lines file by a background thread, and can be queried over MQTT
+(see Tracer.serve).
+Times are time.monotonic() seconds; each span also carries its offset from
+the root in milliseconds.
+"""
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from collections import deque
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from src.logger_setup import DeferredQueueHandler
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("mistbuddy_current_span", default=None)
+# Returned by span() and activate() while no trace is active; reusable and reentrant
+_NO_SPAN = nullcontext(None)
+
+
+class Span:
+    """One timed step of a trace and the steps it contains."""
+    __slots__ = ("name", "start", "end", "outcome", "attrs", "children")
+
+    def __init__(self, name: str, start: Optional[float] = None, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.start = time.monotonic() if start is None else start
+        self.end: Optional[float] = None
+        self.outcome: Optional[str] = None
+        self.attrs: Dict[str, Any] = attrs or {}
+        self.children: List["Span"] = []
+
+    def child(self, name: str, start: Optional[float] = None, **attrs) -> "Span":
+        span = Span(name, start, attrs)
+        self.children.append(span)
+        return span
+
+    def finish(self, outcome: Optional[str] = None, end: Optional[float] = None, **attrs):
+        """End the span. The outcome defaults to one set earlier, else "ok"."""
+        self.end = time.monotonic() if end is None else end
+        self.outcome = outcome or self.outcome or "ok"
+        self.attrs.update(attrs)
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def to_dict(self, origin: Optional[float] = None) -> Dict[str, Any]:
+        origin = self.start if origin is None else origin
+        data: Dict[str, Any] = {
+            "name": self.name,
+            "start": round(self.start, 6),
+            "offset_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": None if self.end is None else round((self.end - self.start) * 1000, 3),
+            "outcome": self.outcome or "unfinished",
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def activate(span: Optional[Span]) -> AbstractContextManager[Optional[Span]]:
+    """Make ``span`` the current span of this task for the duration of the block."""
+    if span is None and _current_span.get() is None:
+        return _NO_SPAN
+    return _activate(span)
+
+
+@contextmanager
+def _activate(span: Optional[Span]) -> Iterator[Optional[Span]]:
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+def span(name: str, **attrs) -> AbstractContextManager[Optional[Span]]:
+    """
+    Time the block as a child of the current span and make it current.
+
+    Yields None when no trace is active. An exception marks the span
+    "error" ("cancelled" for cancellation, "timeout" for a timeout);
+    otherwise it ends with the outcome set on it inside the block, or "ok".
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NO_SPAN
+    return _child_span(parent.child(name, **attrs))
+
+
+@contextmanager
+def _child_span(child: Span) -> Iterator[Span]:
+    token = _current_span.set(child)
+    try:
+        yield child
+    except asyncio.CancelledError:
+        child.finish("cancelled")
+        raise
+    except asyncio.TimeoutError:
+        child.finish("timeout")
+        raise
+    except BaseException as e:
+        child.finish("error", error=repr(e))
+        raise
+    else:
+        if child.end is None:
+            child.finish()
+    finally:
+        _current_span.reset(token)
+
+
+class _TraceFileHandler(logging.Handler):
+    """Appends the trace carried as a record's ``msg`` to a rotated JSON lines file. Runs on the listener thread."""
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record.msg) + "\n")
+        except OSError as e:
+            logger.error(f"Could not write trace to {self.path}: {e}")
+
+    def _rotate(self):
+        for index in range(self.backup_count - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+class Tracer:
+    """
+    Collects finished traces.
+
+    The last ``capacity`` traces are kept in memory. With ``path`` set every
+    trace is also appended to that JSON lines file, which is rotated to
+    ``path.1`` .. ``path.<backup_count>`` once it grows past ``max_bytes``.
+    The file is written by a QueueListener thread, as in queued logging
+    (see src/logger_setup.py): record() only enqueues the trace, and its
+    JSON encoding and the file I/O happen off the event loop. close() writes
+    out what is queued and stops the thread.
+    """
+
+    def __init__(self, capacity: int = 256, path: Optional[str] = None,
+                 max_bytes: int = 1_000_000, backup_count: int = 3):
+        self.traces: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._connection = None
+        self._response_topic: Optional[str] = None
+        # Created with the first trace written to ``path``
+        self._file_queue: Optional[DeferredQueueHandler] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
+    def start_trace(self, name: str, start: Optional[float] = None, **attrs) -> Span:
+        """A new root span; hand it to record() once it is finished."""
+        return Span(name, start, attrs)
+
+    def record(self, root: Span, outcome: Optional[str] = None):
+        """Finish ``root`` if needed and store the trace."""
+        if root.end is None or outcome is not None:
+            root.finish(outcome, end=root.end)
+        trace = root.to_dict()
+        trace["wall_time"] = round(time.time(), 3)
+        self.traces.append(trace)
+        if self.path:
+            if self._file_queue is None:
+                self._start_writer()
+            # The stored trace is never changed afterwards, so the listener may encode it later
+            self._file_queue.handle(logging.makeLogRecord({"msg": trace}))
+
+    def _start_writer(self):
+        trace_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        self._file_queue = DeferredQueueHandler(trace_queue)
+        self._listener = logging.handlers.QueueListener(
+            trace_queue, _TraceFileHandler(self.path, self.max_bytes, self.backup_count))
+        self._listener.start()
+
+    def close(self):
+        """Write out the queued traces and stop the writer thread (no-op without a file)."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+            self._file_queue = None
+
+    def query(self, limit: int = 20, name: Optional[str] = None, controller: Optional[str] = None,
+              outcome: Optional[str] = None, min_duration_ms: Optional[float] = None) -> List[Dict[str, Any]]:
+        """The newest matching traces, oldest first."""
+        matches = []
+        for trace in reversed(self.traces):
+            if len(matches) >= limit:
+                break
+            if name is not None and trace["name"] != name:
+                continue
+            if controller is not None and trace.get("attrs", {}).get("controller") != controller:
+                continue
+            if outcome is not None and trace["outcome"] != outcome:
+                continue
+            if min_duration_ms is not None and (trace["duration_ms"] or 0) < min_duration_ms:
+                continue
+            matches.append(trace)
+        matches.reverse()
+        return matches
+
+    def serve(self, connection, query_topic: str, response_topic: str):
+        """
+        Answer trace queries over MQTT.
+
+        A message on ``query_topic`` holds an optional JSON object with the
+        arguments of query() (e.g. ``{"outcome": "failed", "limit": 5}``); the
+        matching traces are published as a JSON list to ``response_topic``.
+        """
+        self._connection = connection
+        self._response_topic = response_topic
+        connection.subscribe(query_topic, self._on_query)
+
+    def _on_query(self, topic: str, payload_str: str):
+        """Connection callback for the trace query topic. Runs on the event loop."""
+        try:
+            criteria = json.loads(payload_str) if payload_str.strip() else {}
+            if not isinstance(criteria, dict):
+                raise ValueError("expected a JSON object")
+            traces = self.query(**criteria)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Invalid trace query on {topic}: '{payload_str}' ({e})")
+            return
+        self._connection.publish_nowait(self._response_topic, json.dumps(traces), qos=0, queue=False)
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional
+
+from src import metrics
+
+# Get a logger specific to this module
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    """
+    Detects callbacks and coroutine steps that hold the event loop too long.
+
+    The loop runs a heartbeat every ``interval`` seconds and records how late
+    it woke up (scheduler lag). A separate thread watches the heartbeat; when
+    it has been silent for more than ``threshold`` seconds the loop is stuck
+    in one callback right now, so the thread grabs the loop thread's stack
+    with ``sys._current_frames()`` and reports it once per stall. Reports go
+    to the log, optionally to ``log_file`` (appended as JSON lines) and to
+    ``topic`` on ``connection`` once the loop is free again. At most one
+    report is made every ``min_report_interval`` seconds; the rest are only
+    counted.
+    """
+
+    def __init__(self,
+                 threshold: float = 0.25,
+                 interval: float = 0.05,
+                 log_file: Optional[str] = None,
+                 connection=None,
+                 topic: Optional[str] = None,
+                 min_report_interval: float = 60.0):
+        self.threshold = threshold
+        self.interval = interval
+        self.log_file = log_file
+        self.connection = connection
+        self.topic = topic
+        self.min_report_interval = min_report_interval
+
+        self.stalls = 0
+        self.suppressed = 0
+        self.reports: List[dict] = []   # the most recent reports, newest last
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0           # time.monotonic() of the last heartbeat
+        self._stall_reported = False
+        self._last_report = -float("inf")
+        self._beat_handle: Optional[asyncio.TimerHandle] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the heartbeat on the running loop and the watching thread."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._beat_handle = self._loop.call_later(self.interval, self._beat, self._loop.time() + self.interval)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog started (threshold={self.threshold}s)")
+
+    def stop(self):
+        self._stop.set()
+        if self._beat_handle is not None:
+            self._beat_handle.cancel()
+            self._beat_handle = None
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _beat(self, expected: float):
+        """Heartbeat. Runs on the event loop."""
+        now = self._loop.time()
+        metrics.LOOP_LAG_SECONDS.labels().observe(max(0.0, now - expected))
+        self._last_beat = time.monotonic()
+        self._stall_reported = False
+        self._beat_handle = self._loop.call_later(self.interval, self._beat, now + self.interval)
+
+    def _watch(self):
+        """Watching thread: report the loop's stack when the heartbeat goes quiet."""
+        while not self._stop.wait(self.interval / 2):
+            silent = time.monotonic() - self._last_beat - self.interval
+            if silent > self.threshold and not self._stall_reported:
+                self._stall_reported = True
+                self.stalls += 1
+                # Metrics are only touched on the loop; counted as soon as it is free again
+                self._loop.call_soon_threadsafe(metrics.LOOP_STALLS.labels().inc)
+                self._report(silent)
+
+    def _report(self, blocked_for: float):
+        """Capture and hand out the stack of the stuck loop thread. Runs in the watching thread."""
+        now = time.monotonic()
+        if now - self._last_report < self.min_report_interval:
+            self.suppressed += 1
+            return
+        self._last_report = now
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "<loop thread stack unavailable>"
+        report = {
+            "time": time.time(),
+            "blocked_for": round(blocked_for, 3),
+            "suppressed": self.suppressed,
+            "stack": stack,
+        }
+        self.suppressed = 0
+        self.reports = (self.reports + [report])[-10:]
+        logger.warning(f"Event loop blocked for {blocked_for:.3f}s+ (threshold {self.threshold}s). Loop thread stack:\n{stack}")
+        if self.log_file:
+            try:
+                with open(self.log_file, "a") as f:
+                    f.write(json.dumps(report) + "\n")
+            except OSError as e:
+                logger.error(f"Could not write watchdog report to {self.log_file}: {e}")
+        if self.connection is not None and self.topic:
+            # Published from the loop as soon as it is free again
+            self._loop.call_soon_threadsafe(self._publish, json.dumps(report))
+
+    def _publish(self, payload: str):
+        self.connection.publish_nowait(self.topic, payload, qos=0, queue=False)
@@ -0,0 +1,165 @@
+import asyncio
+
+from src.appconfig import LightCheckSettings
+from src.mistbuddy_simple import MistBuddySimple
+
+
+class FakeConnection:
+    """Records subscriptions and publishes in place of a live MQTT connection."""
+
+    def __init__(self, connected=True):
+        self.connected = connected
+        self.handlers = {}
+        self.published = []
+        self.queued = [] # publishes held for the reconnect while disconnected
+        self.state_listeners = []
+
+    def subscribe(self, topic, handler):
+        self.handlers.setdefault(topic, []).append(handler)
+
+    def unsubscribe(self, topic, handler):
+        self.handlers.get(topic, []).remove(handler)
+
+    def is_connected(self):
+        return self.connected
+
+    def add_state_listener(self, listener):
+        self.state_listeners.append(listener)
+
+    def remove_state_listener(self, listener):
+        self.state_listeners.remove(listener)
+
+    def set_connected(self, connected):
+        """Flip the connection state and notify the listeners, as a (re)connect would."""
+        self.connected = connected
+        for listener in list(self.state_listeners):
+            listener(connected)
+
+    def deliver(self, topic, payload):
+        """Hand an inbound message to the registered handlers."""
+        for handler in list(self.handlers.get(topic, ())):
+            handler(topic, payload)
+
+    def publish_nowait(self, topic, payload, qos=1, ttl=None, queue=True, retain=False):
+        future = asyncio.get_running_loop().create_future()
+        if self.connected:
+            self.published.append((topic, payload))
+            future.set_result(True)
+        elif queue:
+            self.queued.append((topic, payload)) # resolves on a reconnect that never comes here
+        else:
+            future.set_result(False)
+        return future
+
+    async def publish_async(self, topic, payload, qos=1, timeout=5.0, ttl=None):
+        if not self.connected:
+            # Like MqttConnection: taken into the offline queue counts as sent
+            self.queued.append((topic, payload))
+            return True
+        return await self.publish_nowait(topic, payload, qos)
+
+
+POWER_TOPICS = ["cmnd/tent_one/mistbuddy_1/fan/POWER", "cmnd/tent_one/mistbuddy_1/mister/POWER"]
+LIGHT_CHECK = LightCheckSettings(
+    light_on_query_topic="cmnd/snifferbuddy/tent_one/sunshine/Mem1",
+    light_on_response_topic="stat/snifferbuddy/tent_one/sunshine/RESULT",
+    light_on_value=1,
+    response_timeout=0.5,
+)
+
+
+
+class FakeBroker:
+    """
+    In-process MQTT 3.1.1 broker stand-in on a loopback port.
+
+    Answers CONNECT, QoS 1 PUBLISH, SUBSCRIBE and PINGREQ and records what
+    it was sent. ``reject`` sessions are closed right after their CONNECT,
+    without a CONNACK; drop() closes every open session.
+    """
+
+    def __init__(self):
+        self.port = None
+        self.connects = [] # loop.time() of every CONNECT
+        self.published = []
+        self.subscribed = []
+        self.reject = 0
+        self._server = None
+        self._writers = []
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.drop()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def drop(self):
+        for writer in self._writers:
+            writer.close()
+        self._writers.clear()
+
+    def send(self, topic, payload):
+        """Publish a short QoS 0 message to every connected client."""
+        body = len(topic).to_bytes(2, "big") + topic.encode() + payload.encode()
+        for writer in self._writers:
+            writer.write(bytes([0x30, len(body)]) + body)
+
+    async def _serve(self, reader, writer):
+        self._writers.append(writer)
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                length, shift = 0, 0
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                packet_type = header >> 4
+                if packet_type == 1: # CONNECT
+                    self.connects.append(asyncio.get_running_loop().time())
+                    if self.reject:
+                        self.reject -= 1
+                        break
+                    writer.write(b"\x20\x02\x00\x00")
+                elif packet_type == 3: # PUBLISH
+                    end = 2 + int.from_bytes(body[:2], "big")
+                    topic, rest = body[2:end].decode(), body[end:]
+                    if header & 0x06:
+                        writer.write(b"\x40\x02" + rest[:2]) # PUBACK with the message id
+                        rest = rest[2:]
+                    self.published.append((topic, rest.decode()))
+                elif packet_type == 8: # SUBSCRIBE
+                    pos, granted = 2, b""
+                    while pos < len(body):
+                        end = pos + 2 + int.from_bytes(body[pos:pos + 2], "big")
+                        self.subscribed.append(body[pos + 2:end].decode())
+                        pos, granted = end + 1, granted + b"\x00"
+                    writer.write(bytes([0x90, 2 + len(granted)]) + body[:2] + granted)
+                elif packet_type == 12: # PINGREQ
+                    writer.write(b"\xd0\x00")
+                elif packet_type == 14: # DISCONNECT
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if writer in self._writers:
+                self._writers.remove(writer)
+            writer.close()
+
+
+def make_buddy(connection, cls=MistBuddySimple, **kwargs) -> MistBuddySimple:
+    return cls(
+        broker_ip="127.0.0.1",
+        control_topic="cmnd/tent_one/mistbuddy_1/ONOFF",
+        power_topics=POWER_TOPICS,
+        light_check_settings=LIGHT_CHECK,
+        connection=connection,
+        **kwargs,
+    )
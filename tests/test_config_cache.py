@@ -0,0 +1,30 @@
+import os
+import shutil
+from pathlib import Path
+
+from src.config_cache import default_cache_path, load_config
+
+APPCONFIG = Path(__file__).resolve().parents[1] / "src" / "appconfig.yaml"
+
+
+def test_cached_config_is_used_until_the_file_changes(tmp_path):
+    path = tmp_path / "appconfig.yaml"
+    shutil.copy(APPCONFIG, path)
+
+    config, from_cache = load_config(path)
+    assert not from_cache
+    assert default_cache_path(path).exists()
+
+    cached, from_cache = load_config(path)
+    assert from_cache
+    assert cached == config
+
+    path.write_text(path.read_text() + "\n# edited\n")
+    os.utime(path, ns=(1, 1))
+    reloaded, from_cache = load_config(path)
+    assert not from_cache
+    assert reloaded == config
+
+    default_cache_path(path).write_text("not a cache")
+    assert load_config(path)[1] is False
+    assert load_config(path)[1] is True
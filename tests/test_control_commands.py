@@ -0,0 +1,98 @@
+import asyncio
+
+from src.mistbuddy_simple import MistBuddySimple
+from tests.fakes import FakeConnection, make_buddy
+
+CONTROL_TOPIC = "cmnd/tent_one/mistbuddy_1/ONOFF"
+
+
+class PatchableBuddy(MistBuddySimple):
+    """Has an instance __dict__ (no __slots__), so a test can swap misting_cycle out."""
+
+
+def run_with_buddy(scenario, **kwargs):
+    connection = FakeConnection()
+    buddy = make_buddy(connection, cls=PatchableBuddy, control_debounce=0.02, **kwargs)
+    started = []
+
+    async def fake_cycle(duration, trace=None):
+        started.append(duration)
+        await asyncio.Event().wait()
+
+    buddy.misting_cycle = fake_cycle
+
+    async def main():
+        buddy.loop = asyncio.get_running_loop()
+        try:
+            await scenario(connection, buddy)
+        finally:
+            await buddy.stop_misting_async()
+
+    asyncio.run(main())
+    return connection, buddy, started
+
+
+def test_burst_of_onoff_messages_applies_only_the_latest():
+    async def scenario(connection, buddy):
+        for seconds in ("10", "0", "12", "0", "15"):
+            connection.deliver(CONTROL_TOPIC, seconds)
+        await asyncio.sleep(0.05)
+        assert buddy.active_duration == 15
+
+    connection, _, started = run_with_buddy(scenario)
+    assert started == [15]
+
+
+def test_command_equal_to_running_state_is_a_no_op():
+    async def scenario(connection, buddy):
+        connection.deliver(CONTROL_TOPIC, "15")
+        await asyncio.sleep(0.05)
+        published = len(connection.published)
+        connection.deliver(CONTROL_TOPIC, "15")
+        await asyncio.sleep(0.05)
+        assert len(connection.published) == published
+
+    _, _, started = run_with_buddy(scenario)
+    assert started == [15]
+
+
+def test_stop_when_already_stopped_sends_nothing():
+    async def scenario(connection, buddy):
+        connection.deliver(CONTROL_TOPIC, "0")
+        await asyncio.sleep(0.05)
+        assert connection.published == []
+
+    run_with_buddy(scenario)
+
+
+def test_finished_misting_task_is_reported_without_polling():
+    async def scenario(connection, buddy):
+        async def short_cycle(duration, trace=None):
+            await asyncio.sleep(0)
+
+        buddy.misting_cycle = short_cycle
+        await buddy.start_misting(10)
+        await asyncio.sleep(0.01)
+        assert buddy.misting_task is None
+        assert buddy.active_duration is None
+
+    run_with_buddy(scenario)
+
+
+def test_run_waits_for_stop_and_follows_connection_state():
+    connection = FakeConnection()
+    buddy = make_buddy(connection)
+
+    async def main():
+        run = asyncio.create_task(buddy.run())
+        await asyncio.sleep(0)
+        assert buddy._on_connection_state in connection.state_listeners
+        connection.set_connected(False)
+        connection.set_connected(True)
+        assert not run.done()
+        buddy.stop()
+        await asyncio.wait_for(run, 1.0)
+
+    asyncio.run(main())
+    # Cleanup switched the devices off
+    assert connection.published[-1] == ("cmnd/tent_one/mistbuddy_1/mister/POWER", "OFF")
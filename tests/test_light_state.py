@@ -0,0 +1,122 @@
+import asyncio
+
+from src.appconfig import LightCheckSettings
+from src.light_state import LightStateCache
+from tests.fakes import FakeConnection
+
+QUERY_TOPIC = "cmnd/snifferbuddy/tent_one/sunshine/Mem1"
+RESPONSE_TOPIC = "stat/snifferbuddy/tent_one/sunshine/RESULT"
+
+
+def make_cache(connection, **kwargs) -> LightStateCache:
+    settings = LightCheckSettings(
+        light_on_query_topic=QUERY_TOPIC,
+        light_on_response_topic=RESPONSE_TOPIC,
+        light_on_value=1,
+        response_timeout=kwargs.pop("response_timeout", 0.5),
+        **kwargs,
+    )
+    return LightStateCache(settings, connection)
+
+
+def queries(connection):
+    return [topic for topic, _ in connection.published if topic == QUERY_TOPIC]
+
+
+def test_concurrent_requests_share_one_query():
+    connection = FakeConnection()
+    cache = make_cache(connection)
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(cache.lights_on()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        connection.deliver(RESPONSE_TOPIC, '{"Mem1":"1"}')
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(scenario()) == [True, True, True]
+    assert len(queries(connection)) == 1
+
+
+def test_cached_state_skips_query_within_ttl():
+    connection = FakeConnection()
+    cache = make_cache(connection, cache_ttl=30)
+
+    async def scenario():
+        first = asyncio.ensure_future(cache.lights_on())
+        await asyncio.sleep(0.01)
+        connection.deliver(RESPONSE_TOPIC, '{"Mem1":"0"}')
+        return await first, await cache.lights_on()
+
+    assert asyncio.run(scenario()) == (False, False)
+    assert len(queries(connection)) == 1
+
+
+def test_unsolicited_result_updates_cache():
+    connection = FakeConnection()
+    cache = make_cache(connection, cache_ttl=30)
+
+    async def scenario():
+        cache.attach_loop(asyncio.get_running_loop())
+        connection.deliver(RESPONSE_TOPIC, '{"POWER":"ON"}') # unrelated RESULT is ignored
+        connection.deliver(RESPONSE_TOPIC, '{"Mem1":1}')
+        await asyncio.sleep(0)
+        return await cache.lights_on()
+
+    assert asyncio.run(scenario()) is True
+    assert queries(connection) == []
+
+
+def test_timeout_assumes_lights_off():
+    connection = FakeConnection()
+    cache = make_cache(connection, response_timeout=0.01)
+    assert asyncio.run(cache.lights_on()) is False
+    assert cache.lights_on_value is None
+
+
+
+def test_close_cancels_the_running_query():
+    connection = FakeConnection()
+    cache = make_cache(connection, response_timeout=30)
+
+    async def scenario():
+        waiter = asyncio.ensure_future(cache.lights_on())
+        await asyncio.sleep(0.01)
+        task = cache._query_task
+        cache.close()
+        return await asyncio.wait_for(waiter, 1.0), task
+
+    lights_on, task = asyncio.run(scenario())
+    assert lights_on is False
+    assert task.cancelled()
+
+
+TELEMETRY_TOPIC = "tele/snifferbuddy/tent_one/sunshine/MEM"
+
+
+def test_pushed_telemetry_answers_without_network_call():
+    connection = FakeConnection()
+    cache = make_cache(connection, light_on_telemetry_topic=TELEMETRY_TOPIC, max_age=60)
+
+    async def scenario():
+        cache.attach_loop(asyncio.get_running_loop())
+        connection.deliver(TELEMETRY_TOPIC, '{"Mem1":"1"}')
+        await asyncio.sleep(0)
+        return [await cache.lights_on() for _ in range(5)]
+
+    assert asyncio.run(scenario()) == [True] * 5
+    assert connection.published == []
+
+
+def test_stale_telemetry_falls_back_to_query():
+    connection = FakeConnection()
+    cache = make_cache(connection, light_on_telemetry_topic=TELEMETRY_TOPIC, max_age=0.01, response_timeout=0.05)
+
+    async def scenario():
+        cache.attach_loop(asyncio.get_running_loop())
+        connection.deliver(TELEMETRY_TOPIC, '{"Mem1":"1"}')
+        await asyncio.sleep(0.02)
+        return await cache.lights_on()
+
+    # No response to the fallback query, so the stale ON is not trusted
+    assert asyncio.run(scenario()) is False
+    assert len(queries(connection)) == 1
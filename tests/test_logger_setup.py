@@ -0,0 +1,32 @@
+import logging
+import threading
+
+from src.logger_setup import DeferredQueueHandler, logger_setup, stop_queued_logging
+
+
+class ThreadRecorder:
+    """Remembers which thread turned it into text."""
+
+    def __init__(self):
+        self.formatted_on = None
+
+    def __str__(self):
+        self.formatted_on = threading.current_thread().name
+        return "payload"
+
+
+def test_queued_logging_formats_on_the_listener_thread(capsys):
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    try:
+        logger = logger_setup("src.test_queued", queued=True)
+        assert [type(h) for h in root.handlers] == [DeferredQueueHandler]
+        value = ThreadRecorder()
+        logger.info("Publishing to %s: %s", "cmnd/a/POWER", value)
+        stop_queued_logging() # drains the queue
+        assert value.formatted_on not in (None, threading.current_thread().name)
+        assert "Publishing to cmnd/a/POWER: payload" in capsys.readouterr().out
+    finally:
+        stop_queued_logging()
+        root.handlers[:] = saved_handlers
+        root.setLevel(saved_level)
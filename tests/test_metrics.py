@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+from src.metrics import Histogram, MetricsRegistry, MetricsServer, StatsPublisher
+from tests.fakes import FakeConnection
+
+
+def make_registry():
+    registry = MetricsRegistry()
+    pulses = registry.counter("pulses_total", "Pulses", ["controller", "outcome"])
+    rtt = registry.histogram("rtt_seconds", "Round trip", buckets=(0.01, 0.1, 1.0))
+    pulses.labels("cmnd/a/ONOFF", "fired").inc()
+    pulses.labels("cmnd/a/ONOFF", "fired").inc()
+    for value in (0.005, 0.05, 0.05, 2.0):
+        rtt.labels().observe(value)
+    return registry
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram((0.01, 0.1, 1.0))
+    for value in (0.005, 0.05, 0.05, 2.0):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 0, 1]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.count == 4
+
+
+def test_prometheus_text_format():
+    text = make_registry().render_prometheus()
+    assert '# TYPE pulses_total counter' in text
+    assert 'pulses_total{controller="cmnd/a/ONOFF",outcome="fired"} 2.0' in text
+    assert 'rtt_seconds_bucket{le="0.1"} 3' in text
+    assert 'rtt_seconds_bucket{le="+Inf"} 4' in text
+    assert 'rtt_seconds_count 4' in text
+
+
+def test_removed_label_values_leave_the_output():
+    registry = make_registry()
+    pulses = registry.families["pulses_total"]
+    pulses.labels("cmnd/a/ONOFF", "skipped").inc()
+    pulses.labels("cmnd/b/ONOFF", "fired").inc()
+    pulses.remove("cmnd/b/ONOFF", "fired")
+    assert set(pulses.children) == {("cmnd/a/ONOFF", "fired"), ("cmnd/a/ONOFF", "skipped")}
+    pulses.remove("cmnd/a/ONOFF") # every outcome of the controller
+    assert pulses.children == {}
+    assert 'controller="cmnd/a/ONOFF"' not in registry.render_prometheus()
+
+def test_merged_dumps_sum_counters_and_histograms():
+    source = make_registry()
+    source.gauge("phase_seconds", "Phase", ["phase"]).labels("config").set(0.2)
+    merged = MetricsRegistry()
+    merged.merge(source.dump())
+    merged.merge(source.dump(), gauges=False)
+
+    assert merged.families["pulses_total"].labels("cmnd/a/ONOFF", "fired").value == 4
+    rtt = merged.families["rtt_seconds"].labels()
+    assert rtt.buckets == (0.01, 0.1, 1.0)
+    assert rtt.counts == [2, 4, 0, 2] and rtt.count == 8
+    assert merged.families["phase_seconds"].labels("config").value == 0.2
+
+
+def test_metrics_endpoint_and_retained_stats():
+    registry = make_registry()
+    connection = FakeConnection()
+
+    async def scenario():
+        server = MetricsServer(registry, port=0)
+        await server.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        await server.stop()
+
+        StatsPublisher(connection, "mistbuddy/stats", registry=registry).publish()
+        return response.decode()
+
+    response = asyncio.run(scenario())
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert "rtt_seconds_sum" in response
+    topic, payload = connection.published[0]
+    assert topic == "mistbuddy/stats"
+    assert json.loads(payload)['pulses_total{controller="cmnd/a/ONOFF",outcome="fired"}'] == 2.0
+
+
+def test_controllers_record_cycles_and_light_check_timeouts():
+    from src import metrics
+    from src.simulation import build_config, run_simulation
+
+    skipped = metrics.PULSES.labels("cmnd/tent_0/mistbuddy_0/ONOFF", "skipped")
+    timeouts = metrics.LIGHT_CHECK_TIMEOUTS.labels("tent_0")
+    skipped_before, timeouts_before = skipped.value, timeouts.value
+
+    run_simulation(build_config(buddies=1), hours=0.2, lights_on_hour=0, lights_off_hour=24, drop_probability=1.0)
+
+    assert skipped.value - skipped_before >= 10
+    assert timeouts.value - timeouts_before == skipped.value - skipped_before
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from paho.mqtt import client as mqtt
+
+from src.mqtt_connection import AsyncioMqttConnection, MqttConnection, create_connection
+from tests.fakes import FakeBroker
+
+
+class FakePahoClient:
+    """Stands in for paho's Client: accepts publishes and hands out message ids."""
+
+    def __init__(self, connected=True):
+        self.connected = connected
+        self.published = []
+
+    def is_connected(self):
+        return self.connected
+
+    def subscribe(self, topic):
+        pass
+
+    def publish(self, topic, payload, qos=1, retain=False):
+        self.published.append((topic, payload, qos))
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=len(self.published))
+
+
+def make_connection(connected=True, offline_queue_size=256) -> MqttConnection:
+    connection = MqttConnection("127.0.0.1", offline_queue_size=offline_queue_size)
+    connection.client = FakePahoClient(connected)
+    return connection
+
+
+def test_publish_async_resolves_from_puback_on_network_thread():
+    connection = make_connection()
+
+    async def scenario():
+        publish = asyncio.ensure_future(connection.publish_async("cmnd/a/POWER", "ON"))
+        await asyncio.sleep(0)
+        # The PUBACK arrives on paho's thread, not the loop's
+        ack = threading.Thread(target=connection._on_publish, args=(None, None, 1, mqtt.ReasonCode(mqtt.PacketTypes.PUBACK, identifier=0), None))
+        ack.start()
+        ack.join()
+        return await publish
+
+    assert asyncio.run(scenario()) is True
+    assert connection._pending_publishes == {}
+
+
+def test_publishes_can_be_awaited_concurrently():
+    connection = make_connection()
+
+    async def scenario():
+        futures = [connection.publish_nowait(f"cmnd/{n}/POWER", "ON") for n in range(3)]
+        assert connection.client.published and len(connection._pending_publishes) == 3
+        for mid in (3, 1, 2):
+            connection._on_publish(None, None, mid, 0, None)
+        return await asyncio.gather(*futures)
+
+    assert asyncio.run(scenario()) == [True, True, True]
+
+
+def test_publish_async_times_out_without_blocking():
+    connection = make_connection()
+    assert asyncio.run(connection.publish_async("cmnd/a/POWER", "ON", timeout=0.01)) is False
+    assert connection._pending_publishes == {}
+
+
+def test_publish_when_disconnected_fails_immediately_without_queue():
+    connection = make_connection(connected=False, offline_queue_size=0)
+    assert asyncio.run(connection.publish_async("cmnd/a/POWER", "ON")) is False
+    assert connection.client.published == []
+
+
+def test_publish_async_returns_once_queued_while_disconnected():
+    connection = make_connection(connected=False)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        ok = await connection.publish_async("cmnd/a/POWER", "OFF", timeout=5.0)
+        return ok, loop.time() - start
+
+    ok, waited = asyncio.run(scenario())
+    assert ok is True and waited < 0.1
+    assert len(connection.offline_queue) == 1
+
+
+def test_offline_queue_coalesces_and_flushes_on_reconnect():
+    connection = make_connection(connected=False)
+
+    async def scenario():
+        connection._loop = asyncio.get_running_loop()
+        first = connection.publish_nowait("cmnd/a/POWER", "ON", ttl=10)
+        connection.publish_nowait("cmnd/a/PulseTime", "115")
+        latest = connection.publish_nowait("cmnd/a/POWER", "OFF")
+        expired = connection.publish_nowait("cmnd/b/POWER", "ON", ttl=0)
+        query = connection.publish_nowait("cmnd/sniffer/Mem1", "", queue=False)
+        assert connection.client.published == []
+
+        connection.client.connected = True
+        connection._on_connect(connection.client, None, None, 0, None)
+        await asyncio.sleep(0)
+        connection._on_publish(None, None, 2, 0, None)
+        return await first, await expired, await query, await latest
+
+    assert asyncio.run(scenario()) == (False, False, False, True)
+    # Only the final POWER state survives, in the order the commands were last issued
+    assert connection.client.published == [("cmnd/a/PulseTime", "115", 1), ("cmnd/a/POWER", "OFF", 1)]
+    assert len(connection.offline_queue) == 0
+
+
+def test_thread_backend_dispatches_handlers_on_the_loop_thread():
+    connection = make_connection()
+
+    async def scenario():
+        connection._loop = asyncio.get_running_loop()
+        received = asyncio.get_running_loop().create_future()
+        connection.subscribe("cmnd/a/ONOFF", lambda topic, payload: received.set_result((payload, threading.get_ident())))
+        message = SimpleNamespace(topic="cmnd/a/ONOFF", payload=b"15")
+        network = threading.Thread(target=connection._on_message, args=(None, None, message))
+        network.start()
+        network.join()
+        return await asyncio.wait_for(received, 1.0)
+
+    payload, handler_thread = asyncio.run(scenario())
+    assert payload == "15"
+    assert handler_thread == threading.get_ident()
+
+
+def test_create_connection_selects_backend():
+    assert type(create_connection("127.0.0.1", "asyncio")) is AsyncioMqttConnection
+    assert type(create_connection("127.0.0.1")) is MqttConnection
+    with pytest.raises(ValueError):
+        create_connection("127.0.0.1", "carrier-pigeon")
+
+
+async def wait_until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+
+def test_asyncio_backend_reconnects_with_backoff_against_a_broker():
+    async def scenario():
+        broker = FakeBroker()
+        await broker.start()
+        connection = AsyncioMqttConnection("127.0.0.1", port=broker.port)
+        connection.RECONNECT_DELAY_MIN = connection._reconnect_delay = 0.05
+        connection.RECONNECT_DELAY_MAX = 0.4
+        received, states = [], []
+        connection.subscribe("stat/a/RESULT", lambda topic, payload: received.append((threading.get_ident(), payload)))
+        connection.add_state_listener(states.append)
+        connection.loop_start()
+        try:
+            await wait_until(lambda: connection.is_connected() and broker.subscribed)
+            misc_task = connection._misc_task
+            assert misc_task is not None and not misc_task.done() # loop_misc runs as a loop task
+            # The PUBLISH goes out through the loop's writer, the PUBACK comes in through its reader
+            assert await connection.publish_async("cmnd/a/POWER", "ON") is True
+            broker.send("stat/a/RESULT", "ON")
+            await wait_until(lambda: received)
+            assert received == [(threading.get_ident(), "ON")]
+
+            # The connection drops and the next two sessions get no CONNACK:
+            # each attempt waits twice as long, until a CONNACK resets the backoff
+            broker.reject = 2
+            broker.drop()
+            await wait_until(lambda: len(broker.connects) == 4 and connection.is_connected(), timeout=5.0)
+            assert misc_task.done()
+            _, refused, refused_again, accepted = broker.connects
+            assert refused_again - refused >= 0.1 and accepted - refused_again >= 0.2
+            assert connection._reconnect_delay == 0.05
+            await wait_until(lambda: broker.subscribed == ["stat/a/RESULT"] * 2) # renewed on the new session
+            assert await connection.publish_async("cmnd/a/POWER", "OFF") is True
+            assert broker.published == [("cmnd/a/POWER", "ON"), ("cmnd/a/POWER", "OFF")]
+            assert states[0] is True and False in states and states[-1] is True
+        finally:
+            connection.loop_stop()
+            await asyncio.sleep(0.05)
+            await broker.close()
+
+    asyncio.run(scenario())
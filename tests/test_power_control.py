@@ -0,0 +1,125 @@
+import asyncio
+
+from src import tasmota
+from tests.fakes import POWER_TOPICS, FakeConnection, make_buddy
+
+
+def test_pulsetime_value_is_clamped():
+    assert tasmota.pulsetime_value(10) == 112 # minimum effective PulseTime
+    assert tasmota.pulsetime_value(15.2) == 116
+    assert tasmota.pulsetime_value(100000) == tasmota.PULSETIME_MAX
+    assert tasmota.pulse_seconds(10) == 12 and tasmota.pulse_seconds(15.2) == 16
+
+
+def test_derived_topics():
+    assert tasmota.backlog_topic(POWER_TOPICS[0]) == "cmnd/tent_one/mistbuddy_1/fan/Backlog"
+    assert tasmota.pulsetime_topic(POWER_TOPICS[1]) == "cmnd/tent_one/mistbuddy_1/mister/PulseTime"
+    assert tasmota.backlog_topic("cmnd/plug/TOGGLE") is None
+
+
+def test_power_on_sends_pulsetime_then_power():
+    connection = FakeConnection()
+    asyncio.run(make_buddy(connection).power_on(15))
+    assert connection.published == [
+        ("cmnd/tent_one/mistbuddy_1/fan/PulseTime", "115"),
+        ("cmnd/tent_one/mistbuddy_1/fan/POWER", "ON"),
+        ("cmnd/tent_one/mistbuddy_1/mister/PulseTime", "115"),
+        ("cmnd/tent_one/mistbuddy_1/mister/POWER", "ON"),
+    ]
+
+
+def test_power_on_with_backlog_sends_one_message_per_device():
+    connection = FakeConnection()
+    asyncio.run(make_buddy(connection, use_backlog=True).power_on(15))
+    assert connection.published == [
+        ("cmnd/tent_one/mistbuddy_1/fan/Backlog", "PulseTime 115; POWER ON"),
+        ("cmnd/tent_one/mistbuddy_1/mister/Backlog", "PulseTime 115; POWER ON"),
+    ]
+
+
+class SlowAckConnection(FakeConnection):
+    """Each publish is recorded at once but acknowledged only after a round trip."""
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def publish_async(self, topic, payload, qos=1, timeout=5.0, ttl=None):
+        self.published.append((topic, payload))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return not topic.startswith("cmnd/tent_one/mistbuddy_1/mister")
+
+
+def test_parallel_power_fans_out_and_reports_per_topic():
+    connection = SlowAckConnection()
+    report = asyncio.run(make_buddy(connection, use_backlog=True, parallel_power=True).power_on(15))
+
+    # Both devices were commanded before either acknowledgement came back
+    assert connection.max_in_flight == 2
+    assert [topic for topic, _ in connection.published] == [
+        "cmnd/tent_one/mistbuddy_1/fan/Backlog", "cmnd/tent_one/mistbuddy_1/mister/Backlog",
+    ]
+    assert report.command == "ON"
+    assert report.succeeded == [POWER_TOPICS[0]]
+    assert report.failed == [POWER_TOPICS[1]]
+    assert not report.ok
+
+
+def test_sequential_power_off_reports_all_topics():
+    connection = FakeConnection()
+    report = asyncio.run(make_buddy(connection).power_off())
+    assert connection.published == [(POWER_TOPICS[0], "OFF"), (POWER_TOPICS[1], "OFF")]
+    assert report.ok and report.results == {POWER_TOPICS[0]: True, POWER_TOPICS[1]: True}
+
+
+def test_cached_pulsetime_sends_only_power_on():
+    connection = FakeConnection()
+    buddy = make_buddy(connection)
+
+    async def scenario():
+        await buddy.power_on(15)
+        # Acknowledged by the broker is not enough: the devices have not confirmed it yet
+        assert buddy.pulsetime_cache.get(POWER_TOPICS[0]) is None
+        for device in ("fan", "mister"):
+            connection.deliver(f"stat/tent_one/mistbuddy_1/{device}/RESULT", '{"PulseTime1":{"Set":115,"Remaining":0}}')
+        connection.published.clear()
+        await buddy.power_on(15)
+
+    asyncio.run(scenario())
+    assert connection.published == [(topic, "ON") for topic in POWER_TOPICS]
+
+
+def test_pulse_while_disconnected_is_queued_as_one_backlog_message():
+    connection = FakeConnection(connected=False)
+    buddy = make_buddy(connection)
+
+    report = asyncio.run(buddy.power_on(15))
+    assert report.ok
+    assert connection.queued == [
+        ("cmnd/tent_one/mistbuddy_1/fan/Backlog", "PulseTime 115; POWER ON"),
+        ("cmnd/tent_one/mistbuddy_1/mister/Backlog", "PulseTime 115; POWER ON"),
+    ]
+
+
+def test_pulsetime_cache_invalidated_by_lwt_and_result():
+    connection = FakeConnection()
+    buddy = make_buddy(connection, use_backlog=True)
+
+    async def scenario():
+        await buddy.power_on(15)
+        for device in ("fan", "mister"):
+            connection.deliver(f"stat/tent_one/mistbuddy_1/{device}/RESULT", '{"PulseTime1":{"Set":115,"Remaining":0}}')
+        connection.deliver("tele/tent_one/mistbuddy_1/fan/LWT", "Online")
+        connection.deliver("stat/tent_one/mistbuddy_1/mister/RESULT", '{"PulseTime1":{"Set":130,"Remaining":0}}')
+        connection.published.clear()
+        await buddy.power_on(15)
+
+    asyncio.run(scenario())
+    assert connection.published == [
+        ("cmnd/tent_one/mistbuddy_1/fan/Backlog", "PulseTime 115; POWER ON"),
+        ("cmnd/tent_one/mistbuddy_1/mister/Backlog", "PulseTime 115; POWER ON"),
+    ]
+    # Until the device confirms the new value, the cache keeps what it last reported
+    assert buddy.pulsetime_cache.get(POWER_TOPICS[1]) == 130
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+
+from src.scheduler import DeadlineScheduler, PulseCoordinator
+
+
+def test_deadlines_do_not_drift_with_work_time():
+    scheduler = DeadlineScheduler(period=0.02)
+
+    async def scenario():
+        deadlines = []
+        for _ in range(5):
+            deadlines.append(await scheduler.wait())
+            await asyncio.sleep(0.012) # work that used to be added to every period
+        return deadlines
+
+    deadlines = asyncio.run(scenario())
+    gaps = [later - earlier for earlier, later in zip(deadlines, deadlines[1:])]
+    assert gaps == pytest.approx([0.02] * 4)
+    assert scheduler.missed == 0
+
+
+def test_stalled_loop_skips_and_reports_missed_deadlines():
+    scheduler = DeadlineScheduler(period=0.02, grace=0.005)
+
+    async def scenario():
+        first = await scheduler.wait()
+        time.sleep(0.07) # blocking call stalls the loop past several deadlines
+        second = await scheduler.wait()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert scheduler.missed >= 3
+    # Still on the original grid after resuming
+    assert (second - first) / 0.02 == pytest.approx(round((second - first) / 0.02))
+
+
+def test_phase_aligns_first_deadline_to_wall_clock():
+    scheduler = DeadlineScheduler(period=60, phase=15, wall_clock=lambda: 1_000_000 * 60 + 10.0)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        return scheduler.first_deadline(loop) - loop.time()
+
+    assert asyncio.run(scenario()) == pytest.approx(5.0, abs=0.01)
+
+
+def test_period_must_be_positive():
+    with pytest.raises(ValueError):
+        DeadlineScheduler(period=0)
+
+
+def test_coordinator_spreads_phases_with_tent_offsets():
+    coordinator = PulseCoordinator(tent_offsets={"tent_two": 5.0})
+    for name, tent in [("a", "tent_one"), ("b", "tent_one"), ("c", "tent_two"), ("d", "tent_two")]:
+        coordinator.register(name, tent)
+
+    assert [coordinator.phase_for(name, 60) for name in "abcd"] == [0.0, 30.0, 20.0, 50.0]
+    assert coordinator.phase_for("unknown", 60) is None
+    assert PulseCoordinator(stagger=False).phase_for("a", 60) is None
+
+    # Phases are kept across membership changes; a newcomer takes a freed one
+    coordinator.unregister("b")
+    coordinator.register("e", "tent_one")
+    coordinator.register("f", "tent_one")
+    phases = [coordinator.phase_for(name, 60) for name in "acdef"]
+    assert phases == [0.0, 20.0, 50.0, 30.0, 7.5]
+
+
+def test_coordinator_caps_concurrent_pulses():
+    coordinator = PulseCoordinator(stagger=False, max_concurrent=2)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = []
+
+        async def pulse(name):
+            await coordinator.acquire_pulse(0.03)
+            started.append((name, loop.time()))
+
+        begin = loop.time()
+        await asyncio.gather(*(pulse(n) for n in range(4)))
+        return [t - begin for _, t in started]
+
+    offsets = asyncio.run(scenario())
+    assert offsets[0] < 0.02 and offsets[1] < 0.02
+    assert offsets[2] >= 0.025 and offsets[3] >= 0.025
+    assert coordinator.delayed_pulses == 2
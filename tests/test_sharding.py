@@ -0,0 +1,168 @@
+import asyncio
+import itertools
+import queue
+import time
+
+from src import metrics
+from src.appconfig import AppConfig
+from src.sharding import RESTART_BACKOFF, STABLE_AFTER, ShardedRunner, shard_config, shard_for, shard_path
+from src.simulation import build_config
+from src.supervisor import MistBuddySupervisor
+from tests.fakes import FakeConnection
+
+
+def test_tents_are_split_deterministically_over_the_shards():
+    data = build_config(40, tents=20).model_dump(mode="json")
+    data["supervisor_settings"].update(metrics_port=9108, stats_topic="mistbuddy/stats", trace_file="/var/log/traces.jsonl")
+    config = AppConfig(**data)
+
+    parts = [shard_config(config, index, 3) for index in range(3)]
+    tents = [set(part.tents_settings) for part in parts]
+    assert set().union(*tents) == set(config.tents_settings)
+    assert sum(len(t) for t in tents) == len(config.tents_settings)
+    assert all(tents) # 20 tents leave no shard empty
+    assert all(shard_for(name, 3) == index for index, names in enumerate(tents) for name in names)
+
+    settings = parts[1].supervisor_settings
+    assert settings.metrics_port is None # served by the parent
+    assert settings.stats_topic == "mistbuddy/stats/shard1"
+    assert settings.trace_file == str(shard_path("/var/log/traces.jsonl", 1)) == "/var/log/traces.shard1.jsonl"
+
+
+def test_sharded_supervisor_runs_and_reloads_only_its_tents():
+    config = build_config(12, tents=6)
+    supervisor = MistBuddySupervisor(config, connection=FakeConnection(), shard=(0, 2))
+    assert {tent for tent, _ in supervisor.controllers} == {name for name in config.tents_settings if shard_for(name, 2) == 0}
+
+    reloaded = build_config(14, tents=7) # adds tent_6
+    asyncio.run(supervisor.apply_config(reloaded))
+    assert {tent for tent, _ in supervisor.controllers} == {name for name in reloaded.tents_settings if shard_for(name, 2) == 0}
+
+
+class FakeProcess:
+    """Stands in for a worker process; ``stops`` is whether it ends on SIGTERM."""
+
+    def __init__(self, pid, stops=True):
+        self.pid = pid
+        self.name = f"fake-shard-{pid}"
+        self.stops = stops
+        self.alive = False
+        self.exitcode = None
+        self.terminated = self.killed = False
+
+    def start(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def exit(self, code=1):
+        self.alive, self.exitcode = False, code
+
+    def terminate(self):
+        self.terminated = True
+        if self.stops:
+            self.exit(-15)
+
+    def kill(self):
+        self.killed = True
+        self.exit(-9)
+
+    def join(self, timeout=None):
+        pass
+
+
+class FakeContext:
+    """Spawns FakeProcesses instead of worker processes."""
+
+    def __init__(self):
+        self.pids = itertools.count(1000)
+
+    def Process(self, target, args, name, daemon):
+        return FakeProcess(next(self.pids))
+
+
+def make_runner(shards=2) -> ShardedRunner:
+    runner = ShardedRunner(build_config(4, tents=shards), shards)
+    runner._context = FakeContext()
+    runner._reports = queue.Queue()
+    for worker in runner.workers:
+        runner._start_worker(worker)
+    return runner
+
+
+def test_check_workers_restarts_dead_and_silent_workers_with_backoff():
+    runner = make_runner()
+    worker, other = runner.workers
+
+    # A worker that exits is restarted once its backoff is over, and the backoff doubles
+    first = worker.process
+    first.exit()
+    runner.check_workers()
+    assert worker.process is None
+    assert worker.restart_at - time.monotonic() <= RESTART_BACKOFF[0] and worker.backoff == 2 * RESTART_BACKOFF[0]
+    runner.check_workers()
+    assert worker.process is None # still waiting
+    worker.restart_at = time.monotonic()
+    runner.check_workers()
+    assert worker.process is not None and worker.process is not first and worker.restarts == 1
+
+    worker.process.exit() # again right away: the longer backoff applies
+    runner.check_workers()
+    assert worker.restart_at - time.monotonic() > RESTART_BACKOFF[0] and worker.backoff == 4 * RESTART_BACKOFF[0]
+    worker.restart_at = time.monotonic()
+    runner.check_workers()
+    worker.started_at -= STABLE_AFTER # ran long enough to count as stable: the backoff starts over
+    worker.process.exit()
+    runner.check_workers()
+    assert worker.restart_at - time.monotonic() <= RESTART_BACKOFF[0] and worker.backoff == 2 * RESTART_BACKOFF[0]
+
+    # A worker that is alive but stopped reporting is killed and restarted the same way
+    silent = other.process
+    runner._reports.put((other.index, silent.pid, {}))
+    runner.check_workers()
+    assert other.process is silent # its report counts as a heartbeat
+    other.last_report -= runner.heartbeat_timeout + 1
+    runner.check_workers()
+    assert silent.killed and other.process is None and other.restart_at is not None
+
+
+def test_stop_workers_kills_a_worker_that_ignores_sigterm():
+    runner = make_runner()
+    polite, stubborn = (worker.process for worker in runner.workers)
+    stubborn.stops = False
+
+    asyncio.run(runner._stop_workers(timeout=0.1))
+    assert polite.terminated and not polite.killed
+    assert stubborn.terminated and stubborn.killed
+    assert all(worker.process is None for worker in runner.workers)
+
+
+def test_parent_registry_merges_the_shards_and_keeps_retired_totals():
+    def dump(controller, fired):
+        registry = metrics.MetricsRegistry()
+        pulses = registry.counter("mistbuddy_test_pulses_total", "Pulses", ["controller"])
+        pulses.labels(controller).inc(fired)
+        pulses.labels("shared").inc(fired)
+        return registry.dump()
+
+    def pulses(controller):
+        return runner.registry.snapshot()[f'mistbuddy_test_pulses_total{{controller="{controller}"}}']
+
+    runner = make_runner()
+    worker, other = runner.workers
+    runner._reports.put((worker.index, worker.process.pid, dump("a", 3)))
+    runner._reports.put((other.index, other.process.pid, dump("b", 5)))
+    runner.check_workers()
+    assert (pulses("a"), pulses("b"), pulses("shared")) == (3, 5, 8)
+
+    # The restarted worker reports from zero; the totals of the one it replaced are kept
+    old_pid = worker.process.pid
+    worker.process.exit()
+    runner.check_workers()
+    worker.restart_at = time.monotonic()
+    runner.check_workers()
+    runner._reports.put((worker.index, old_pid, dump("a", 100))) # late report of the dead process is ignored
+    runner._reports.put((worker.index, worker.process.pid, dump("a", 1)))
+    runner.check_workers()
+    assert (pulses("a"), pulses("b"), pulses("shared")) == (4, 5, 9)
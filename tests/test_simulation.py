@@ -0,0 +1,31 @@
+from src.simulation import build_config, run_simulation
+
+
+def test_simulated_day_follows_light_schedule_in_virtual_time():
+    config = build_config(buddies=2, cycle_period=60)
+    result = run_simulation(config, hours=3, duration=15, lights_on_hour=1, lights_off_hour=2)
+
+    pulses = [e for e in result.timeline.events if e.kind == "pulse"]
+    skips = [e for e in result.timeline.events if e.kind == "skip"]
+    assert result.virtual_seconds >= 3 * 3600
+    assert result.real_seconds < 30
+    # Pulses only while the lights are on, one per buddy per minute
+    assert all(3600 <= e.time < 7200 + 60 for e in pulses)
+    assert len(pulses) == 2 * 60
+    # The two lights-off hours, less a cycle at the very start or end of the run
+    assert 2 * 120 - 2 <= len(skips) <= 2 * 120
+    assert all(e.detail["reason"] == "lights_off" for e in skips)
+    # Every pulse energized both relays
+    assert result.timeline.counts()["relay_on"] == 2 * len(pulses)
+
+
+def test_dropped_light_responses_become_skipped_pulses():
+    config = build_config(buddies=1)
+    result = run_simulation(config, hours=0.5, lights_on_hour=0, lights_off_hour=24, drop_probability=1.0)
+
+    counts = result.timeline.counts()
+    assert counts["pulse"] == 0
+    # The last query may still be waiting for its timeout when the run ends
+    assert counts["dropped_response"] - 1 <= counts["skip"] <= counts["dropped_response"]
+    assert counts["skip"] >= 29
+    assert {e.detail["reason"] for e in result.timeline.events if e.kind == "skip"} == {"no_response"}
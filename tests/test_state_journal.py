@@ -0,0 +1,96 @@
+import asyncio
+
+from src.appconfig import AppConfig
+from src.state_journal import StateJournal
+from src.supervisor import MistBuddySupervisor
+from tests.fakes import FakeConnection
+from tests.test_supervisor import make_config
+
+CONTROL_TOPIC = "cmnd/tent_one/mistbuddy_1/ONOFF"
+
+
+def test_journal_replays_latest_state_and_survives_a_torn_line(tmp_path):
+    path = tmp_path / "state.jsonl"
+    journal = StateJournal(path, fsync=False, compact_after=5)
+    journal.record("cmnd/a/ONOFF", 10, 12.5, 60.0)
+    journal.record("cmnd/b/ONOFF", 20, None, 60.0)
+    journal.record("cmnd/a/ONOFF", 0, None, 60.0)
+    with open(path, "a") as f:
+        f.write('{"controller": "cmnd/b/ONOFF", "durat') # crash mid-write
+
+    journal = StateJournal(path, fsync=False, compact_after=5)
+    restored = journal.load()
+    assert restored["cmnd/a/ONOFF"].duration == 0
+    assert restored["cmnd/b/ONOFF"].duration == 20
+
+    journal.record("cmnd/b/ONOFF", 15, 3.0, 60.0) # appended on a fresh line after the torn one
+    assert StateJournal(path).load()["cmnd/b/ONOFF"].phase == 3.0
+    journal.record("cmnd/a/ONOFF", 5, 1.0, 60.0) # over compact_after: rewritten
+    assert len(path.read_text().splitlines()) == 2
+    assert StateJournal(path).load()["cmnd/a/ONOFF"].duration == 5
+
+
+
+def test_journal_batches_writes_off_the_loop(tmp_path):
+    path = tmp_path / "state.jsonl"
+    journal = StateJournal(path, fsync=False, compact_after=5)
+
+    async def main():
+        for i in range(8):
+            journal.record(f"cmnd/{i}/ONOFF", 10, 1.0, 60.0)
+        assert not path.exists() # nothing written on the loop
+        await journal.flush()
+
+    asyncio.run(main())
+    # All eight went out in one batch, which was over compact_after
+    assert len(path.read_text().splitlines()) == 8
+    assert len(StateJournal(path).load()) == 8
+
+def test_supervisor_resumes_misting_at_its_phase_after_a_restart(tmp_path):
+    data = make_config().model_dump(mode="json")
+    data["supervisor_settings"] = {"state_journal": str(tmp_path / "state.jsonl")}
+    config = AppConfig(**data)
+
+    async def run_supervisor(command=None):
+        connection = FakeConnection()
+        supervisor = MistBuddySupervisor(config, connection=connection)
+        run = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.01)
+        if command is not None:
+            connection.deliver(CONTROL_TOPIC, command)
+            await asyncio.sleep(0.3) # debounce
+        controller = supervisor.controllers[("tent_one", "mistbuddy_1")]
+        state = (controller.is_misting(), controller.active_duration,
+                 controller.schedule.phase if controller.schedule else None)
+        supervisor.stop() # a shutdown is not a stop command: the state is kept
+        await asyncio.wait_for(run, 2.0)
+        return state
+
+    misting, duration, _ = asyncio.run(run_supervisor("10"))
+    assert misting and duration == 10
+    phase = StateJournal(config.supervisor_settings.state_journal).load()[CONTROL_TOPIC].phase
+
+    assert asyncio.run(run_supervisor()) == (True, 10, phase)
+    asyncio.run(run_supervisor("0"))
+    assert asyncio.run(run_supervisor()) == (False, None, None)
+
+
+def test_controller_removed_by_a_reload_is_journaled_as_stopped(tmp_path):
+    data = make_config().model_dump(mode="json")
+    data["supervisor_settings"] = {"state_journal": str(tmp_path / "state.jsonl")}
+    config = AppConfig(**data)
+
+    async def main():
+        connection = FakeConnection()
+        supervisor = MistBuddySupervisor(config, connection=connection)
+        run = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.01)
+        connection.deliver(CONTROL_TOPIC, "10")
+        await asyncio.sleep(0.3) # debounce
+        del data["tents_settings"]["tent_one"]["MistBuddies"]["mistbuddy_1"]
+        await supervisor.apply_config(AppConfig(**data))
+        supervisor.stop()
+        await asyncio.wait_for(run, 2.0)
+
+    asyncio.run(main())
+    assert StateJournal(config.supervisor_settings.state_journal).load()[CONTROL_TOPIC].duration == 0
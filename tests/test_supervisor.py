@@ -0,0 +1,212 @@
+import asyncio
+
+import pytest
+import yaml
+
+from src.appconfig import AppConfig
+from src.config_watcher import ConfigWatcher
+from src.supervisor import MistBuddySupervisor
+from tests.fakes import FakeConnection, make_buddy
+
+
+def make_config() -> AppConfig:
+    def light_check(tent):
+        return {
+            "light_on_query_topic": f"cmnd/snifferbuddy/{tent}/sunshine/Mem1",
+            "light_on_response_topic": f"stat/snifferbuddy/{tent}/sunshine/RESULT",
+            "light_on_value": 1,
+            "response_timeout": 0.5,
+        }
+
+    def buddy(tent, name):
+        return {
+            "mqtt_onoff_topic": f"cmnd/{tent}/{name}/ONOFF",
+            "mqtt_power_topics": [f"cmnd/{tent}/{name}/fan/POWER", f"cmnd/{tent}/{name}/mister/POWER"],
+        }
+
+    return AppConfig(
+        growbase_settings={"host_ip": "127.0.0.1"},
+        tents_settings={
+            "tent_one": {
+                "MistBuddies": {"mistbuddy_1": buddy("tent_one", "mistbuddy_1"),
+                                "mistbuddy_2": buddy("tent_one", "mistbuddy_2")},
+                "LightCheck": light_check("tent_one"),
+            },
+            "tent_two": {
+                "MistBuddies": {"mistbuddy_1": buddy("tent_two", "mistbuddy_1")},
+                "LightCheck": light_check("tent_two"),
+            },
+        },
+    )
+
+
+def test_supervisor_builds_one_controller_per_buddy_on_one_connection():
+    connection = FakeConnection()
+    supervisor = MistBuddySupervisor(make_config(), connection=connection)
+
+    assert set(supervisor.controllers) == {
+        ("tent_one", "mistbuddy_1"), ("tent_one", "mistbuddy_2"), ("tent_two", "mistbuddy_1"),
+    }
+    assert all(c.connection is connection for c in supervisor.controllers.values())
+    # Every ONOFF topic is handled, and buddies in a tent share its light state
+    assert len(connection.handlers["cmnd/tent_one/mistbuddy_2/ONOFF"]) == 1
+    assert len(connection.handlers["stat/snifferbuddy/tent_one/sunshine/RESULT"]) == 1
+    tent_one = [c for (tent, _), c in supervisor.controllers.items() if tent == "tent_one"]
+    assert tent_one[0].light_state is tent_one[1].light_state is supervisor.light_states["tent_one"]
+
+
+def test_deadline_grace_reaches_the_cycle_scheduler():
+    data = make_config().model_dump(mode="json")
+    data["tents_settings"]["tent_two"]["MistBuddies"]["mistbuddy_1"]["deadline_grace"] = 5.0
+    connection = FakeConnection()
+    supervisor = MistBuddySupervisor(AppConfig(**data), connection=connection)
+    controller = supervisor.controllers[("tent_two", "mistbuddy_1")]
+
+    async def main():
+        run = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.01)
+        connection.deliver(controller.control_topic, "10")
+        await asyncio.sleep(0.3) # debounce
+        grace = controller.schedule.grace
+        supervisor.stop()
+        await asyncio.wait_for(run, 2.0)
+        return grace
+
+    assert asyncio.run(main()) == 5.0
+
+def test_supervisor_runs_all_controllers_on_one_loop():
+    supervisor = MistBuddySupervisor(make_config(), connection=FakeConnection())
+
+    async def run_briefly():
+        task = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.05)
+        loops = {c.loop for c in supervisor.controllers.values()}
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return loops
+
+    loops = asyncio.run(run_briefly())
+    assert len(loops) == 1 and None not in loops
+
+
+def test_idle_controllers_are_compact_and_need_no_task():
+    supervisor = MistBuddySupervisor(make_config(), connection=FakeConnection())
+    controllers = list(supervisor.controllers.values())
+    assert all(c.context is supervisor.context for c in controllers)
+    assert not any(hasattr(c, "__dict__") for c in controllers)
+
+    async def main():
+        run = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.01)
+        # Only the supervisor's own run() task: idle controllers live on callbacks
+        assert asyncio.all_tasks() == {asyncio.current_task(), run}
+        supervisor.stop()
+        await asyncio.wait_for(run, 1.0)
+
+    asyncio.run(main())
+
+    # Shared resources come from the context only
+    with pytest.raises(ValueError, match="connection"):
+        make_buddy(FakeConnection(), context=supervisor.context)
+
+
+def test_supervisor_stop_ends_every_controller():
+    supervisor = MistBuddySupervisor(make_config(), connection=FakeConnection())
+
+    async def main():
+        run = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.01)
+        supervisor.stop()
+        await asyncio.wait_for(run, 1.0)
+
+    asyncio.run(main())
+    assert all(c.misting_task is None for c in supervisor.controllers.values())
+
+
+def test_apply_config_only_touches_changed_controllers(tmp_path):
+    connection = FakeConnection()
+    config = make_config()
+    supervisor = MistBuddySupervisor(config, connection=connection)
+
+    data = config.model_dump(mode="json")
+    data["tents_settings"]["tent_one"]["MistBuddies"]["mistbuddy_2"]["cycle_period"] = 30.0
+    data["tents_settings"]["tent_three"] = data["tents_settings"].pop("tent_two")
+    path = tmp_path / "appconfig.yaml" # created by the first write below
+
+    async def main():
+        run = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.01)
+        for mistbuddy in ("mistbuddy_1", "mistbuddy_2"):
+            connection.deliver(f"cmnd/tent_one/{mistbuddy}/ONOFF", "10")
+        await asyncio.sleep(0.3) # debounce
+        before = dict(supervisor.controllers)
+        unchanged_task = before[("tent_one", "mistbuddy_1")].misting_task
+        phase = before[("tent_one", "mistbuddy_2")].running_phase()
+
+        watcher = ConfigWatcher(path, supervisor.apply_config)
+        path.write_text("tents_settings: [not, valid]\n")
+        assert not await watcher.check() # an invalid file keeps the running config
+        path.write_text(yaml.safe_dump(data))
+        assert await watcher.check()
+        await asyncio.sleep(0.01)
+
+        after = supervisor.controllers
+        assert set(after) == {("tent_one", "mistbuddy_1"), ("tent_one", "mistbuddy_2"), ("tent_three", "mistbuddy_1")}
+        # Untouched controller keeps its running cycle
+        assert after[("tent_one", "mistbuddy_1")] is before[("tent_one", "mistbuddy_1")]
+        assert after[("tent_one", "mistbuddy_1")].misting_task is unchanged_task
+        # Reconfigured controller is rebuilt and resumes misting
+        rebuilt = after[("tent_one", "mistbuddy_2")]
+        assert rebuilt is not before[("tent_one", "mistbuddy_2")]
+        assert rebuilt.cycle_period == 30.0 and rebuilt.is_misting() and rebuilt.active_duration == 10
+        assert rebuilt.schedule.phase == pytest.approx(phase % 30.0) # keeps its place in the cycle
+        assert len(connection.handlers["cmnd/tent_one/mistbuddy_2/ONOFF"]) == 1
+        # The removed tent let go of the connection (tent_three reuses its LightCheck); the new one runs
+        assert set(supervisor.light_states) == {"tent_one", "tent_three"}
+        assert connection.handlers["stat/snifferbuddy/tent_two/sunshine/RESULT"] == [supervisor.light_states["tent_three"]._on_response]
+        assert after[("tent_three", "mistbuddy_1")].loop is not None
+
+        supervisor.stop()
+        await asyncio.wait_for(run, 2.0)
+
+    asyncio.run(main())
+
+
+def test_supervisor_without_controllers_waits_for_the_config_file(tmp_path):
+    data = make_config().model_dump(mode="json")
+    data["supervisor_settings"] = {"config_reload_interval": 0.01}
+    empty = dict(data, tents_settings={})
+    path = tmp_path / "appconfig.yaml"
+    path.write_text(yaml.safe_dump(empty))
+    supervisor = MistBuddySupervisor(AppConfig(**empty), connection=FakeConnection(), config_path=path)
+
+    async def main():
+        run = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.05)
+        assert not run.done()
+        path.write_text(yaml.safe_dump(data))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if supervisor.controllers:
+                break
+        supervisor.stop()
+        await asyncio.wait_for(run, 2.0)
+
+    asyncio.run(main())
+    assert len(supervisor.controllers) == 3
+
+
+def test_single_mode_passes_the_buddy_settings():
+    from src.app import build_single_buddy
+
+    data = make_config().model_dump(mode="json")
+    data["tents_settings"]["tent_one"]["MistBuddies"]["mistbuddy_2"].update(
+        deadline_grace=5.0, cycle_period=30.0, cycle_phase=10.0)
+    connection = FakeConnection()
+    buddy = build_single_buddy(AppConfig(**data), "tent_one", "mistbuddy_2", connection=connection)
+
+    assert buddy.connection is connection
+    assert buddy.control_topic == "cmnd/tent_one/mistbuddy_2/ONOFF"
+    assert (buddy.cycle_period, buddy.cycle_phase, buddy.deadline_grace) == (30.0, 10.0, 5.0)
+    with pytest.raises(KeyError):
+        build_single_buddy(AppConfig(**data), "tent_two", "mistbuddy_2", connection=FakeConnection())
@@ -0,0 +1,65 @@
+import pytest
+
+from src.topic_router import TopicRouter
+
+
+def recorder(calls, name):
+    return lambda topic, payload: calls.append((name, topic, payload))
+
+
+def test_exact_topics_dispatch_and_count():
+    router = TopicRouter()
+    calls = []
+    assert router.add("cmnd/tent_one/mistbuddy_1/ONOFF", recorder(calls, "mb1")) is True
+    assert router.add("cmnd/tent_one/mistbuddy_2/ONOFF", recorder(calls, "mb2")) is True
+
+    assert router.dispatch("cmnd/tent_one/mistbuddy_2/ONOFF", "15") == 1
+    assert router.dispatch("cmnd/tent_one/mistbuddy_9/ONOFF", "15") == 0
+    assert calls == [("mb2", "cmnd/tent_one/mistbuddy_2/ONOFF", "15")]
+    assert router.message_counts == {"cmnd/tent_one/mistbuddy_2/ONOFF": 1}
+    assert router.unmatched_count == 1
+
+
+@pytest.mark.parametrize("topic_filter, topic, matches", [
+    ("stat/+/RESULT", "stat/fan/RESULT", True),
+    ("stat/+/RESULT", "stat/fan/mister/RESULT", False),
+    ("tele/#", "tele", True),
+    ("tele/#", "tele/snifferbuddy/tent_one/SENSOR", True),
+    ("+/+", "cmnd/POWER", True),
+    ("#", "$SYS/broker/uptime", False),
+    ("+/broker/uptime", "$SYS/broker/uptime", False),
+    ("$SYS/#", "$SYS/broker/uptime", True),
+])
+def test_wildcard_matching(topic_filter, topic, matches):
+    router = TopicRouter()
+    calls = []
+    router.add(topic_filter, recorder(calls, "w"))
+    assert bool(router.match(topic)) is matches
+
+
+def test_exact_and_wildcard_handlers_both_run():
+    router = TopicRouter()
+    calls = []
+    router.add("stat/tent_one/mistbuddy_1/fan/RESULT", recorder(calls, "exact"))
+    router.add("stat/tent_one/+/+/RESULT", recorder(calls, "plus"))
+    router.add("stat/#", recorder(calls, "hash"))
+    router.dispatch("stat/tent_one/mistbuddy_1/fan/RESULT", "{}")
+    assert sorted(name for name, _, _ in calls) == ["exact", "hash", "plus"]
+
+
+def test_remove_reports_last_handler():
+    router = TopicRouter()
+    first, second = recorder([], "a"), recorder([], "b")
+    router.add("stat/+/RESULT", first)
+    assert router.add("stat/+/RESULT", second) is False
+    assert router.remove("stat/+/RESULT", first) is False
+    assert router.remove("stat/+/RESULT", second) is True
+    assert router.filters() == []
+    assert router.match("stat/fan/RESULT") == []
+
+
+def test_invalid_filters_are_rejected():
+    router = TopicRouter()
+    for bad in ("stat/#/RESULT", "stat/fan+/RESULT", "stat/x#"):
+        with pytest.raises(ValueError):
+            router.add(bad, recorder([], "x"))
@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+from src.tracing import Tracer, activate, span
+from tests.fakes import LIGHT_CHECK, FakeConnection, make_buddy
+
+
+class SnifferConnection(FakeConnection):
+    """Answers every light query with 'lights on', as the snifferbuddy would."""
+
+    def publish_nowait(self, topic, payload, qos=1, ttl=None, queue=True, retain=False):
+        future = super().publish_nowait(topic, payload, qos, ttl, queue, retain)
+        if topic == LIGHT_CHECK.light_on_query_topic:
+            asyncio.get_running_loop().call_soon(
+                self.deliver, LIGHT_CHECK.light_on_response_topic, json.dumps({"Mem1": 1}))
+        return future
+
+
+def names(trace):
+    return [child["name"] for child in trace.get("children", [])]
+
+
+def test_first_cycle_is_traced_from_onoff_to_power_publish():
+    connection = SnifferConnection()
+    tracer = Tracer()
+
+    async def scenario():
+        buddy = make_buddy(connection, tracer=tracer, cycle_period=2.0, control_debounce=0.01, cache_pulsetime=False)
+        run = asyncio.create_task(buddy.run())
+        await asyncio.sleep(0)
+        connection.deliver(buddy.control_topic, "1")
+        await asyncio.sleep(0.2) # the first deadline is immediate
+        buddy.stop()
+        await run
+
+    asyncio.run(scenario())
+    first = tracer.query(name="cycle")[0]
+    assert first["outcome"] == "fired"
+    assert names(first) == ["onoff_debounce", "command_lock", "start_misting", "deadline_wait", "light_check", "power_on"]
+    light_check = first["children"][4]
+    assert light_check["attrs"] == {"tent": LIGHT_CHECK.light_on_query_topic, "source": "query", "lights_on": True}
+    assert names(light_check) == ["light_query_publish", "result_wait"]
+    pulse = first["children"][5]["children"][0]
+    assert names(pulse) == ["publish PulseTime", "publish POWER"]
+    # Offsets grow along the cycle
+    offsets = [child["offset_ms"] for child in first["children"]]
+    assert offsets == sorted(offsets)
+
+
+def test_tracer_query_rotation_and_mqtt_queries(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(capacity=3, path=str(path), max_bytes=1, backup_count=1)
+    for outcome in ("fired", "failed", "fired", "skipped"):
+        root = tracer.start_trace("cycle", controller="cmnd/a/ONOFF")
+        with activate(root):
+            with span("light_check") as step:
+                step.attrs["source"] = "cache"
+        tracer.record(root, outcome)
+
+    assert len(tracer.traces) == 3 # ring buffer
+    assert [t["outcome"] for t in tracer.query(outcome="fired")] == ["fired"]
+    # Every write after the first rotated the file
+    tracer.close()
+    assert len(path.read_text().splitlines()) == 1 and (tmp_path / "traces.jsonl.1").exists()
+
+    connection = FakeConnection()
+    tracer.serve(connection, "mistbuddy/traces/query", "mistbuddy/traces/result")
+
+    async def ask():
+        connection.deliver("mistbuddy/traces/query", '{"limit": 1}')
+
+    asyncio.run(ask())
+    topic, payload = connection.published[0]
+    assert topic == "mistbuddy/traces/result"
+    assert [t["outcome"] for t in json.loads(payload)] == ["skipped"]
+
+
+def test_span_is_a_no_op_without_a_trace():
+    with span("light_check") as step:
+        assert step is None
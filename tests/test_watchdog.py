@@ -0,0 +1,49 @@
+import asyncio
+import json
+import time
+
+from src import metrics
+from src.watchdog import LoopWatchdog
+from tests.fakes import FakeConnection
+
+
+def blocking_step():
+    time.sleep(0.3) # synchronous work inside a coroutine
+
+
+def test_watchdog_reports_stack_of_blocking_call(tmp_path):
+    connection = FakeConnection()
+    log_file = tmp_path / "watchdog.jsonl"
+    watchdog = LoopWatchdog(threshold=0.1, interval=0.02, log_file=str(log_file),
+                            connection=connection, topic="mistbuddy/diagnostics")
+
+    async def scenario():
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        blocking_step()
+        await asyncio.sleep(0.05)
+        blocking_step() # second stall within min_report_interval is only counted
+        await asyncio.sleep(0.05)
+        watchdog.stop()
+
+    stalls_before = metrics.LOOP_STALLS.labels().value
+    asyncio.run(scenario())
+    assert watchdog.stalls == 2
+    assert metrics.LOOP_STALLS.labels().value - stalls_before == 2 # counted on the loop once it was free
+    assert len(watchdog.reports) == 1 and watchdog.suppressed == 1
+    assert "blocking_step" in watchdog.reports[0]["stack"]
+    assert json.loads(log_file.read_text())["blocked_for"] >= 0.1
+    assert connection.published[0][0] == "mistbuddy/diagnostics"
+
+
+def test_watchdog_is_quiet_on_a_responsive_loop():
+    watchdog = LoopWatchdog(threshold=0.1, interval=0.02)
+
+    async def scenario():
+        watchdog.start()
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+        watchdog.stop()
+
+    asyncio.run(scenario())
+    assert watchdog.stalls == 0